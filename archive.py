@@ -0,0 +1,123 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+
+import config
+
+# Formats that are already compressed gain nothing from deflating, so they are stored as-is.
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp4', '.webm', '.ogg', '.mov', '.avi',
+                     '.mp3', '.zip', '.gz'}
+
+# Every member gets the same timestamp, so identical content always produces
+# identical archive bytes (and therefore the same content hash).
+FIXED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+def spooled_file():
+    """Returns a temporary file kept in memory until it grows past ARCHIVE_SPILL_BYTES."""
+    return tempfile.SpooledTemporaryFile(max_size=config.ARCHIVE_SPILL_BYTES, dir=config.SPOOL_DIR)
+
+class ArchiveBuilder:
+    """
+    Builds a zip archive as the scrape runs, instead of writing files to a
+    folder and zipping them afterwards.
+
+    The archive lives in memory and only spills to a temporary file on disk
+    once it exceeds ARCHIVE_SPILL_BYTES. Members are stored or deflated
+    depending on their type, and all members sit inside a folder named after
+    root, like the archives made from scrape folders used to. Adding members
+    is thread-safe, so parallel downloads can feed the same archive.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.filename = f"{root}.zip"
+        self._file = spooled_file()
+        self._zip = zipfile.ZipFile(self._file, 'w')
+        self._names = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self.streamed_bytes = 0 # Uncompressed bytes added through write_stream (i.e. downloaded)
+
+    def _info(self, name):
+        """Returns the ZipInfo for a new member, choosing stored or deflated by extension."""
+        info = zipfile.ZipInfo(f"{self.root}/{name}", date_time=FIXED_DATE_TIME)
+        if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+            info.compress_type = zipfile.ZIP_STORED
+        else:
+            info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+
+    def writestr(self, name, data):
+        """Adds a member from a string or bytes."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self._lock:
+            self._zip.writestr(self._info(name), data)
+            self._names.append(name)
+
+    def write_stream(self, name, fileobj):
+        """
+        Adds a member by copying a readable file object in chunks.
+        Returns False if the archive was already finished.
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            info = self._info(name)
+            with self._zip.open(info, 'w') as member:
+                shutil.copyfileobj(fileobj, member, 64 * 1024)
+            self._names.append(name)
+            self.streamed_bytes += info.file_size
+            return True
+
+    def has(self, name):
+        """Returns True if a member with this name was added."""
+        with self._lock:
+            return name in self._names
+
+    def names(self):
+        """Returns the names of all members added so far."""
+        with self._lock:
+            return list(self._names)
+
+    def finish(self):
+        """Writes the zip directory. No members can be added afterwards."""
+        with self._lock:
+            if not self._closed:
+                self._zip.close()
+                self._closed = True
+        return self
+
+    @property
+    def size(self):
+        """Size of the archive in bytes (call after finish())."""
+        self._file.seek(0, os.SEEK_END)
+        return self._file.tell()
+
+    def open(self):
+        """Returns the finished archive as a file object positioned at the start."""
+        self.finish()
+        self._file.seek(0)
+        return self._file
+
+    def content_hash(self):
+        """Returns the SHA-256 hex digest of the finished archive."""
+        digest = hashlib.sha256()
+        f = self.open()
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+        f.seek(0)
+        return digest.hexdigest()
+
+    def save(self, path):
+        """Writes the finished archive to path."""
+        with open(path, "wb") as out:
+            shutil.copyfileobj(self.open(), out, 1024 * 1024)
+
+    def close(self):
+        """Discards the archive and frees its memory or temporary file."""
+        self.finish()
+        self._file.close()
@@ -0,0 +1,92 @@
+# Runs scrape jobs and deliveries on a single asyncio event loop, so one
+# process can have hundreds of scrapes and uploads in flight without a thread
+# for each. Scrapes await scraper.scrape_data_async directly, and the blocking
+# database and disk calls run on threads. Like worker.py it shares the job
+# store with bot.py, which keeps handling commands, for example:
+#     SCRAPE_WORKERS=0 python bot.py & python async_bot.py --jobs 200
+import argparse
+import asyncio
+import signal
+
+from telebot.async_telebot import AsyncTeleBot
+
+import config
+from fetcher import create_session
+from job_queue import open_job_store, AsyncJobRunner
+from instrument import span, trace_job, serve_metrics
+from pipeline import (users, result_cache, check_allowed, job_target, build_batch_result, scraped_result,
+                      ScrapeOutcome)
+from result_cache import cache_key
+from scraper import scrape_data_async
+from delivery import prepare_parts, send_parts_async, close_parts, delivery_message, DeliveryError
+
+async def send_zip_async(bot, chat_id, result, source_key=None, filename=None):
+    """Async counterpart of utils.send_zip, splitting large results and reusing stored file_ids the same way."""
+    # Hashing and splitting read the whole archive, so they run on a thread.
+    parts = await asyncio.to_thread(prepare_parts, result, filename, source_key)
+    try:
+        failed = await send_parts_async(bot, chat_id, parts)
+    finally:
+        close_parts(parts)
+    if failed:
+        raise DeliveryError(parts, failed)
+    await bot.send_message(chat_id, delivery_message(parts))
+
+async def run_scrape_job_async(bot, session, job):
+    """Async counterpart of pipeline.run_scrape_job."""
+    with trace_job(job.get('id'), user_id=job['user_id'], batch=bool(job.get('urls'))), span('job'):
+        await _run_scrape_job_async(bot, session, job)
+
+async def _run_scrape_job_async(bot, session, job):
+    check_allowed(await asyncio.to_thread(users.get, job['user_id']))
+    await bot.send_message(job['chat_id'], "⏳ Scraping started... This might take a moment.")
+    outcome = ScrapeOutcome()
+    target, options, filename = job_target(job)
+
+    async def build():
+        outcome.missed()
+        if job.get('urls'):
+            # Batches use the crawler's per-domain scheduler, which runs on threads.
+            return outcome.built(*await asyncio.to_thread(build_batch_result, target, options))
+        archive = await scrape_data_async(session, target, only=options['only'], fmt=options['format'])
+        return outcome.built(*scraped_result(archive))
+
+    try:
+        key = cache_key(target, options)
+        result, cached = await result_cache.get_or_build_async(key, build)
+        try:
+            await send_zip_async(bot, job['chat_id'], result, source_key=key, filename=filename)
+        finally:
+            # Cached archives stay on disk for the next request; fresh ones are discarded.
+            if not cached:
+                result.close()
+    except Exception as e:
+        outcome.failed(e)
+        raise
+    finally:
+        await asyncio.to_thread(outcome.record)
+
+async def main(max_jobs):
+    # Only messages and files are sent from here; updates are still polled by bot.py.
+    bot = AsyncTeleBot(config.BOT_TOKEN)
+    session = create_session()
+    runner = AsyncJobRunner(open_job_store(), lambda job: run_scrape_job_async(bot, session, job), max_jobs)
+
+    if config.METRICS_PORT:
+        serve_metrics(config.METRICS_PORT)
+
+    # On shutdown, stop claiming new jobs and let the running ones finish.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, runner.stop)
+    print(f"Async scrape runner started with up to {max_jobs} concurrent job(s).")
+    try:
+        await runner.run()
+    finally:
+        await session.close()
+        await bot.close_session()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run ScrapNest scrape jobs on one asyncio event loop.")
+    parser.add_argument('--jobs', type=int, default=config.ASYNC_MAX_JOBS,
+                        help="Maximum number of scrape jobs in flight at once.")
+    args = parser.parse_args()
+    asyncio.run(main(args.jobs))
@@ -0,0 +1,339 @@
+# Benchmark for the scrape-and-deliver pipeline that needs neither the internet
+# nor Telegram. Generated pages (of varying size, media count and latency) are
+# served from a local HTTP server, and jobs go through pipeline.run_scrape_job
+# with a stub bot that records and drains every send_document, for example:
+#     python benchmark.py --jobs 60 --workers 4 --json results.json
+#     python benchmark.py --jobs 60 --workers 4 --baseline results.json
+# Without --cache the result and HTTP caches are off, so every job does the full work.
+# With --startup N it instead starts bot.py N times against fake_telegram.py and
+# times how long it takes to import and to answer a /start waiting in getUpdates:
+#     python benchmark.py --startup 5 --json startup.json
+import argparse
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+# The bot modules refuse to load without these; nothing is sent to Telegram.
+os.environ.setdefault("BOT_TOKEN", "123456:benchmark")
+os.environ.setdefault("ADMIN_ID", "1")
+
+# Page profiles the jobs are drawn from: (name, weight, HTML KB, images, videos,
+# asset KB, server latency in ms).
+PROFILES = [
+    ('small', 5, 20, 2, 0, 30, 20),
+    ('medium', 3, 150, 5, 1, 200, 80),
+    ('large', 1, 600, 5, 3, 1500, 200),
+]
+
+class FixtureServer:
+    """
+    A local HTTP server for generated pages. /page/<seed>?kb=&images=&videos=&asset_kb=&delay=
+    returns an HTML page with that many images and videos, all of them
+    /asset/... URLs served with the same delay. Bytes served are counted.
+    """
+
+    def __init__(self, port=0):
+        self.bytes_served = 0
+        self._lock = threading.Lock()
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = {key: int(values[0]) for key, values in parse_qs(url.query).items()}
+                time.sleep(params.get('delay', 0) / 1000)
+                if url.path.startswith('/page/'):
+                    body = fixture._page(url.path.rsplit('/', 1)[-1], params)
+                    content_type = 'text/html; charset=utf-8'
+                elif url.path.startswith('/asset/'):
+                    # Random bytes, so compression cannot make the archive unrealistically small.
+                    body = random.Random(url.path).randbytes(params.get('kb', 10) * 1024)
+                    content_type = 'video/mp4' if url.path.endswith('.mp4') else 'image/jpeg'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with fixture._lock:
+                    fixture.bytes_served += len(body)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @staticmethod
+    def _page(seed, params):
+        """Builds an HTML page of about kb KB with prices, headlines, tables and media."""
+        query = f"kb={params.get('asset_kb', 10)}&delay={params.get('delay', 0)}"
+        parts = [f"<html><head><title>Fixture {seed}</title>"
+                 f"<meta name='description' content='Benchmark page {seed}'></head><body>"]
+        parts += [f"<img src='/asset/{seed}-{i}.jpg?{query}'>" for i in range(params.get('images', 0))]
+        parts += [f"<video src='/asset/{seed}-{i}.mp4?{query}'></video>" for i in range(params.get('videos', 0))]
+        filler = (f"<h2>Headline {seed}</h2><p>Only $19.99 today, was $24.99. Lorem ipsum dolor sit amet, "
+                  "consectetur adipiscing elit.</p><table><tr><th>Item</th><th>Price</th></tr>"
+                  "<tr><td>Widget</td><td>$5.00</td></tr></table>")
+        target = params.get('kb', 10) * 1024
+        size = sum(len(part) for part in parts)
+        while size < target:
+            parts.append(filler)
+            size += len(filler)
+        parts.append("</body></html>")
+        return "".join(parts).encode('utf-8')
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+class StubBot:
+    """
+    Stands in for telebot.TeleBot in run_scrape_job. send_document reads the
+    whole file, like an upload would, and records its size.
+    """
+
+    def __init__(self):
+        self.documents = []
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        return SimpleNamespace(message_id=0)
+
+    def send_document(self, chat_id, document, visible_file_name=None, **kwargs):
+        size = 0
+        if not isinstance(document, str): # A str is a file_id being reused
+            for chunk in iter(lambda: document.read(1024 * 1024), b""):
+                size += len(chunk)
+        with self._lock:
+            self.documents.append({'chat_id': chat_id, 'filename': visible_file_name, 'bytes': size})
+            file_id = f"stub-{len(self.documents)}"
+        return SimpleNamespace(message_id=0, document=SimpleNamespace(file_id=file_id))
+
+def make_jobs(base_url, count, seed):
+    """Returns count scrape jobs for generated pages, drawn from PROFILES by weight."""
+    rng = random.Random(seed)
+    weights = [profile[1] for profile in PROFILES]
+    jobs = []
+    for i in range(count):
+        name, _, kb, images, videos, asset_kb, delay = rng.choices(PROFILES, weights)[0]
+        url = (f"{base_url}/page/{i}?kb={kb}&images={images}&videos={videos}"
+               f"&asset_kb={asset_kb}&delay={delay}")
+        jobs.append({'id': i + 1, 'user_id': 1000 + i, 'chat_id': 1000 + i, 'keyword': url, 'profile': name})
+    return jobs
+
+def percentile(values, q):
+    """Returns the q-th percentile (0-100) of values by the nearest-rank method."""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+def run(jobs_count, workers, seed, cache):
+    """Runs the benchmark and returns its results as a dict."""
+    workdir = tempfile.mkdtemp(prefix='scrapnest-bench-')
+    # Everything the pipeline stores goes into the temporary directory.
+    os.environ['DB_PATH'] = os.path.join(workdir, 'bench.db')
+    os.environ['RESULT_CACHE_DIR'] = os.path.join(workdir, 'result_cache')
+    os.environ['HTTP_CACHE_DIR'] = os.path.join(workdir, 'http_cache')
+    # Every generated page lives on the same host, which stands in for many websites.
+    os.environ.setdefault('HOST_RATE', '1000')
+    os.environ.setdefault('HOST_BURST', '1000')
+    if not cache:
+        os.environ['RESULT_CACHE_TTL'] = '0'
+        os.environ['HTTP_CACHE_MAX_BYTES'] = '0'
+    import pipeline # Imported only now, so config picks up the settings above
+
+    fixture = FixtureServer().start()
+    bot = StubBot()
+    jobs = make_jobs(fixture.base_url, jobs_count, seed)
+    for job in jobs:
+        pipeline.users.get_or_create(job['user_id'])
+
+    latencies = {}
+    failures = []
+
+    def timed(job):
+        started = time.perf_counter()
+        try:
+            pipeline.run_scrape_job(bot, job)
+        except Exception as e:
+            failures.append(f"job {job['id']}: {e}")
+        latencies[job['id']] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(timed, jobs))
+    elapsed = time.perf_counter() - started
+    fixture.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    all_latencies = list(latencies.values())
+    by_profile = {}
+    for job in jobs:
+        by_profile.setdefault(job['profile'], []).append(latencies[job['id']])
+    return {
+        'jobs': jobs_count,
+        'workers': workers,
+        'seed': seed,
+        'cache': cache,
+        'seconds': round(elapsed, 3),
+        'jobs_per_second': round(jobs_count / elapsed, 3),
+        'latency': {f"p{q}": round(percentile(all_latencies, q), 3) for q in (50, 95, 99)},
+        'latency_by_profile': {name: {'jobs': len(values), 'p50': round(percentile(values, 50), 3),
+                                      'p95': round(percentile(values, 95), 3)}
+                               for name, values in sorted(by_profile.items())},
+        # ru_maxrss is in kilobytes on Linux (and bytes on macOS).
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                             / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+        'bytes_served': fixture.bytes_served,
+        'bytes_sent': sum(document['bytes'] for document in bot.documents),
+        'documents': len(bot.documents),
+        'failures': failures,
+    }
+
+def run_startup(runs):
+    """
+    Starts the polling bot runs times, each time with a fresh fake Telegram
+    holding one /start update, and returns the medians of: starting an empty
+    interpreter, importing bot, the first getUpdates call and the reply to
+    /start, all in seconds since the process was started.
+    """
+    from fake_telegram import FakeTelegram, make_update
+
+    workdir = tempfile.mkdtemp(prefix='scrapnest-startup-')
+    # One database for all runs, as a restarted bot would find it.
+    env = dict(os.environ, DB_PATH=os.path.join(workdir, 'startup.db'), PORT='0', WEBHOOK_URL='')
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    timings = {'interpreter': [], 'import': [], 'first_poll': [], 'first_reply': []}
+    failures = []
+
+    def timed_run(code):
+        started = time.monotonic()
+        subprocess.run([sys.executable, '-c', code], env=env, cwd=cwd, check=True,
+                       stdout=subprocess.DEVNULL)
+        return time.monotonic() - started
+
+    for run_number in range(1, runs + 1):
+        timings['interpreter'].append(timed_run('pass'))
+        timings['import'].append(timed_run('import bot'))
+
+        telegram = FakeTelegram().serve()
+        telegram.queue_update(make_update(1, 42, "/start"))
+        launcher = (f"from telebot import apihelper; apihelper.API_URL = {telegram.api_url!r}; "
+                    "import runpy; runpy.run_path('bot.py', run_name='__main__')")
+        started = time.monotonic()
+        process = subprocess.Popen([sys.executable, '-c', launcher], env=env, cwd=cwd,
+                                   stdout=subprocess.DEVNULL)
+        while 'sendMessage' not in telegram.first_calls and process.poll() is None \
+                and time.monotonic() - started < 60:
+            time.sleep(0.005)
+        process.kill()
+        process.wait()
+        telegram.server.shutdown()
+        if 'sendMessage' not in telegram.first_calls:
+            failures.append(f"run {run_number}: the bot did not answer /start")
+            continue
+        timings['first_poll'].append(telegram.first_calls['getUpdates'] - started)
+        timings['first_reply'].append(telegram.first_calls['sendMessage'] - started)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {'runs': runs}
+    results.update({f"{name}_seconds": round(percentile(values, 50), 3) for name, values in timings.items()})
+    results['failures'] = failures
+    return results
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regressions of results against baseline beyond tolerance (a fraction)."""
+    regressions = []
+    # (key, lower is better); only keys both results have are compared, so
+    # pipeline and --startup results can each be checked against their own kind.
+    keys = [('jobs_per_second', False), ('peak_rss_mb', True), ('bytes_sent', True),
+            ('import_seconds', True), ('first_poll_seconds', True), ('first_reply_seconds', True)]
+    checks = [(key, results[key], baseline[key], lower_is_better)
+              for key, lower_is_better in keys if key in results and key in baseline]
+    checks += [(f"latency {name}", results['latency'][name], baseline['latency'][name], True)
+               for name in baseline.get('latency', {}) if name in results.get('latency', {})]
+    for name, current, previous, lower_is_better in checks:
+        if not previous:
+            continue
+        change = (current - previous) / previous
+        if (change > tolerance) if lower_is_better else (change < -tolerance):
+            regressions.append(f"{name}: {previous} -> {current} ({change:+.0%})")
+    return regressions
+
+def report(results):
+    print(f"{results['jobs']} jobs on {results['workers']} worker(s) in {results['seconds']}s: "
+          f"{results['jobs_per_second']} jobs/s")
+    print("Latency: " + ", ".join(f"{name} {value}s" for name, value in results['latency'].items()))
+    for name, values in results['latency_by_profile'].items():
+        print(f"  {name:<7} {values['jobs']:>4} jobs, p50 {values['p50']}s, p95 {values['p95']}s")
+    print(f"Peak RSS: {results['peak_rss_mb']} MB")
+    print(f"Bytes served: {results['bytes_served']}, bytes sent to Telegram: {results['bytes_sent']} "
+          f"in {results['documents']} document(s)")
+    for failure in results['failures']:
+        print(f"Failed: {failure}")
+
+def report_startup(results):
+    print(f"Median of {results['runs']} start(s): interpreter {results['interpreter_seconds']}s, "
+          f"import bot {results['import_seconds']}s")
+    print(f"First getUpdates after {results['first_poll_seconds']}s, "
+          f"reply to /start after {results['first_reply_seconds']}s")
+    for failure in results['failures']:
+        print(f"Failed: {failure}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the ScrapNest scrape-and-deliver pipeline offline.")
+    parser.add_argument('--jobs', type=int, default=40, help="Number of scrape jobs to run.")
+    parser.add_argument('--workers', type=int, default=2, help="Number of jobs running at once.")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the mix of generated pages.")
+    parser.add_argument('--cache', action='store_true', help="Keep the result and HTTP caches enabled.")
+    parser.add_argument('--startup', type=int, metavar='RUNS',
+                        help="Measure the bot's start-up this many times instead of running jobs.")
+    parser.add_argument('--json', metavar='PATH', help="Also write the results to this JSON file.")
+    parser.add_argument('--baseline', metavar='PATH', help="Compare with results saved earlier with --json.")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Relative change counted as a regression (default 0.2, i.e. 20%%).")
+    args = parser.parse_args()
+
+    if args.startup:
+        results = run_startup(args.startup)
+        report_startup(results)
+    else:
+        results = run(args.jobs, args.workers, args.seed, args.cache)
+        report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    failed = bool(results['failures'])
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if not regressions:
+            print("No regressions against the baseline.")
+        failed = failed or bool(regressions)
+    # The pipeline's pool threads keep running; exit without waiting for them.
+    sys.stdout.flush()
+    os._exit(1 if failed else 0)
@@ -1,47 +1,46 @@
+import time
+STARTED = time.perf_counter() # For the startup timings below; set before the other imports
+
+import math
 import telebot
-import os
-import json # For JSON file persistence
-from scraper import scrape_data
-from utils import zip_and_send
+import threading
+from urllib.parse import urlparse
 from payment import verify_payment
-from keep_alive import keep_alive
+from job_queue import open_job_store, WorkerPool, QueueFullError, UserLimitError
+from storage import UserStore
+from stats import StatsStore, latency_label
+from broadcast import BroadcastEngine
+from ratelimit import TokenBucket, KeyedLimiter
+from instrument import registry, span
 import config # Import config variables
 from functools import wraps # For decorator
 
+# The scrape pipeline (scraper, crawler, pipeline) and Flask (keep_alive) are
+# imported where they are first used rather than here, so the bot starts
+# receiving updates without waiting for them. See preload().
+
 # --- Constants & Initialization ---
-USER_DATA_FILE = 'user_data.json' # File to store user data persistently
+USER_DATA_FILE = 'user_data.json' # Old user data file, imported into the database once
 
-# Initialize the Telegram bot with token from config
-bot = telebot.TeleBot(config.BOT_TOKEN)
+# Initialize the Telegram bot with token from config.
+# Handlers run on BOT_THREADS worker threads, in polling and webhook mode alike.
+bot = telebot.TeleBot(config.BOT_TOKEN, num_threads=config.BOT_THREADS)
 
-# Dictionary to store user-specific data (e.g., remaining uses, ban status)
-# This will be loaded from and saved to a JSON file.
-user_data = {}
+# Per-user data (remaining uses, ban status) lives in the SQLite database.
+# Records are read and updated one user at a time, never loaded or saved as a whole.
+users = UserStore()
+stats_store = StatsStore()
 
-# --- User Data Persistence Functions ---
-def load_user_data():
-    """Loads user data from a JSON file."""
-    global user_data
-    if os.path.exists(USER_DATA_FILE):
-        try:
-            with open(USER_DATA_FILE, 'r') as f:
-                loaded_data = json.load(f)
-                # Convert string keys back to int if they represent user IDs
-                user_data = {int(k): v for k, v in loaded_data.items()}
-            print(f"Loaded user data from {USER_DATA_FILE}")
-        except json.JSONDecodeError:
-            print(f"Error decoding JSON from {USER_DATA_FILE}. Starting with empty data.")
-            user_data = {}
-    else:
-        print(f"No {USER_DATA_FILE} found. Starting with empty user data.")
-        user_data = {}
+# Exported on the keep-alive server's /metrics route, next to the scrape stage timings.
+JOBS_QUEUED = registry.counter('scrapnest_jobs_queued_total', "Scrape requests, by whether they were queued or refused.")
+JOBS_FINISHED = registry.counter('scrapnest_jobs_finished_total', "Finished scrape jobs reported to users, by status.")
+STARTUP_SECONDS = registry.gauge('scrapnest_startup_seconds',
+                                 "Seconds from the start of bot.py until its imports were done ('imports'), "
+                                 "it was ready for updates ('ready') and the first update arrived ('first_update').")
 
-def save_user_data():
-    """Saves user data to a JSON file."""
-    with open(USER_DATA_FILE, 'w') as f:
-        # Convert integer keys to strings for JSON serialization
-        json.dump({str(k): v for k, v in user_data.items()}, f, indent=4)
-    print(f"Saved user data to {USER_DATA_FILE}")
+# Scrape requests are rate limited per user and overall, on top of the job queue's limits.
+user_limits = KeyedLimiter(1 / config.USER_SCRAPE_INTERVAL, config.USER_SCRAPE_BURST)
+scrape_limit = TokenBucket(config.GLOBAL_SCRAPE_RATE, config.GLOBAL_SCRAPE_BURST)
 
 # --- Decorator for Admin-Only Commands ---
 def admin_only(func):
@@ -62,7 +61,7 @@ def start(message):
     bot.send_message(message.chat.id, "👋 Welcome to ScrapNest!\n\n"
                                       "🔎 Get data from web pages: images, videos, headlines, and prices.\n\n"
                                       "💰 You get 2 free uses. Pay ₹100 to get 15 uses.\n\n"
-                                      "Use /scrape to begin.\n"
+                                      "Use /scrape to begin, or /batch for several URLs at once.\n"
                                       "Use /uses_left to check your uses left.\n"
                                       "Use /help for more commands.\n"
                                       "Use /legal to view Privacy Policy.")
@@ -70,10 +69,15 @@ def start(message):
 @bot.message_handler(commands=['help'])
 def help_command(message):
     """Provides help instructions and lists commands."""
+    from extract import EXTRACTORS, GROUPS
     help_text = "📚 ScrapNest Bot Help:\n\n" \
                 "**User Commands:**\n" \
                 "/start - Welcome message and info.\n" \
                 "/scrape <keyword or URL> - Start a scraping task. (2 free uses, then 15 uses for ₹100)\n" \
+                f"  Options: `--only <names>` to pick extractors ({', '.join(list(EXTRACTORS) + list(GROUPS))}), " \
+                "`--format json|ndjson|csv` for the manifest file.\n" \
+                f"/batch <URL> <URL> ... - Scrape up to {config.BATCH_MAX_URLS} URLs for one use, returned in one zip.\n" \
+                f"  Options: as for /scrape, plus `--depth <0-{config.CRAWL_MAX_DEPTH}>` to also scrape linked pages on the same site.\n" \
                 "/uses_left - Check your remaining scraping uses.\n" \
                 "/confirm_payment <your PayPal email> - Confirm your payment after sending money.\n" \
                 "/legal - View privacy policy and legal notice.\n\n" \
@@ -100,33 +104,28 @@ def uses_left(message):
     """Handles the /uses_left command, showing the user's remaining uses."""
     uid = message.from_user.id
     # Initialize user data if not exists, default uses and not banned
-    if uid not in user_data:
-        user_data[uid] = {'uses': 2, 'banned': False}
-        save_user_data()
+    user = users.get_or_create(uid)
     
-    if user_data[uid]['banned']:
+    if user['banned']:
         bot.send_message(message.chat.id, "🚫 You are currently banned from using this bot.")
         return
 
-    balance = user_data[uid]['uses']
+    balance = user['uses']
     bot.send_message(message.chat.id, f"💳 You have {balance} uses left.")
 
-@bot.message_handler(commands=['scrape'])
-def handle_scrape(message):
-    """Initiates the scraping process, checking user uses and ban status first."""
+def can_scrape(message):
+    """Checks the user's ban status and remaining uses, replying if they cannot scrape."""
     uid = message.from_user.id
     
     # Initialize user data if not exists
-    if uid not in user_data:
-        user_data[uid] = {'uses': 2, 'banned': False}
-        save_user_data()
+    user = users.get_or_create(uid)
 
-    if user_data[uid]['banned']:
+    if user['banned']:
         bot.send_message(message.chat.id, "🚫 You are currently banned from using this bot.")
-        return
+        return False
 
     # Check if the user has any uses left
-    if user_data[uid]['uses'] <= 0:
+    if user['uses'] <= 0:
         payment_info = (
             f"💰 To get 15 more uses, please pay ₹100 using one of these methods:\n"
             f"- **PayPal Email:** `{config.PAYPAL_EMAIL}`\n"
@@ -135,40 +134,169 @@ def handle_scrape(message):
             f"After payment, send: `/confirm_payment <your PayPal email>` (or screenshot if needed for manual verification)."
         )
         bot.send_message(message.chat.id, payment_info, parse_mode='Markdown')
+        return False
+    return True
+
+@bot.message_handler(commands=['scrape'])
+def handle_scrape(message):
+    """Initiates the scraping process, checking user uses and ban status first."""
+    if not can_scrape(message):
         return
-    
+
+    from scraper import parse_scrape_request
+    # Options and the target can be given right away, e.g. `/scrape --only prices <URL>`
+    try:
+        target, options = parse_scrape_request(message.text)
+    except ValueError as e:
+        bot.send_message(message.chat.id, f"❌ {e}")
+        return
+    if target:
+        queue_scrape(message, target, options)
+        return
+
     # Prompt user for keyword or URL
     msg = bot.send_message(message.chat.id, "🔍 Send the keyword or URL you want to scrape.")
     # Register the next step handler to process the user's input
-    bot.register_next_step_handler(msg, process_scrape)
+    bot.register_next_step_handler(msg, process_scrape, options)
+
+def process_scrape(message, options=None):
+    """Handles the keyword/URL sent after /scrape, which may carry its own options."""
+    from scraper import parse_scrape_request
+    try:
+        target, options = parse_scrape_request(message.text or '', options)
+    except ValueError as e:
+        bot.send_message(message.chat.id, f"❌ {e} Please use /scrape again.")
+        return
+    if not target:
+        bot.send_message(message.chat.id, "❌ No keyword or URL given. Please use /scrape again.")
+        return
+    queue_scrape(message, target, options)
+
+def queue_scrape(message, keyword, options):
+    """Queues a keyword/URL for scraping and replies with its queue position."""
+    queue_job(message, {'keyword': keyword, 'only': options['only'], 'format': options['format']})
+
+@bot.message_handler(commands=['batch'])
+def handle_batch(message):
+    """Starts a batch scrape of several URLs, which costs one use for the whole batch."""
+    if not can_scrape(message):
+        return
+
+    from crawler import parse_batch_request
+    try:
+        urls, options = parse_batch_request(message.text)
+    except ValueError as e:
+        bot.send_message(message.chat.id, f"❌ {e}")
+        return
+    if urls:
+        queue_batch(message, urls, options)
+        return
+
+    msg = bot.send_message(message.chat.id, f"🔍 Send the URLs you want to scrape (up to {config.BATCH_MAX_URLS}), "
+                                            "separated by spaces or new lines.")
+    bot.register_next_step_handler(msg, process_batch, options)
+
+def process_batch(message, options=None):
+    """Handles the list of URLs sent after /batch, which may carry its own options."""
+    from crawler import parse_batch_request
+    try:
+        urls, options = parse_batch_request(message.text or '', options)
+    except ValueError as e:
+        bot.send_message(message.chat.id, f"❌ {e} Please use /batch again.")
+        return
+    if not urls:
+        bot.send_message(message.chat.id, "❌ No URLs given. Please use /batch again.")
+        return
+    queue_batch(message, urls, options)
+
+def queue_batch(message, urls, options):
+    """Queues a batch of URLs as a single job and replies with its queue position."""
+    queue_job(message, {'keyword': urlparse(urls[0]).netloc, 'urls': urls, 'depth': options['depth'],
+                        'only': options['only'], 'format': options['format']})
 
-def process_scrape(message):
-    """Processes the user's keyword/URL, initiates scraping, and sends results."""
+def queue_job(message, payload):
+    """Spends one use on a scrape job and queues it, replying with its queue position."""
     uid = message.from_user.id
-    keyword = message.text.strip()
-    
-    # Re-check uses and ban status before processing scrape to prevent abuse
-    if uid not in user_data or user_data[uid]['banned'] or user_data[uid]['uses'] <= 0:
+
+    # Requests over the user's or the bot's rate are turned away before any use is spent.
+    # Each token is taken atomically, so two requests at once cannot both get the
+    # last one, and both are given back below unless the job is queued.
+    if not user_limits.try_acquire(uid):
+        wait = user_limits.wait_time(uid)
+    elif not scrape_limit.try_acquire():
+        user_limits.refund(uid)
+        wait = scrape_limit.wait_time()
+    else:
+        wait = None
+    if wait is not None:
+        JOBS_QUEUED.inc(outcome='rate_limited')
+        bot.send_message(message.chat.id, f"⏳ Too many scrape requests right now. Try again in {max(math.ceil(wait), 1)} seconds.")
+        return
+
+    # Spend the use up front: the check and the decrement are one atomic update,
+    # so the same use cannot pay for two jobs. It is refunded if the job fails.
+    if users.try_use(uid) is None:
+        refund_rate(uid)
         bot.send_message(message.chat.id, "❌ Error: You are not authorized or have no uses left. Please use /uses_left or /scrape again.")
         return
 
-    bot.send_message(message.chat.id, "⏳ Scraping started... This might take a moment.")
-    
     try:
-        # Call the scrape_data function from scraper.py
-        scraped_folder_path = scrape_data(keyword)
-        
-        # Zip the folder and send it to the user
-        zip_and_send(bot, message.chat.id, scraped_folder_path)
-        
-        # Decrement user's uses after successful scrape
-        user_data[uid]['uses'] -= 1
-        save_user_data() # Save data after change
-        bot.send_message(message.chat.id, f"✅ Scraping complete! You have {user_data[uid]['uses']} uses left.")
-    except Exception as e:
-        # Catch any errors during scraping or sending and inform the user
-        bot.send_message(message.chat.id, f"❌ An error occurred during scraping: {e}")
-        print(f"Error in process_scrape for user {uid} with keyword '{keyword}': {e}")
+        with span('enqueue'):
+            position = job_store.enqueue(uid, message.chat.id, payload)
+    except (UserLimitError, QueueFullError) as e:
+        JOBS_QUEUED.inc(outcome='refused')
+        users.refund(uid)
+        refund_rate(uid)
+        bot.send_message(message.chat.id, f"⏳ {e} Please try again later.")
+        return
+    JOBS_QUEUED.inc(outcome='queued')
+
+    bot.send_message(message.chat.id, f"⏳ Your scrape is queued (position {position}). Results will be sent here when ready.")
+
+def refund_rate(uid):
+    """Gives back the rate tokens taken for a request that was not queued after all."""
+    user_limits.refund(uid)
+    scrape_limit.refund()
+
+def report_finished_jobs():
+    """
+    Runs in the background: picks up jobs finished by any worker, refunds the
+    use spent on failed ones and tells the user the outcome.
+    """
+    while True:
+        try:
+            for job in job_store.finished():
+                uid = job['user_id']
+                # Marked first, so a message that fails to send never refunds a job twice.
+                job_store.mark_reported(job['id'])
+                JOBS_FINISHED.inc(status=job['status'])
+                if job['status'] == 'done':
+                    # The use was already spent when the job was queued
+                    user = users.get(uid) or {'uses': 0}
+                    bot.send_message(job['chat_id'], f"✅ Scraping complete! You have {user['uses']} uses left.")
+                else:
+                    users.refund(uid)
+                    bot.send_message(job['chat_id'], f"❌ An error occurred during scraping: {job['error']}")
+                    print(f"Error in scrape job {job['id']} for user {uid} with keyword '{job['keyword']}': {job['error']}")
+        except Exception as e:
+            print(f"Error reporting finished jobs: {e}")
+        time.sleep(1)
+
+# Scrape jobs are stored durably, so pending jobs survive a restart. They are
+# run by the worker threads below and/or by separate worker.py processes.
+job_store = open_job_store()
+
+def run_job(job):
+    """Runs one scrape job on a worker thread."""
+    from pipeline import run_scrape_job
+    run_scrape_job(bot, job)
+
+scrape_workers = WorkerPool(job_store, run_job, workers=config.SCRAPE_WORKERS)
+
+# Admin announcements are sent in the background within Telegram's rate limits.
+broadcasts = BroadcastEngine(bot, users, workers=config.BROADCAST_WORKERS, rate=config.BROADCAST_RATE,
+                             per_chat_rate=config.BROADCAST_CHAT_RATE,
+                             progress_interval=config.BROADCAST_PROGRESS_INTERVAL)
 
 @bot.message_handler(commands=['confirm_payment']) # Renamed from /confirm
 def confirm_payment(message):
@@ -221,16 +349,13 @@ def grant_access(message):
             bot.send_message(message.chat.id, "Uses to grant must be positive.")
             return
 
-        if target_uid not in user_data:
-            user_data[target_uid] = {'uses': 0, 'banned': False} # Initialize if new user
-        
-        user_data[target_uid]['uses'] += uses_to_grant
-        save_user_data()
-        bot.send_message(message.chat.id, f"✅ Granted {uses_to_grant} uses to user ID `{target_uid}`. New balance: {user_data[target_uid]['uses']}.")
+        # Initializes the user with 0 uses if new
+        new_total = users.grant(target_uid, uses_to_grant)
+        bot.send_message(message.chat.id, f"✅ Granted {uses_to_grant} uses to user ID `{target_uid}`. New balance: {new_total}.")
         
         # Notify the target user
         try:
-            bot.send_message(target_uid, f"🎉 You have been granted {uses_to_grant} additional scraping uses! Your new total is {user_data[target_uid]['uses']}.")
+            bot.send_message(target_uid, f"🎉 You have been granted {uses_to_grant} additional scraping uses! Your new total is {new_total}.")
         except Exception as e:
             bot.send_message(message.chat.id, f"Warning: Could not notify user {target_uid}. Error: {e}")
 
@@ -240,42 +365,45 @@ def grant_access(message):
 @bot.message_handler(commands=['broadcast'])
 @admin_only
 def broadcast(message):
-    """Admin command: Sends a broadcast message to all users."""
+    """Admin command: Sends a broadcast message to all active users."""
     parts = message.text.split(maxsplit=1)
     if len(parts) < 2:
         bot.send_message(message.chat.id, "❌ Invalid format. Use: `/broadcast <your message>`")
         return
     
     broadcast_message = parts[1].strip()
-    sent_count = 0
-    failed_count = 0
-    
-    bot.send_message(message.chat.id, "Starting broadcast...")
-    for uid_str in user_data.keys(): # Iterate through all known user IDs
-        try:
-            uid = int(uid_str) # Ensure UID is int
-            bot.send_message(uid, f"📢 **Announcement from Admin:**\n{broadcast_message}", parse_mode='Markdown')
-            sent_count += 1
-        except Exception as e:
-            print(f"Failed to send broadcast to user {uid_str}: {e}")
-            failed_count += 1
-    
-    bot.send_message(message.chat.id, f"✅ Broadcast complete. Sent to {sent_count} users, failed for {failed_count} users.")
+    # Sending runs in the background at Telegram's rate limits and resumes after
+    # a restart; the admin gets a live progress message.
+    broadcasts.start(message.chat.id, broadcast_message)
 
 @bot.message_handler(commands=['stats'])
 @admin_only
 def stats(message):
     """Admin command: Displays bot usage statistics."""
-    total_users = len(user_data)
-    total_uses_granted = sum(data['uses'] for data in user_data.values())
-    banned_users = sum(1 for data in user_data.values() if data.get('banned', False)) # Use .get for safety
-    
+    # Every figure is a maintained counter or a few ring-buffer slots, so this
+    # costs the same however many users and jobs there are.
+    day = 24 * 3600
+    hits, misses = stats_store.recent('cache_hits', day), stats_store.recent('cache_misses', day)
+    hit_rate = f"{100 * hits / (hits + misses):.0f}%" if hits + misses else "n/a"
+    p50, p95 = stats_store.latency_percentile(50), stats_store.latency_percentile(95)
+    latency = f"{latency_label(p50)} / {latency_label(p95)}" if p50 is not None else "n/a"
+    failures = stats_store.recent_by_prefix('failure:', day)
+    failure_text = ", ".join(f"{name}: {count:.0f}" for name, count in sorted(failures.items())) or "none"
+    pending, running = job_store.stats()
+
     stats_text = (
         "📊 Bot Usage Statistics:\n"
-        f"👥 Total registered users: `{total_users}`\n"
-        f"💳 Total uses (remaining) across all users: `{total_uses_granted}`\n"
-        f"🚫 Banned users: `{banned_users}`\n\n"
-        "*(Note: Statistics are based on current loaded user data.)*"
+        f"👥 Total registered users: `{stats_store.total('users'):.0f}` "
+        f"(`{stats_store.recent('new_users', day):.0f}` new in 24h, `{stats_store.total('users_active'):.0f}` active)\n"
+        f"💳 Total uses (remaining) across all users: `{stats_store.total('uses_remaining'):.0f}`\n"
+        f"🚫 Banned users: `{stats_store.total('users_banned'):.0f}`\n\n"
+        f"🔎 Scrapes: `{stats_store.recent('scrapes', 3600):.0f}` last hour, `{stats_store.recent('scrapes', day):.0f}` "
+        f"last 24h, `{stats_store.recent('scrapes', 30 * day):.0f}` last 30 days\n"
+        f"❌ Failed (24h): `{stats_store.recent('scrapes_failed', day):.0f}` (`{failure_text}`)\n"
+        f"⏱ Latency p50/p95 (24h): `{latency}`\n"
+        f"♻️ Cache hit rate (24h): `{hit_rate}`\n"
+        f"📦 Downloaded (24h): `{stats_store.recent('downloaded_bytes', day) / 1024 / 1024:.1f} MB`\n"
+        f"📥 Queue: `{pending}` waiting, `{running}` running"
     )
     bot.send_message(message.chat.id, stats_text, parse_mode='Markdown')
 
@@ -294,12 +422,7 @@ def ban_user(message):
             bot.send_message(message.chat.id, "🚫 You cannot ban yourself.")
             return
 
-        if target_uid not in user_data:
-            user_data[target_uid] = {'uses': 0, 'banned': True} # Initialize as banned
-        else:
-            user_data[target_uid]['banned'] = True
-        
-        save_user_data()
+        users.set_banned(target_uid, True, create=True) # Initialize as banned if new
         bot.send_message(message.chat.id, f"✅ User ID `{target_uid}` has been banned.")
         try:
             bot.send_message(target_uid, "🚫 You have been banned from using this bot by the administrator.")
@@ -320,12 +443,10 @@ def unban_user(message):
     
     try:
         target_uid = int(parts[1])
-        if target_uid not in user_data:
+        if not users.set_banned(target_uid, False):
             bot.send_message(message.chat.id, f"User ID `{target_uid}` not found in records or not banned.")
             return
         
-        user_data[target_uid]['banned'] = False
-        save_user_data()
         bot.send_message(message.chat.id, f"✅ User ID `{target_uid}` has been unbanned.")
         try:
             bot.send_message(target_uid, "🎉 You have been unbanned by the administrator. You can now use the bot again.")
@@ -336,11 +457,84 @@ def unban_user(message):
         bot.send_message(message.chat.id, "❌ Invalid user ID. Use: `/unban <user_id>`")
 
 # --- Start Bot and Keep-Alive Server ---
-if __name__ == '__main__':
-    load_user_data() # Load user data at startup
-    keep_alive() # Start the Flask web server in a separate thread
-    print("Keep-alive server started.")
-    
-    print("Bot is starting...")
-    bot.polling(none_stop=True) # Use none_stop=True to keep bot running
+IMPORT_SECONDS = time.perf_counter() - STARTED
+STARTUP_SECONDS.set(IMPORT_SECONDS, phase='imports')
+
+def record_first_update(updates):
+    """Update listener that records when the first update arrived, then removes itself."""
+    seconds = time.perf_counter() - STARTED
+    try:
+        bot.update_listener.remove(record_first_update)
+    except ValueError:
+        return # Another handler thread got here first
+    STARTUP_SECONDS.set(seconds, phase='first_update')
+    print(f"First update received {seconds:.2f}s after start.")
+
+bot.set_update_listener(record_first_update)
+
+def mark_ready():
+    """Records that the bot is about to receive updates."""
+    seconds = time.perf_counter() - STARTED
+    STARTUP_SECONDS.set(seconds, phase='ready')
+    print(f"Ready for updates {seconds:.2f}s after start (imports took {IMPORT_SECONDS:.2f}s).")
+
+def preload():
+    """
+    Imports in the background what the first scrape will need: the whole
+    pipeline if this process runs scrape workers, else only the request
+    parsers. Runs once the bot is ready, so it never delays the first update.
+    """
+    if config.SCRAPE_WORKERS > 0:
+        import pipeline
+    else:
+        import crawler
+
+def start_services():
+    """Starts the background work that runs next to update handling."""
+    users.migrate_json(USER_DATA_FILE) # Import the old JSON user data once, if present
+    scrape_workers.start() # Start the scrape worker threads (none if SCRAPE_WORKERS is 0)
+    threading.Thread(target=report_finished_jobs, daemon=True).start()
+    broadcasts.resume() # Continue broadcasts interrupted by a restart
+
+def use_webhook():
+    """
+    Has Telegram push updates to the keep-alive web server (WEBHOOK_URL)
+    instead of the bot polling for them.
+    """
+    from keep_alive import enable_webhook
+    enable_webhook(bot.process_new_updates)
+    bot.set_webhook(url=config.WEBHOOK_URL + config.WEBHOOK_PATH, secret_token=config.WEBHOOK_SECRET)
+
+def start_keep_alive():
+    """
+    Starts the keep-alive web server on its own thread, which also imports
+    Flask, so that polling can start meanwhile. Returns the thread.
+    """
+    def serve():
+        from keep_alive import run
+        run()
+    server = threading.Thread(target=serve)
+    server.start()
+    return server
 
+if __name__ == '__main__':
+    start_services()
+    if config.WEBHOOK_URL:
+        use_webhook()
+        from keep_alive import keep_alive
+        server = keep_alive() # The Flask web server now also receives the updates
+        print(f"Bot is receiving updates at {config.WEBHOOK_URL}{config.WEBHOOK_PATH}...")
+        mark_ready()
+        if config.PRELOAD:
+            threading.Thread(target=preload, daemon=True).start()
+        server.join()
+    else:
+        start_keep_alive() # Start the Flask web server in a separate thread
+        print("Keep-alive server starting.")
+
+        print("Bot is starting...")
+        bot.remove_webhook() # Polling does not work while a webhook is set
+        mark_ready()
+        if config.PRELOAD:
+            threading.Thread(target=preload, daemon=True).start()
+        bot.polling(none_stop=True) # Use none_stop=True to keep bot running
@@ -0,0 +1,178 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from telebot.apihelper import ApiTelegramException
+
+from db import get_connection, transaction
+from ratelimit import TokenBucket, KeyedLimiter
+
+# A broadcast is 'running' until every active user was handled, then 'done'.
+# last_user_id is the checkpoint: every user up to that ID has been handled,
+# so a broadcast interrupted by a restart continues after it.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    admin_chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',
+    last_user_id INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    progress_message_id INTEGER,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+def _unreachable(error):
+    """True if Telegram says the user can no longer be messaged (blocked the bot, deleted account, ...)."""
+    return error.error_code == 403 or (error.error_code == 400 and 'chat not found' in error.description.lower())
+
+class BroadcastEngine:
+    """
+    Sends an admin announcement to every active user in the background.
+
+    Messages go out on a small pool of worker threads, through a token
+    bucket for Telegram's overall limit and one per chat. When Telegram
+    answers 429, the whole broadcast waits for the retry_after it asks for.
+    Users who blocked the bot are marked inactive and skipped from then on.
+    Progress is checkpointed after every page of users, so an interrupted
+    broadcast resumes where it stopped (at most one page is sent twice), and
+    the admin sees a live progress message.
+    """
+
+    def __init__(self, bot, users, workers=4, rate=25, per_chat_rate=1, page_size=50,
+                 progress_interval=5, max_attempts=5):
+        self.bot = bot
+        self.users = users
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.max_attempts = max_attempts
+        self.global_limit = TokenBucket(rate)
+        self.chat_limit = KeyedLimiter(per_chat_rate)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='broadcast')
+        self._running = set()
+        self._lock = threading.Lock()
+        get_connection().executescript(SCHEMA)
+
+    def start(self, admin_chat_id, text):
+        """Starts broadcasting text to all active users and returns the broadcast's ID."""
+        total = self.users.count_active()
+        progress = self._send(admin_chat_id, f"📢 Starting broadcast to {total} users...")
+        now = time.time()
+        with transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO broadcasts (admin_chat_id, text, total, progress_message_id, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (admin_chat_id, text, total, progress.message_id if progress else None, now, now))
+            broadcast_id = cursor.lastrowid
+        self._launch(broadcast_id)
+        return broadcast_id
+
+    def resume(self):
+        """Continues broadcasts that were interrupted by a restart."""
+        for row in get_connection().execute("SELECT id FROM broadcasts WHERE status = 'running'").fetchall():
+            print(f"Resuming broadcast {row['id']}.")
+            self._launch(row['id'])
+
+    def _launch(self, broadcast_id):
+        with self._lock:
+            if broadcast_id in self._running:
+                return
+            self._running.add(broadcast_id)
+        threading.Thread(target=self._run, args=(broadcast_id,), name=f"broadcast-{broadcast_id}", daemon=True).start()
+
+    def _run(self, broadcast_id):
+        """Sends the broadcast page by page, checkpointing after each page."""
+        try:
+            row = get_connection().execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+            counts = {'sent': row['sent'], 'failed': row['failed'], 'blocked': row['blocked']}
+            last_user_id = row['last_user_id']
+            message = f"📢 **Announcement from Admin:**\n{row['text']}"
+            last_report = time.monotonic()
+
+            while True:
+                user_ids = self.users.active_ids(after=last_user_id, limit=self.page_size)
+                if not user_ids:
+                    break
+                for outcome in self._executor.map(lambda uid: self._deliver(uid, message), user_ids):
+                    counts[outcome] += 1
+                last_user_id = user_ids[-1]
+                get_connection().execute(
+                    "UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, blocked = ?, updated = ? WHERE id = ?",
+                    (last_user_id, counts['sent'], counts['failed'], counts['blocked'], time.time(), broadcast_id))
+                if time.monotonic() - last_report >= self.progress_interval:
+                    self._report(row, counts)
+                    last_report = time.monotonic()
+
+            get_connection().execute("UPDATE broadcasts SET status = 'done', updated = ? WHERE id = ?",
+                                     (time.time(), broadcast_id))
+            self._report(row, counts, finished=True)
+        except Exception as e:
+            # The broadcast stays 'running' and resumes from its checkpoint on the next start.
+            print(f"Broadcast {broadcast_id} stopped: {e}")
+        finally:
+            with self._lock:
+                self._running.discard(broadcast_id)
+
+    def _deliver(self, uid, message):
+        """Sends the message to one user. Returns 'sent', 'failed' or 'blocked'. Runs on a pool thread."""
+        for attempt in range(self.max_attempts):
+            self.chat_limit.acquire(uid)
+            self.global_limit.acquire()
+            try:
+                self.bot.send_message(uid, message, parse_mode='Markdown')
+                return 'sent'
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    # Telegram wants every send to slow down, not just this one.
+                    retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+                    self.global_limit.pause(retry_after)
+                    continue
+                if _unreachable(e):
+                    self.users.set_active(uid, False)
+                    return 'blocked'
+                print(f"Failed to send broadcast to user {uid}: {e}")
+                return 'failed'
+            except requests.exceptions.RequestException as e:
+                # Network trouble; back off and try again.
+                print(f"Network error sending broadcast to user {uid}: {e}")
+                time.sleep(2 ** attempt)
+            except Exception as e:
+                print(f"Failed to send broadcast to user {uid}: {e}")
+                return 'failed'
+        return 'failed'
+
+    def _send(self, chat_id, text):
+        """Sends a status message to the admin, returning it (or None on failure)."""
+        self.global_limit.acquire()
+        try:
+            return self.bot.send_message(chat_id, text)
+        except Exception as e:
+            print(f"Could not send broadcast status to {chat_id}: {e}")
+            return None
+
+    def _report(self, row, counts, finished=False):
+        """Updates the admin's progress message (or sends a new one if there is none)."""
+        handled = sum(counts.values())
+        if finished:
+            text = (f"✅ Broadcast complete. Sent to {counts['sent']} users, failed for {counts['failed']} users, "
+                    f"{counts['blocked']} users blocked the bot and were marked inactive.")
+        else:
+            percent = min(100 * handled // row['total'], 100) if row['total'] else 100
+            text = (f"📢 Broadcasting... {handled}/{row['total']} ({percent}%): {counts['sent']} sent, "
+                    f"{counts['failed']} failed, {counts['blocked']} blocked.")
+        if row['progress_message_id'] is None:
+            self._send(row['admin_chat_id'], text)
+            return
+        self.global_limit.acquire()
+        try:
+            self.bot.edit_message_text(text, chat_id=row['admin_chat_id'], message_id=row['progress_message_id'])
+        except Exception as e:
+            print(f"Could not update broadcast progress: {e}")
+            if finished:
+                self._send(row['admin_chat_id'], text)
@@ -1,3 +1,4 @@
+import hashlib
 import os
 from dotenv import load_dotenv
 
@@ -28,3 +29,263 @@ if not ADMIN_ID:
     raise ValueError("ADMIN_ID environment variable not set. Please set it in your .env file or deployment environment.")
 # PAYPAL_EMAIL, UPI_ID, TELEGRAM_USERNAME can be None if not using payment features,
 # but it's good practice to ensure they are handled.
+
+# --- Scraper Tuning ---
+# These have sensible defaults and only need to be set to override them.
+
+# Size of the connection pool shared by all scrapes of a process, for pages
+# and their images/videos alike.
+FETCH_CONNECTIONS = int(os.getenv("FETCH_CONNECTIONS", "100"))
+
+# Maximum number of simultaneous downloads from a single host.
+DOWNLOAD_PER_HOST = int(os.getenv("DOWNLOAD_PER_HOST", "4"))
+
+# Timeout in seconds for downloading a single image or video.
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "20"))
+
+# Seconds allowed for connecting to a website, and for each read from it.
+CONNECT_TIMEOUT = float(os.getenv("CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("READ_TIMEOUT", "20"))
+
+# Seconds allowed for fetching a whole page, retries included.
+PAGE_TIMEOUT = float(os.getenv("PAGE_TIMEOUT", "45"))
+
+# Failed GET requests (no connection, no answer in time, or a 429/502/503/504
+# answer) are retried up to FETCH_RETRIES times, after a random delay of up to
+# RETRY_BACKOFF seconds doubling with each attempt, at most RETRY_MAX_BACKOFF.
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "2"))
+RETRY_BACKOFF = float(os.getenv("RETRY_BACKOFF", "0.5"))
+RETRY_MAX_BACKOFF = float(os.getenv("RETRY_MAX_BACKOFF", "8"))
+
+# After BREAKER_FAILURES failed requests in a row to a website, requests to it
+# fail at once for BREAKER_COOLDOWN seconds, instead of every user waiting on it.
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "60"))
+
+# Maximum number of assets one scrape downloads at the same time.
+DOWNLOAD_PER_JOB = int(os.getenv("DOWNLOAD_PER_JOB", "4"))
+
+# Requests per second sent to any one website, with bursts of up to HOST_BURST.
+HOST_RATE = float(os.getenv("HOST_RATE", "5"))
+HOST_BURST = int(os.getenv("HOST_BURST", "10"))
+
+# When a website answers 429 or 503, requests to it pause for its Retry-After,
+# or else for a backoff doubling from 1 second, at most HOST_MAX_BACKOFF seconds.
+HOST_MAX_BACKOFF = float(os.getenv("HOST_MAX_BACKOFF", "300"))
+
+# Longest a request waits for its website's turn before failing instead.
+HOST_MAX_WAIT = float(os.getenv("HOST_MAX_WAIT", "30"))
+
+# Overall deadline in seconds for all asset downloads of one scrape.
+SCRAPE_JOB_TIMEOUT = float(os.getenv("SCRAPE_JOB_TIMEOUT", "90"))
+
+# Maximum number of bytes saved for a single image or video (default 20 MB).
+MAX_ASSET_BYTES = int(os.getenv("MAX_ASSET_BYTES", str(20 * 1024 * 1024)))
+
+# Maximum number of bytes saved for all assets of one scrape (default 150 MB).
+# Results over DELIVERY_PART_BYTES are sent as several zip files.
+MAX_JOB_BYTES = int(os.getenv("MAX_JOB_BYTES", str(150 * 1024 * 1024)))
+
+# Number of scrape jobs each process works on at the same time. The bot process
+# runs this many worker threads itself; set it to 0 for the bot when scrapes are
+# handled by separate worker.py processes instead.
+SCRAPE_WORKERS = int(os.getenv("SCRAPE_WORKERS", "2"))
+
+# Number of processes started by worker.py, each running SCRAPE_WORKERS threads.
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+
+# Maximum number of scrape jobs one user may have queued or running at once.
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", "1"))
+
+# Maximum number of scrape jobs waiting in the queue before new ones are refused.
+MAX_PENDING_JOBS = int(os.getenv("MAX_PENDING_JOBS", "100"))
+
+# Scrape requests each user may make: one every USER_SCRAPE_INTERVAL seconds,
+# with bursts of up to USER_SCRAPE_BURST. Faster requests are told when to retry.
+USER_SCRAPE_INTERVAL = float(os.getenv("USER_SCRAPE_INTERVAL", "20"))
+USER_SCRAPE_BURST = int(os.getenv("USER_SCRAPE_BURST", "3"))
+
+# Scrape requests per second accepted from all users together, with bursts of up to GLOBAL_SCRAPE_BURST.
+GLOBAL_SCRAPE_RATE = float(os.getenv("GLOBAL_SCRAPE_RATE", "2"))
+GLOBAL_SCRAPE_BURST = int(os.getenv("GLOBAL_SCRAPE_BURST", "20"))
+
+# SQLite database shared by the bot and worker processes (job queue and other state).
+DB_PATH = os.getenv("DB_PATH", "scrapnest.db")
+
+# Seconds a worker may hold a job without renewing its lease before the job is
+# considered abandoned (e.g. after a crash or restart) and handed out again.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+
+# Maximum number of times a job is attempted after worker crashes before giving up.
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Finished scrape archives are cached on disk and reused for identical requests
+# (same normalized URL or keyword) for this many seconds. Set to 0 to disable.
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+
+# Maximum total size of the result cache (default 500 MB). Least recently used
+# results are evicted first.
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+
+# Directory holding the cached result archives.
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "result_cache")
+
+# Result archives and downloads are kept in memory up to this size (default
+# 8 MB) and spill to a temporary file on disk only beyond it.
+ARCHIVE_SPILL_BYTES = int(os.getenv("ARCHIVE_SPILL_BYTES", str(8 * 1024 * 1024)))
+
+# Directory for spilled temporary files. Defaults to the system temp directory.
+SPOOL_DIR = os.getenv("SPOOL_DIR") or None
+
+# HTML parser used to extract page data: "lxml" (faster, used when the lxml
+# package is installed) or "html.parser" (pure Python, always available).
+HTML_PARSER = os.getenv("HTML_PARSER", "lxml")
+
+# Maximum number of headlines and prices kept per page. Once these and the
+# paragraph/image/video/table limits are reached, the rest of the page is
+# skipped. Set to 0 for no limit: those are then collected from the part of
+# the page read until the other extractors are done.
+MAX_HEADLINES = int(os.getenv("MAX_HEADLINES", "100"))
+MAX_PRICES = int(os.getenv("MAX_PRICES", "100"))
+
+# Maximum number of links collected per page by the "links" extractor, which
+# /batch uses to follow links. Set to 0 for no limit.
+MAX_LINKS = int(os.getenv("MAX_LINKS", "200"))
+
+# --- Batch Scraping ---
+# Maximum number of URLs accepted in one /batch request.
+BATCH_MAX_URLS = int(os.getenv("BATCH_MAX_URLS", "20"))
+
+# Maximum total number of pages scraped for one /batch request, including
+# pages reached by following links.
+BATCH_MAX_PAGES = int(os.getenv("BATCH_MAX_PAGES", "30"))
+
+# Maximum link-follow depth a user can ask for with `/batch --depth N`.
+CRAWL_MAX_DEPTH = int(os.getenv("CRAWL_MAX_DEPTH", "2"))
+
+# Number of pages of one batch fetched at the same time.
+CRAWL_WORKERS = int(os.getenv("CRAWL_WORKERS", "4"))
+
+# Minimum number of seconds between two page requests to the same host. A
+# larger Crawl-delay in the host's robots.txt takes precedence.
+CRAWL_DELAY = float(os.getenv("CRAWL_DELAY", "1"))
+
+# Maximum time in seconds for a whole batch. Pages not started by then are skipped.
+BATCH_JOB_TIMEOUT = float(os.getenv("BATCH_JOB_TIMEOUT", "300"))
+
+# --- Search ---
+# Keywords (anything that is not a URL) are searched for on the web with this
+# backend: duckduckgo, bing or google (see search.py).
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "duckduckgo")
+
+# Maximum number of search results kept per keyword.
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "10"))
+
+# Parsed search results are reused for the same keyword for this many seconds
+# (default 6 hours). Set to 0 to disable.
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(6 * 3600)))
+
+# Number of top results whose pages are scraped along with the result list,
+# like a /batch of their URLs. Set to 0 to return only the result list.
+SEARCH_FAN_OUT = int(os.getenv("SEARCH_FAN_OUT", "3"))
+
+# --- HTTP Cache ---
+# Scraped pages are kept in an on-disk HTTP cache and revalidated with
+# ETag/Last-Modified, so an unchanged page costs a 304 instead of a full
+# download. Maximum total size of the cache (default 200 MB); 0 disables it.
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# Pages larger than this (default 5 MB) are not cached.
+HTTP_CACHE_MAX_ENTRY_BYTES = int(os.getenv("HTTP_CACHE_MAX_ENTRY_BYTES", str(5 * 1024 * 1024)))
+
+# Pages without explicit caching headers are treated as fresh for 10% of the
+# time since they were last modified, but never longer than this many seconds.
+HTTP_CACHE_HEURISTIC_MAX = float(os.getenv("HTTP_CACHE_HEURISTIC_MAX", "3600"))
+
+# Directory holding the cached page bodies.
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", "http_cache")
+
+# --- Media ---
+# Downloaded images and videos are checked before they go into the archive
+# (see media.py): duplicates, placeholders and error pages are dropped.
+# Files smaller than this many bytes are dropped as placeholders.
+MEDIA_MIN_BYTES = int(os.getenv("MEDIA_MIN_BYTES", "200"))
+
+# Images larger than this (default 1 MB) are downscaled and recompressed to
+# about this size, if Pillow is installed. 0 keeps every image as downloaded.
+MEDIA_TARGET_IMAGE_BYTES = int(os.getenv("MEDIA_TARGET_IMAGE_BYTES", str(1024 * 1024)))
+
+# Longest side in pixels of a recompressed image.
+MEDIA_MAX_DIMENSION = int(os.getenv("MEDIA_MAX_DIMENSION", "2048"))
+
+# Images larger than this (default 20 MB) are kept as they are rather than
+# decoded, which could take a lot of memory.
+MEDIA_MAX_RECOMPRESS_BYTES = int(os.getenv("MEDIA_MAX_RECOMPRESS_BYTES", str(20 * 1024 * 1024)))
+
+# Number of processes recompressing images, shared by all scrapes.
+MEDIA_PROCESSES = int(os.getenv("MEDIA_PROCESSES", "2"))
+
+# --- Async Runner (async_bot.py) ---
+# Maximum number of scrape jobs async_bot.py runs at once on its event loop.
+ASYNC_MAX_JOBS = int(os.getenv("ASYNC_MAX_JOBS", "100"))
+
+# --- Webhook Mode ---
+# Public HTTPS base URL of this service (e.g. https://scrapnest.onrender.com).
+# When set, Telegram pushes updates to the keep-alive web server instead of
+# the bot long-polling for them. Leave empty to use polling.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+
+# Path of the webhook route on the web server.
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+
+# Secret Telegram sends with every webhook update (letters, digits, _ and -).
+# Defaults to a value derived from BOT_TOKEN, so it is stable across restarts.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()
+
+# Number of threads the bot uses to run command handlers.
+BOT_THREADS = int(os.getenv("BOT_THREADS", "2"))
+
+# --- Broadcasts ---
+# Messages per second sent by /broadcast. Telegram allows about 30 per second
+# overall, and about 1 per second to the same chat.
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CHAT_RATE = float(os.getenv("BROADCAST_CHAT_RATE", "1"))
+
+# Number of threads sending broadcast messages.
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "4"))
+
+# Seconds between updates of the admin's broadcast progress message.
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# --- Delivery ---
+# Telegram bots may upload files of at most 50 MB, so larger results are sent
+# as several zip files of at most this size (default 48 MB) each.
+DELIVERY_PART_BYTES = int(os.getenv("DELIVERY_PART_BYTES", str(48 * 1024 * 1024)))
+
+# Number of files (parts of results) uploaded at the same time, shared by all jobs.
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "3"))
+
+# Times a part that failed with a network error, 429 or Telegram server error
+# is sent again. Parts that were sent are never sent twice.
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", "2"))
+
+# Uploads started per second overall and to the same chat.
+UPLOAD_RATE = float(os.getenv("UPLOAD_RATE", "20"))
+UPLOAD_CHAT_RATE = float(os.getenv("UPLOAD_CHAT_RATE", "1"))
+
+# --- Instrumentation ---
+# File that gets one JSON line per scrape job with the time spent in every
+# stage (fetch, parse, downloads, zip, upload, ...). Leave empty to disable.
+TRACE_LOG = os.getenv("TRACE_LOG", "")
+
+# Stage timings and counters are exported in the Prometheus format on the
+# /metrics route: the bot's on its keep-alive server, and those of worker.py
+# and async_bot.py on a server of their own at this port if it is set (the
+# worker.py processes on this port and the ones after it). 0 disables them.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# --- Startup ---
+# The bot starts taking updates before the scrape pipeline is imported; with
+# PRELOAD=1 it is then imported on a background thread, so the first scrape
+# does not wait for it. Set to 0 to import it only when first needed.
+PRELOAD = int(os.getenv("PRELOAD", "1"))
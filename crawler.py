@@ -0,0 +1,217 @@
+import contextvars
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+
+import config
+from archive import ArchiveBuilder
+from extract import resolve_names
+from fetcher import fetch_text, normalize_url, JobBudget, USER_AGENT, FETCH_ERRORS
+from instrument import span
+from media import MediaStage
+from scraper import scrape_page, parse_scrape_request, safe_name
+
+class DomainScheduler:
+    """
+    Decides when a page may be requested, per host: robots.txt rules are
+    honoured, and requests to the same host are spaced at least CRAWL_DELAY
+    seconds apart, or by the host's robots.txt Crawl-delay if that is longer.
+    Pages on different hosts are never held up by each other.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._robots = {} # Maps a host to its parsed robots.txt
+        self._next_slot = {} # Maps a host to the earliest time of its next request
+        self._lock = threading.Lock()
+        self._host_locks = {}
+
+    def _host_lock(self, host):
+        with self._lock:
+            return self._host_locks.setdefault(host, threading.Lock())
+
+    def _rules(self, url):
+        """Returns the host's robots.txt rules, fetching them on first use."""
+        parts = urlparse(url)
+        host = parts.netloc.lower()
+        # One lock per host, so robots.txt is fetched once even if several pages of it start together.
+        with self._host_lock(host):
+            if host not in self._robots:
+                rules = RobotFileParser()
+                try:
+                    status, text = fetch_text(f"{parts.scheme}://{parts.netloc}/robots.txt",
+                                              raise_for_status=False, timeout=config.DOWNLOAD_TIMEOUT)
+                    # Same interpretation as RobotFileParser.read().
+                    if status in (401, 403):
+                        rules.disallow_all = True
+                    elif status >= 400:
+                        rules.allow_all = True
+                    else:
+                        rules.parse(text.splitlines())
+                except FETCH_ERRORS as e:
+                    print(f"Could not fetch robots.txt for {host}: {e}")
+                    rules.allow_all = True
+                rules.modified() # Marks the rules as fetched; crawl_delay() ignores them otherwise
+                self._robots[host] = rules
+            return self._robots[host]
+
+    def allowed(self, url):
+        """Returns True if robots.txt allows fetching url."""
+        return self._rules(url).can_fetch(USER_AGENT, url)
+
+    def wait(self, url, deadline):
+        """
+        Blocks until the next request to url's host is allowed and returns True,
+        or returns False without waiting if that would be after deadline.
+        """
+        host = urlparse(url).netloc.lower()
+        delay = max(self.delay, self._rules(url).crawl_delay(USER_AGENT) or 0)
+        # Reserve the slot under the lock and sleep outside it, so threads
+        # waiting for one host never hold up pages on other hosts.
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            if slot > deadline:
+                return False
+            self._next_slot[host] = slot + delay
+        time.sleep(max(slot - time.monotonic(), 0))
+        return True
+
+def parse_batch_request(text, options=None):
+    """
+    Splits a batch request like "/batch --depth 1 --only prices <URL> <URL> ..."
+    into (urls, options). Accepts the same options as /scrape plus --depth,
+    the number of link levels to follow. URLs are de-duplicated, keeping
+    their order. Raises ValueError for invalid input.
+    """
+    options = dict(options) if options else {'only': [], 'format': 'json', 'depth': 0}
+    tokens = text.split()
+    rest = []
+    while tokens:
+        token = tokens.pop(0)
+        flag, _, value = token.partition('=')
+        if flag == '--depth':
+            if not value:
+                if not tokens:
+                    raise ValueError("--depth needs a value.")
+                value = tokens.pop(0)
+            if not value.isdigit() or int(value) > config.CRAWL_MAX_DEPTH:
+                raise ValueError(f"--depth must be a number from 0 to {config.CRAWL_MAX_DEPTH}.")
+            options['depth'] = int(value)
+        else:
+            rest.append(token)
+
+    targets, options = parse_scrape_request(" ".join(rest), options)
+    urls = []
+    for url in targets.split():
+        if not url.lower().startswith(("http://", "https://")):
+            raise ValueError(f"'{url}' is not a URL. /batch only takes URLs starting with http:// or https://.")
+        url = normalize_url(url)
+        if url not in urls:
+            urls.append(url)
+    if len(urls) > config.BATCH_MAX_URLS:
+        raise ValueError(f"A batch can have at most {config.BATCH_MAX_URLS} URLs.")
+    return urls, options
+
+def _page_folder(number, url):
+    """Returns the archive folder for the number-th page of a batch, e.g. "01_example.com_products/"."""
+    parts = urlparse(url)
+    return f"{number:02d}_{safe_name(parts.netloc + parts.path.rstrip('/'))}/"
+
+def _crawl_page(entry, archive, scheduler, only, fmt, follow, deadline, budget, media):
+    """Scrapes one page of a batch into its folder and returns the links found on it. Runs on a pool thread."""
+    url = entry['url']
+    if not scheduler.allowed(url):
+        entry['status'] = 'skipped'
+        entry['error'] = "Disallowed by robots.txt."
+        return []
+    if not scheduler.wait(url, deadline):
+        entry['status'] = 'skipped'
+        entry['error'] = "Batch time limit reached."
+        return []
+
+    # Pages whose links are followed also run the links extractor.
+    names = resolve_names(list(only or resolve_names(None)) + ['links']) if follow else only
+    try:
+        page = scrape_page(url, archive, names, fmt, prefix=entry['folder'], budget=budget,
+                           media=media)
+    except FETCH_ERRORS as e:
+        print(f"Network or HTTP error while scraping {url}: {e}")
+        archive.writestr(entry['folder'] + "error.txt", f"Scraping failed due to network or HTTP error: {e}")
+        entry['status'] = 'error'
+        entry['error'] = str(e)
+        return []
+    except Exception as e:
+        print(f"An unexpected error occurred while scraping {url}: {e}")
+        archive.writestr(entry['folder'] + "error.txt", f"Scraping failed due to an unexpected error: {e}")
+        entry['status'] = 'error'
+        entry['error'] = str(e)
+        return []
+
+    entry['status'] = 'ok'
+    links = page.get('links')
+    return [urljoin(url, href) for href in links.links] if links else []
+
+def crawl(urls, depth=0, only=None, fmt='json', archive=None):
+    """
+    Scrapes a batch of URLs, and with depth > 0 also the pages they link to on
+    the same host, up to depth levels of links and BATCH_MAX_PAGES pages in
+    total. Every URL is scraped once. Pages are fetched CRAWL_WORKERS at a time
+    while DomainScheduler keeps each host to its crawl delay and robots.txt.
+
+    Each page goes into its own numbered folder of one archive, and batch.json
+    lists every page with its outcome. Downloads of all pages share one
+    MAX_JOB_BYTES budget and one MediaStage, so a file found on several
+    pages is only stored once. Returns the finished ArchiveBuilder.
+    """
+    if archive is None:
+        archive = ArchiveBuilder(f"batch_{safe_name(urlparse(urls[0]).netloc)}")
+    deadline = time.monotonic() + config.BATCH_JOB_TIMEOUT
+    scheduler = DomainScheduler(config.CRAWL_DELAY)
+    budget = JobBudget(config.MAX_JOB_BYTES)
+    media = MediaStage()
+
+    entries = []
+    seen = set()
+    # Breadth first: all pages of one level are fetched before any page of the next.
+    level = [(url, urlparse(url).netloc.lower()) for url in urls]
+    seen.update(url for url, _ in level)
+    with ThreadPoolExecutor(max_workers=config.CRAWL_WORKERS, thread_name_prefix='crawl') as executor:
+        for current_depth in range(depth + 1):
+            level = level[:config.BATCH_MAX_PAGES - len(entries)]
+            if not level:
+                break
+            batch = []
+            for url, host in level:
+                entry = {'url': url, 'depth': current_depth, 'folder': _page_folder(len(entries) + 1, url),
+                         'status': None, 'error': None}
+                entries.append(entry)
+                batch.append((entry, host))
+            follow = current_depth < depth
+            # Pages run in a copy of the caller's context, so their spans join the job's trace.
+            futures = [executor.submit(contextvars.copy_context().run, _crawl_page, entry, archive, scheduler,
+                                       only, fmt, follow, deadline, budget, media)
+                       for entry, _ in batch]
+
+            # Links are only followed within the host of the page they were found on.
+            level = []
+            for (entry, host), future in zip(batch, futures):
+                for link in future.result():
+                    link = normalize_url(link)
+                    if link not in seen and link.startswith('http') and urlparse(link).netloc.lower() == host:
+                        seen.add(link)
+                        level.append((link, host))
+
+    index = {
+        'urls': urls,
+        'depth': depth,
+        'pages': entries,
+    }
+    archive.writestr("batch.json", json.dumps(index, ensure_ascii=False, indent=2))
+    if not any(entry['status'] == 'ok' for entry in entries):
+        archive.writestr("error.txt", "None of the pages in the batch could be scraped. See batch.json for details.")
+    with span('zip'):
+        return archive.finish()
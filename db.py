@@ -0,0 +1,41 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import config
+
+# Each thread (and each process) gets its own connection, since SQLite
+# connections must not be shared between threads.
+_local = threading.local()
+
+def get_connection():
+    """Returns this thread's connection to the bot database, opening it on first use."""
+    conn = getattr(_local, 'conn', None)
+    # A connection inherited through fork() belongs to the parent process; open a fresh one.
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(config.DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # WAL lets the bot and worker processes read while another process writes.
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+@contextmanager
+def transaction():
+    """
+    Runs the enclosed statements in one write transaction.
+    BEGIN IMMEDIATE takes the write lock up front, so read-then-update
+    sequences inside the block cannot race with other processes.
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
@@ -0,0 +1,353 @@
+# Sending results to Telegram. Bots may upload files of at most 50 MB, so a
+# result larger than DELIVERY_PART_BYTES is split into several zip files, each
+# a complete archive holding some of the members: extracting all of them into
+# the same folder gives the full result. Parts are uploaded UPLOAD_WORKERS at
+# a time, paced per chat and overall, and only the parts that failed are retried.
+import asyncio
+import contextvars
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import config
+from archive import spooled_file
+from fetcher import retry_delay
+from instrument import registry, span
+from ratelimit import TokenBucket, KeyedLimiter
+from storage import FileIdStore
+
+# Telegram file_ids of uploaded archives, so repeated content is never uploaded twice.
+file_ids = FileIdStore()
+
+DELIVERIES = registry.counter('scrapnest_deliveries_total',
+                              "Archives (or archive parts) sent to users, by whether a stored file_id "
+                              "was reused or the file uploaded.")
+
+# Upload pacing shared by every job of this process. Telegram allows about 30
+# messages per second overall and about 1 per second to the same chat; a chat
+# may start its first UPLOAD_WORKERS uploads at once.
+upload_limit = TokenBucket(config.UPLOAD_RATE)
+chat_upload_limit = KeyedLimiter(config.UPLOAD_CHAT_RATE, config.UPLOAD_WORKERS)
+
+# Bytes a zip needs per member besides its data (local header, central
+# directory entry and data descriptor, not counting the name), and once per archive.
+MEMBER_OVERHEAD = 200
+ARCHIVE_OVERHEAD = 100
+
+_executor = None
+_lock = threading.Lock()
+
+def _get_executor():
+    """Returns the thread pool that uploads parts, created on first use."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.UPLOAD_WORKERS, thread_name_prefix='upload')
+        return _executor
+
+def file_hash(path):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    with open(path, "rb") as f:
+        return _stream_hash(f)
+
+def _stream_hash(f):
+    digest = hashlib.sha256()
+    f.seek(0)
+    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+class Part:
+    """
+    One file sent to the user: a whole result (a zip path or open file) or
+    a piece split off a larger one, which the Part owns and close() frees.
+    caption is sent along with the file.
+    """
+
+    def __init__(self, filename, content_hash, path=None, file=None, source_key=None, owned=False, caption=None):
+        self.filename = filename
+        self.content_hash = content_hash
+        self.caption = caption
+        self.path = path
+        self.file = file
+        self.source_key = source_key
+        self.owned = owned
+
+    @contextmanager
+    def reading(self):
+        """Yields the part's contents as a file object positioned at the start."""
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                yield f
+        else:
+            self.file.seek(0)
+            yield self.file
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+
+def split_archive(source, part_bytes):
+    """
+    Splits the zip file object source into complete zip archives of at most
+    about part_bytes each, keeping the members' order, names, dates and
+    compression. A member too large for a part of its own still gets one.
+    Returns the archives as spooled files.
+    """
+    pieces = []
+    out = None
+    size = 0
+    try:
+        with zipfile.ZipFile(source) as src:
+            for info in src.infolist():
+                needed = info.compress_size + 2 * len(info.filename.encode('utf-8')) + MEMBER_OVERHEAD
+                if out is not None and size + needed > part_bytes:
+                    out.close()
+                    out = None
+                if out is None:
+                    pieces.append(spooled_file())
+                    out = zipfile.ZipFile(pieces[-1], 'w')
+                    size = ARCHIVE_OVERHEAD
+                copy = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                copy.compress_type = info.compress_type
+                with src.open(info) as member, out.open(copy, 'w') as target:
+                    shutil.copyfileobj(member, target, 64 * 1024)
+                size += needed
+        if out is not None:
+            out.close()
+    except BaseException:
+        for piece in pieces:
+            piece.close()
+        raise
+    return pieces
+
+def scraped_caption(timestamp):
+    """Returns the caption telling when a result was scraped, given its time.time()."""
+    return f"Scraped {datetime.fromtimestamp(timestamp, timezone.utc):%Y-%m-%d %H:%M} UTC"
+
+def prepare_parts(result, filename=None, source_key=None):
+    """
+    Returns the Parts to send for a result, the path of a zip file or a
+    finished ArchiveBuilder: the result itself if it fits DELIVERY_PART_BYTES,
+    else the pieces split_archive() makes of it, named like
+    "example.com.part1of3.zip". Close them with close_parts() once sent.
+
+    The time of the scrape goes into the caption rather than the archive, so
+    the same content always makes the same bytes and reuses its file_id. A
+    zip file (a cached result) was scraped when it was written.
+    """
+    if isinstance(result, str):
+        filename = filename or os.path.basename(result)
+        size = os.path.getsize(result)
+        caption = scraped_caption(os.path.getmtime(result))
+    else:
+        filename = filename or result.filename
+        size = result.size
+        caption = scraped_caption(time.time())
+
+    if size <= config.DELIVERY_PART_BYTES:
+        with span('hash'):
+            if isinstance(result, str):
+                return [Part(filename, file_hash(result), path=result, source_key=source_key, caption=caption)]
+            return [Part(filename, result.content_hash(), file=result.open(), source_key=source_key,
+                         caption=caption)]
+
+    with span('split'):
+        if isinstance(result, str):
+            with open(result, "rb") as f:
+                pieces = split_archive(f, config.DELIVERY_PART_BYTES)
+        else:
+            pieces = split_archive(result.open(), config.DELIVERY_PART_BYTES)
+    stem = os.path.splitext(filename)[0]
+    parts = []
+    with span('hash'):
+        for number, piece in enumerate(pieces, 1):
+            # Every part has its own file_id; a result with a new number of parts replaces them slot by slot.
+            key = f"{source_key}#{number}/{len(pieces)}" if source_key else None
+            parts.append(Part(f"{stem}.part{number}of{len(pieces)}.zip", _stream_hash(piece), file=piece,
+                              source_key=key, owned=True, caption=caption))
+    return parts
+
+def close_parts(parts):
+    for part in parts:
+        part.close()
+
+# The sync and async bots raise different ApiTelegramException classes, so
+# Telegram's answers are recognized by their error_code.
+
+def retryable(error):
+    """True for errors worth another try: network failures, 429 Too Many Requests and Telegram server errors."""
+    error_code = getattr(error, 'error_code', None)
+    if error_code is not None:
+        return error_code == 429 or error_code >= 500
+    # Connection errors and timeouts of requests and asyncio are OSErrors.
+    if isinstance(error, OSError):
+        return True
+    # AsyncTeleBot raises RequestTimeout when a request gets no answer. Its
+    # module is only looked up, since only async_bot.py needs to import it.
+    async_helper = sys.modules.get('telebot.asyncio_helper')
+    return async_helper is not None and isinstance(error, async_helper.RequestTimeout)
+
+def _throttled(chat_id, error):
+    """Pauses the chat's uploads for as long as Telegram asks after a 429."""
+    if getattr(error, 'error_code', None) == 429:
+        retry_after = (error.result_json.get('parameters') or {}).get('retry_after', 1)
+        chat_upload_limit.pause(chat_id, retry_after)
+
+# Descriptions of Telegram's 400 answers to a file_id it no longer accepts.
+STALE_FILE_ID_ERRORS = ('wrong file identifier', 'wrong remote file identifier', 'file reference expired',
+                        'file_reference_expired', 'invalid file_id', 'file_id_invalid')
+
+def _stale_file_id(error):
+    """True if Telegram rejected a stored file_id itself, rather than the message or the chat."""
+    if getattr(error, 'error_code', None) != 400:
+        return False
+    description = (getattr(error, 'description', None) or '').lower()
+    return any(marker in description for marker in STALE_FILE_ID_ERRORS)
+
+def _send_part(bot, chat_id, part):
+    """
+    Sends one part, reusing its stored file_id if there is one. Returns None
+    or the error. Runs on a pool thread, once the chat's turn has come.
+    """
+    upload_limit.acquire()
+    try:
+        with span('upload'):
+            file_id = file_ids.get(part.content_hash)
+            if file_id:
+                try:
+                    bot.send_document(chat_id, file_id, caption=part.caption)
+                    DELIVERIES.inc(kind='file_id')
+                    return None
+                except Exception as e:
+                    if not _stale_file_id(e):
+                        raise
+                    # The file_id is no longer valid; fall back to uploading the file.
+                    print(f"Stored file_id for {part.filename} was rejected, re-uploading: {e}")
+                    file_ids.forget(part.content_hash)
+
+            with part.reading() as f:
+                sent_message = bot.send_document(chat_id, f, visible_file_name=part.filename,
+                                                 caption=part.caption)
+            file_ids.remember(part.content_hash, sent_message.document.file_id, part.source_key)
+            DELIVERIES.inc(kind='upload')
+        return None
+    except Exception as e:
+        print(f"Error sending {part.filename}: {e}")
+        _throttled(chat_id, e)
+        return e
+
+def send_parts(bot, chat_id, parts):
+    """
+    Sends parts to the chat, UPLOAD_WORKERS at a time. Parts that failed with
+    a temporary error are retried, up to UPLOAD_RETRIES more rounds, while
+    the parts already sent are not sent again. Returns {filename: error} for
+    the parts that could not be sent.
+    """
+    failed = {}
+    pending = list(parts)
+    for attempt in range(config.UPLOAD_RETRIES + 1):
+        if attempt:
+            time.sleep(retry_delay(attempt - 1))
+        futures = []
+        for part in pending:
+            # The chat's pacing is waited out here, before the part is handed to
+            # the pool, so a chat sending many parts never holds upload threads
+            # that other chats' jobs share.
+            chat_upload_limit.acquire(chat_id)
+            # Each upload runs in a copy of the caller's context, so its span joins the job's trace.
+            futures.append(_get_executor().submit(contextvars.copy_context().run, _send_part, bot, chat_id, part))
+        for part, future in zip(pending, futures):
+            error = future.result()
+            if error is None:
+                failed.pop(part, None)
+            else:
+                failed[part] = error
+        pending = [part for part in pending if part in failed and retryable(failed[part])]
+        if not pending:
+            break
+    return {part.filename: error for part, error in failed.items()}
+
+async def _send_part_async(bot, chat_id, part):
+    """Async counterpart of _send_part, for an AsyncTeleBot."""
+    await chat_upload_limit.acquire_async(chat_id)
+    await upload_limit.acquire_async()
+    try:
+        with span('upload'):
+            # The file_id store is SQLite, so its calls run on a thread.
+            file_id = await asyncio.to_thread(file_ids.get, part.content_hash)
+            if file_id:
+                try:
+                    await bot.send_document(chat_id, file_id, caption=part.caption)
+                    DELIVERIES.inc(kind='file_id')
+                    return None
+                except Exception as e:
+                    if not _stale_file_id(e):
+                        raise
+                    print(f"Stored file_id for {part.filename} was rejected, re-uploading: {e}")
+                    await asyncio.to_thread(file_ids.forget, part.content_hash)
+
+            with part.reading() as f:
+                sent_message = await bot.send_document(chat_id, f, visible_file_name=part.filename,
+                                                       caption=part.caption)
+            await asyncio.to_thread(file_ids.remember, part.content_hash, sent_message.document.file_id,
+                                    part.source_key)
+            DELIVERIES.inc(kind='upload')
+        return None
+    except Exception as e:
+        print(f"Error sending {part.filename}: {e}")
+        _throttled(chat_id, e)
+        return e
+
+async def send_parts_async(bot, chat_id, parts):
+    """Async counterpart of send_parts, uploading on the event loop."""
+    lanes = asyncio.Semaphore(config.UPLOAD_WORKERS)
+
+    async def send_in_lane(part):
+        async with lanes:
+            return await _send_part_async(bot, chat_id, part)
+
+    failed = {}
+    pending = list(parts)
+    for attempt in range(config.UPLOAD_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(retry_delay(attempt - 1))
+        errors = await asyncio.gather(*(send_in_lane(part) for part in pending))
+        for part, error in zip(pending, errors):
+            if error is None:
+                failed.pop(part, None)
+            else:
+                failed[part] = error
+        pending = [part for part in pending if part in failed and retryable(failed[part])]
+        if not pending:
+            break
+    return {part.filename: error for part, error in failed.items()}
+
+class DeliveryError(Exception):
+    """
+    Raised when some parts of a result could not be sent, given the parts and
+    send_parts()'s result. Its message tells the user what went wrong.
+    """
+
+    def __init__(self, parts, failed):
+        error = next(iter(failed.values()))
+        if len(parts) == 1:
+            message = f"Your data could not be sent: {error}"
+        else:
+            message = f"{len(failed)} of {len(parts)} parts could not be sent ({', '.join(failed)}): {error}"
+        super().__init__(message)
+
+def delivery_message(parts):
+    """Returns the message telling the user their result was sent as the given parts."""
+    if len(parts) == 1:
+        return "📤 Your scraped data has been sent as a zip file!"
+    return (f"📤 Your scraped data has been sent as {len(parts)} zip files! "
+            "Extract them all into the same folder to get everything.")
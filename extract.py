@@ -0,0 +1,474 @@
+import json
+import re
+from html.parser import HTMLParser
+
+import config
+
+# lxml's C parser is much faster than the pure-Python html.parser on large
+# pages. It is optional: install it with `pip install lxml` to use it.
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Finds patterns like "₹1,234" or "$9.99".
+PRICE_PATTERN = re.compile(r"₹[0-9,]+|\$[0-9.]+")
+# Links to common video file extensions.
+VIDEO_LINK_PATTERN = re.compile(r'\.(mp4|webm|ogg|mov|avi)$', re.IGNORECASE)
+HEADLINE_TAGS = {'h1', 'h2', 'h3'}
+# Text inside these tags is not visible page text.
+SKIP_TEXT_TAGS = {'script', 'style'}
+# Block elements that implicitly end an open paragraph, as browsers do.
+BLOCK_TAGS = {'address', 'article', 'aside', 'blockquote', 'details', 'div', 'dl', 'fieldset',
+              'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+              'header', 'hr', 'li', 'main', 'nav', 'ol', 'pre', 'section', 'table', 'td', 'ul'}
+
+# --- Extractor Registry ---
+# Maps an extractor name (as used in `/scrape --only <names>`) to its class.
+EXTRACTORS = {}
+
+# Names that select several extractors at once.
+GROUPS = {'media': ['images', 'videos']}
+
+def register(name):
+    """Class decorator adding an extractor to the registry under name."""
+    def decorator(cls):
+        cls.name = name
+        EXTRACTORS[name] = cls
+        return cls
+    return decorator
+
+def resolve_names(names):
+    """
+    Expands group names and checks that every extractor exists.
+    Returns the extractor names in registry order; None or empty means all
+    default extractors. Raises ValueError for unknown names.
+    """
+    if not names:
+        return [name for name, cls in EXTRACTORS.items() if cls.default]
+    wanted = set()
+    for name in names:
+        name = name.strip().lower()
+        if name in GROUPS:
+            wanted.update(GROUPS[name])
+        elif name in EXTRACTORS:
+            wanted.add(name)
+        else:
+            raise ValueError(f"Unknown extractor '{name}'. Available: {', '.join(list(EXTRACTORS) + list(GROUPS))}.")
+    return [name for name in EXTRACTORS if name in wanted]
+
+class Extractor:
+    """
+    Base class for extractor plugins. The engine calls start() and end() for
+    every tag and text() for every run of text between tags; visible is False
+    for text inside <script> or <style>. An extractor sets done to True once it
+    needs nothing more from the page, and result() returns its JSON-ready data.
+    limit is the most items it collects; None or 0 means it has no limit.
+    Extractors with default False only run when selected by name.
+    """
+    name = None
+    default = True
+    done = False
+    limit = None
+
+    def start(self, tag, attrs):
+        pass
+
+    def end(self, tag):
+        pass
+
+    def text(self, text, visible):
+        pass
+
+    def close(self):
+        pass
+
+    def result(self):
+        raise NotImplementedError
+
+class _TextCollector(Extractor):
+    """Shared logic for extractors that collect the text of whole elements."""
+
+    def __init__(self):
+        self._open = [] # Stack of [tag, text fragments] for elements being collected
+
+    def _finish(self, tag, text):
+        raise NotImplementedError
+
+    def _close(self, entry):
+        # Same result as BeautifulSoup's get_text(strip=True).
+        self._finish(entry[0], "".join(fragment.strip() for fragment in entry[1]))
+
+    def _close_through(self, tag):
+        # Close the matching element and anything left open inside it.
+        if any(entry[0] == tag for entry in self._open):
+            while self._open:
+                entry = self._open.pop()
+                self._close(entry)
+                if entry[0] == tag:
+                    break
+
+    def text(self, text, visible):
+        if visible:
+            for entry in self._open:
+                entry[1].append(text)
+
+    def close(self):
+        while self._open:
+            self._close(self._open.pop(0))
+
+@register('prices')
+class PriceExtractor(Extractor):
+    """Patterns like "₹1,234" or "$9.99" in page text, scripts and attribute values."""
+
+    def __init__(self):
+        self.limit = config.MAX_PRICES
+        self.prices = []
+
+    def _scan(self, text):
+        if self.done or not text:
+            return
+        for price in PRICE_PATTERN.findall(text):
+            self.prices.append(price)
+            if 0 < self.limit <= len(self.prices):
+                self.done = True
+                break
+
+    def start(self, tag, attrs):
+        for value in attrs.values():
+            self._scan(value)
+
+    def text(self, text, visible):
+        self._scan(text)
+
+    def result(self):
+        return self.prices
+
+@register('headlines')
+class HeadlineExtractor(_TextCollector):
+    """Text of h1, h2 and h3 tags."""
+
+    def __init__(self):
+        super().__init__()
+        self.limit = config.MAX_HEADLINES
+        self.headlines = []
+
+    def _finish(self, tag, text):
+        if not self.done:
+            self.headlines.append(text)
+            self.done = 0 < self.limit <= len(self.headlines)
+
+    def start(self, tag, attrs):
+        if tag in HEADLINE_TAGS and not self.done:
+            self._open.append([tag, []])
+
+    def end(self, tag):
+        if tag in HEADLINE_TAGS:
+            self._close_through(tag)
+
+    def result(self):
+        return self.headlines
+
+@register('paragraphs')
+class ParagraphExtractor(_TextCollector):
+    """Text of the first 20 <p> tags."""
+
+    def __init__(self, limit=20):
+        super().__init__()
+        self.limit = limit
+        self.paragraphs = []
+
+    def _finish(self, tag, text):
+        if not self.done:
+            self.paragraphs.append(text)
+            self.done = len(self.paragraphs) >= self.limit
+
+    def _close_paragraph(self):
+        if self._open and self._open[-1][0] == 'p':
+            self._close(self._open.pop())
+
+    def start(self, tag, attrs):
+        # A new paragraph or block implicitly closes an open paragraph, as in HTML.
+        if tag == 'p' or tag in BLOCK_TAGS:
+            self._close_paragraph()
+        if tag == 'p' and not self.done:
+            self._open.append([tag, []])
+
+    def end(self, tag):
+        if tag == 'p':
+            self._close_through(tag)
+        elif tag in BLOCK_TAGS:
+            # The end of an enclosing block also ends a paragraph left open inside it.
+            self._close_paragraph()
+
+    def result(self):
+        return self.paragraphs
+
+@register('images')
+class ImageExtractor(Extractor):
+    """Sources of the first 5 <img> tags."""
+
+    def __init__(self, limit=5):
+        self.limit = limit
+        self.images = [] # (index of the <img> tag, src)
+        self._seen = 0
+
+    def start(self, tag, attrs):
+        if tag == 'img' and not self.done:
+            if attrs.get('src'):
+                self.images.append((self._seen, attrs['src']))
+            self._seen += 1
+            self.done = self._seen >= self.limit
+
+    def result(self):
+        return [{'index': index, 'src': src} for index, src in self.images]
+
+@register('videos')
+class VideoExtractor(Extractor):
+    """Up to 3 unique videos from <video src>, <source> inside <video>, and links to video files."""
+
+    def __init__(self, limit=3):
+        self.limit = limit
+        self.videos = []
+        self._in_video = 0
+
+    def _add(self, src):
+        if src and not self.done and src not in self.videos:
+            self.videos.append(src)
+            self.done = len(self.videos) >= self.limit
+
+    def start(self, tag, attrs):
+        if tag == 'video':
+            self._in_video += 1
+            self._add(attrs.get('src'))
+        elif tag == 'source' and self._in_video:
+            self._add(attrs.get('src'))
+        elif tag == 'a':
+            href = attrs.get('href')
+            if href and VIDEO_LINK_PATTERN.search(href):
+                self._add(href)
+
+    def end(self, tag):
+        if tag == 'video' and self._in_video:
+            self._in_video -= 1
+
+    def result(self):
+        return [{'src': src} for src in self.videos]
+
+@register('metadata')
+class MetadataExtractor(Extractor):
+    """The page title, OpenGraph/Twitter <meta> properties and JSON-LD blocks of the <head>."""
+
+    def __init__(self):
+        self.title = None
+        self.meta = {}
+        self.json_ld = []
+        self._in_title = False
+        self._in_json_ld = False
+        self._buffer = []
+
+    def start(self, tag, attrs):
+        if tag == 'body':
+            self.done = True # Everything it reads is in the <head>, which may not be closed explicitly
+        elif tag == 'title' and self.title is None:
+            self._in_title = True
+            self._buffer = []
+        elif tag == 'meta':
+            key = attrs.get('property') or attrs.get('name') or ''
+            if key.startswith(('og:', 'twitter:')) or key in ('description', 'keywords'):
+                self.meta.setdefault(key, attrs.get('content', ''))
+        elif tag == 'script' and attrs.get('type', '').lower() == 'application/ld+json':
+            self._in_json_ld = True
+            self._buffer = []
+
+    def end(self, tag):
+        if tag == 'head':
+            self.done = True
+        elif tag == 'title' and self._in_title:
+            self.title = "".join(self._buffer).strip()
+            self._in_title = False
+        elif tag == 'script' and self._in_json_ld:
+            try:
+                self.json_ld.append(json.loads("".join(self._buffer)))
+            except ValueError:
+                pass # Broken JSON-LD is common; skip it
+            self._in_json_ld = False
+
+    def text(self, text, visible):
+        if self._in_title or self._in_json_ld:
+            self._buffer.append(text)
+
+    def result(self):
+        return {'title': self.title, 'meta': self.meta, 'json_ld': self.json_ld}
+
+@register('tables')
+class TableExtractor(Extractor):
+    """Cell text of the first 5 <table> elements, as lists of rows."""
+
+    def __init__(self, limit=5, max_rows=200):
+        self.limit = limit
+        self.max_rows = max_rows
+        self.tables = []
+        self._depth = 0 # Nesting depth of tables; only top-level tables are collected
+        self._row = None
+        self._cell = None
+
+    def start(self, tag, attrs):
+        if tag == 'table':
+            self._depth += 1
+            if self._depth == 1 and not self.done:
+                self.tables.append([])
+        elif self._depth == 1 and self.tables and len(self.tables) <= self.limit:
+            if tag == 'tr':
+                self._row = []
+            elif tag in ('td', 'th') and self._row is not None:
+                self._cell = []
+
+    def end(self, tag):
+        if tag == 'table' and self._depth:
+            self._depth -= 1
+            if self._depth == 0:
+                self._row = self._cell = None
+                self.done = len(self.tables) >= self.limit
+        elif self._depth == 1 and self.tables:
+            if tag in ('td', 'th') and self._cell is not None:
+                self._row.append(" ".join("".join(self._cell).split()))
+                self._cell = None
+            elif tag == 'tr' and self._row is not None:
+                if len(self.tables[-1]) < self.max_rows:
+                    self.tables[-1].append(self._row)
+                self._row = None
+
+    def text(self, text, visible):
+        if visible and self._cell is not None:
+            self._cell.append(text)
+
+    def result(self):
+        return self.tables
+
+@register('links')
+class LinkExtractor(Extractor):
+    """Unique targets of <a href> links, used by /batch to follow links. Only runs when selected."""
+    default = False
+
+    def __init__(self):
+        self.limit = config.MAX_LINKS
+        self.links = []
+        self._seen = set()
+
+    def start(self, tag, attrs):
+        if tag != 'a' or self.done:
+            return
+        href = attrs.get('href', '').strip()
+        if not href or href.startswith(('#', 'javascript:', 'mailto:', 'tel:')) or href in self._seen:
+            return
+        self._seen.add(href)
+        self.links.append(href)
+        self.done = 0 < self.limit <= len(self.links)
+
+    def result(self):
+        return self.links
+
+# --- Extraction Engine ---
+class ExtractionEngine:
+    """
+    Runs the selected extractors over a stream of parser events (start, end,
+    data) in a single pass over the document. Extractors that were not
+    selected are never instantiated, so they cost nothing. done becomes True
+    when every selected extractor with a limit is finished, and the caller
+    can then stop parsing: extractors without a limit get what the page
+    offers up to that point, and only if none has a limit is the whole page
+    read.
+    """
+
+    def __init__(self, names=None):
+        self.extractors = [EXTRACTORS[name]() for name in resolve_names(names)]
+        self._active = list(self.extractors)
+        self._limited = [extractor for extractor in self.extractors if extractor.limit] or self.extractors
+        self._skip_text = 0
+        self._text_run = [] # Text since the last tag, handled as one string
+
+    @property
+    def done(self):
+        """True once every selected extractor with a limit has everything it needs."""
+        return all(extractor.done for extractor in self._limited)
+
+    def _prune(self):
+        if any(extractor.done for extractor in self._active):
+            self._active = [extractor for extractor in self._active if not extractor.done]
+
+    def _flush_text(self):
+        # Parsers may split one run of text into several data events; handle it as
+        # one string so neither a price nor the spacing inside it is cut apart.
+        if self._text_run:
+            text = "".join(self._text_run)
+            self._text_run = []
+            for extractor in self._active:
+                extractor.text(text, not self._skip_text)
+
+    def start(self, tag, attrs):
+        self._flush_text()
+        for extractor in self._active:
+            extractor.start(tag, attrs)
+        if tag in SKIP_TEXT_TAGS:
+            self._skip_text += 1
+        self._prune()
+
+    def end(self, tag):
+        self._flush_text()
+        if tag in SKIP_TEXT_TAGS and self._skip_text:
+            self._skip_text -= 1
+        for extractor in self._active:
+            extractor.end(tag)
+        self._prune()
+
+    def data(self, text):
+        self._text_run.append(text)
+
+    def close(self):
+        self._flush_text()
+        for extractor in self._active:
+            extractor.close()
+        self._active = []
+        return self
+
+    def get(self, name):
+        """Returns the extractor with this name if it was selected, else None."""
+        for extractor in self.extractors:
+            if extractor.name == name:
+                return extractor
+        return None
+
+    def results(self):
+        """Returns {extractor name: result} for every selected extractor."""
+        return {extractor.name: extractor.result() for extractor in self.extractors}
+
+class _StdlibParser(HTMLParser):
+    """Feeds html.parser events into a target with the same interface lxml uses."""
+
+    def __init__(self, target):
+        super().__init__(convert_charrefs=True)
+        self.target = target
+
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag, {name: value or '' for name, value in attrs})
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.target.end(tag)
+
+    def handle_endtag(self, tag):
+        self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+    def close(self):
+        super().close()
+        return self.target.close()
+
+def make_parser(target):
+    """Returns a parser feeding target: lxml if installed (and not disabled), else html.parser."""
+    if etree is not None and config.HTML_PARSER != 'html.parser':
+        return etree.HTMLParser(target=target)
+    return _StdlibParser(target)
@@ -0,0 +1,164 @@
+# A stand-in for the Telegram Bot API, for trying the bot locally without
+# Telegram. It answers the Bot API calls the bot makes and records them, and
+# feeds updates to the bot's webhook route the way Telegram would:
+#     python fake_telegram.py "/start" "/uses_left" "/scrape https://example.com"
+# Updates put in its queue are handed out by getUpdates instead, for a bot polling it.
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# The bot refuses to start without these; any values work against the fake API.
+os.environ.setdefault("BOT_TOKEN", "123456:fake-token")
+os.environ.setdefault("ADMIN_ID", "1")
+
+class FakeTelegram:
+    """
+    A local HTTP server that answers Bot API methods (sendMessage,
+    sendDocument, setWebhook, ...) with plausible results and records every
+    call in calls as (method, parameters), and the time.monotonic() of the
+    first call of each method in first_calls. getUpdates hands out the
+    updates added with queue_update().
+    """
+
+    def __init__(self, port=0):
+        self.calls = []
+        self.first_calls = {}
+        self.updates = []
+        self._next_message_id = 1
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                # telebot sends most parameters in the query string and files as multipart.
+                url = urlsplit(self.path)
+                method = url.path.rsplit('/', 1)[-1]
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                params.update(fake._parse(self.headers.get('Content-Type', ''), body))
+                reply = json.dumps({'ok': True, 'result': fake._result(method, params)}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(reply)))
+                self.end_headers()
+                try:
+                    self.wfile.write(reply)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # The bot was stopped while waiting for getUpdates
+
+            do_GET = do_POST
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.port = self.server.server_address[1]
+
+    @property
+    def api_url(self):
+        """The value for telebot's apihelper.API_URL that sends its requests here."""
+        return f"http://127.0.0.1:{self.port}/bot{{0}}/{{1}}"
+
+    def serve(self):
+        """Serves in a background thread."""
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def start(self):
+        """Serves in a background thread and points telebot in this process at this server."""
+        self.serve()
+        from telebot import apihelper
+        apihelper.API_URL = self.api_url
+        return self
+
+    def queue_update(self, update):
+        """Adds an update (as JSON, see make_update()) for getUpdates to hand out."""
+        with self._lock:
+            self.updates.append(json.loads(update))
+
+    def _get_updates(self, params):
+        # Like Telegram, answers at once if there are updates from offset on,
+        # else waits a little (up to the long polling timeout) for some.
+        offset = int(params.get('offset') or 0)
+        deadline = time.monotonic() + min(float(params.get('timeout') or 0), 0.5)
+        while True:
+            with self._lock:
+                updates = [update for update in self.updates if update['update_id'] >= offset]
+            if updates or time.monotonic() >= deadline:
+                return updates
+            time.sleep(0.01)
+
+    def _parse(self, content_type, body):
+        if content_type.startswith('multipart/form-data'):
+            # Uploaded files are only counted, not decoded.
+            return {'multipart_bytes': len(body)}
+        if content_type.startswith('application/json'):
+            return json.loads(body or b'{}')
+        return {key: values[0] for key, values in parse_qs(body.decode('utf-8', 'replace')).items()}
+
+    def _result(self, method, params):
+        with self._lock:
+            self.calls.append((method, params))
+            self.first_calls.setdefault(method, time.monotonic())
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method == 'getMe':
+            return {'id': 123456, 'is_bot': True, 'first_name': 'ScrapNest', 'username': 'scrapnest_bot'}
+        if method in ('sendMessage', 'sendDocument', 'editMessageText'):
+            chat_id = int(params.get('chat_id', 0))
+            message = {'message_id': message_id, 'date': int(time.time()),
+                       'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+            if method == 'sendDocument':
+                message['document'] = {'file_id': f"file-{message_id}", 'file_unique_id': f"u{message_id}"}
+            return message
+        return True
+
+def make_update(update_id, user_id, text):
+    """Returns the JSON of a Telegram update carrying a private text message."""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}", 'username': f"user{user_id}"}
+    return json.dumps({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'from': user,
+        'chat': {'id': user_id, 'type': 'private'}, 'text': text,
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        if text.startswith('/') else []}})
+
+def post_update(webhook_url, update, secret):
+    """Delivers an update to the webhook route like Telegram does; returns the HTTP status."""
+    import requests
+    return requests.post(webhook_url, data=update, timeout=10, headers={
+        'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret}).status_code
+
+if __name__ == '__main__':
+    telegram = FakeTelegram().start()
+    os.environ.setdefault("PORT", "8090")
+    os.environ.setdefault("WEBHOOK_URL", f"http://127.0.0.1:{os.environ['PORT']}")
+    import config
+    import bot
+    from keep_alive import keep_alive
+
+    bot.start_services()
+    bot.use_webhook()
+    keep_alive()
+    webhook_url = config.WEBHOOK_URL + config.WEBHOOK_PATH
+    time.sleep(1) # Let the web server start
+
+    # Telegram's webhook registration, then an update with a wrong secret.
+    print("setWebhook:", [params for method, params in telegram.calls if method == 'setWebhook'])
+    print("Update with a wrong secret ->", post_update(webhook_url, make_update(1, 42, "/start"), "wrong"))
+
+    texts = sys.argv[1:] or ["/start", "/uses_left"]
+    for update_id, text in enumerate(texts, start=2):
+        print(f"{text!r} ->", post_update(webhook_url, make_update(update_id, 42, text), config.WEBHOOK_SECRET))
+
+    # Handlers and scrapes run on background threads; give them time to answer.
+    time.sleep(float(os.getenv("FAKE_TELEGRAM_WAIT", "3")))
+    for method, params in telegram.calls:
+        if method != 'setWebhook':
+            print(method, params.get('chat_id', ''), params.get('text', params))
+    os._exit(0) # The web server thread does not stop on its own
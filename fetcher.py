@@ -0,0 +1,406 @@
+# All HTTP fetching of pages and media, written once with asyncio and aiohttp.
+# async_bot.py awaits these coroutines on its own event loop with its own
+# session. The threads of bot.py and worker.py call them through run_sync(),
+# which runs them on a shared background event loop with one process-wide
+# session, so connections to the same host are kept alive between scrapes.
+import asyncio
+import atexit
+import contextvars
+import functools
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+import aiohttp
+
+import config
+from archive import spooled_file
+from instrument import span
+from media import MediaStage
+from ratelimit import HostThrottle, CircuitBreaker
+
+# User-agent sent with every request to mimic a browser.
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# The shared event loop, its session and the pool for blocking work are
+# created on first use and then reused by every scrape.
+_loop = None
+_loop_thread = None
+_session = None
+_blocking_executor = None
+_lock = threading.Lock()
+
+# Request pacing and circuit breakers per host, shared by every request of this process.
+host_throttle = HostThrottle(config.HOST_RATE, config.HOST_BURST, max_backoff=config.HOST_MAX_BACKOFF)
+circuit_breaker = CircuitBreaker(config.BREAKER_FAILURES, config.BREAKER_COOLDOWN)
+
+# Answers worth retrying: the server is overloaded or a gateway failed, not the request itself.
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# When the fetches of the running job must be done by (a time.monotonic() value), if set.
+_deadline = contextvars.ContextVar('fetch_deadline', default=None)
+
+class HostBusyError(aiohttp.ClientError):
+    """Raised instead of sending a request when its host would not be ready within HOST_MAX_WAIT seconds."""
+
+class OriginDownError(aiohttp.ClientError):
+    """Raised instead of sending a request to a host whose circuit breaker is open."""
+
+# What a failed fetch raises: network and HTTP errors (including the two
+# above) and timeouts. Callers catch these to report a page as unreachable.
+FETCH_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+@contextmanager
+def fetch_deadline(deadline):
+    """Stops requests made inside from retrying past deadline (a time.monotonic() value)."""
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def retry_delay(attempt):
+    """Seconds to wait before retry number attempt + 1: exponential backoff with full jitter."""
+    return random.uniform(0, min(config.RETRY_MAX_BACKOFF, config.RETRY_BACKOFF * 2 ** attempt))
+
+def create_session():
+    """
+    Returns a new aiohttp.ClientSession whose connection pool holds up to
+    FETCH_CONNECTIONS connections, at most DOWNLOAD_PER_HOST of them to one
+    host. Call it from inside the running event loop and close it when done.
+    """
+    connector = aiohttp.TCPConnector(limit=config.FETCH_CONNECTIONS, limit_per_host=config.DOWNLOAD_PER_HOST)
+    # A stalled connection or read fails instead of hanging; pages also stop at PAGE_TIMEOUT.
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=config.CONNECT_TIMEOUT,
+                                    sock_read=config.READ_TIMEOUT)
+    # Accept-Encoding is left to aiohttp, which offers gzip and deflate, plus
+    # br and zstd when the Brotli or zstandard packages are installed.
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers={'User-Agent': USER_AGENT})
+
+async def resilient_get(session, url, deadline=None, **kwargs):
+    """
+    session.get(url, **kwargs), returning the response (release it when
+    done). For every request it:
+    - fails fast with OriginDownError while the host's circuit breaker is open;
+    - waits for the host's turn in host_throttle, and backs off from hosts
+      answering 429 or 503;
+    - retries failed connections, timeouts and RETRY_STATUSES answers, up to
+      FETCH_RETRIES times with jittered exponential backoff, but never past
+      deadline (by default the job's fetch_deadline()).
+    """
+    host = urlsplit(url).netloc.lower()
+    if deadline is None:
+        deadline = _deadline.get()
+    for attempt in range(config.FETCH_RETRIES + 1):
+        retry_in = circuit_breaker.retry_in(host)
+        if retry_in:
+            raise OriginDownError(f"{host} is not responding; not trying it again for {retry_in:.0f}s.")
+        if not await host_throttle.acquire_async(host, config.HOST_MAX_WAIT):
+            raise HostBusyError(f"Too many requests to {host} right now; try again later.")
+
+        error = response = None
+        try:
+            response = await session.get(url, **kwargs)
+        except aiohttp.ClientSSLError:
+            circuit_breaker.failure(host)
+            raise # A certificate problem does not go away by retrying
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            circuit_breaker.failure(host)
+            error = e
+        else:
+            if response.status >= 500:
+                circuit_breaker.failure(host)
+            else:
+                circuit_breaker.success(host)
+            delay = host_throttle.observe(host, response.status, response.headers.get('Retry-After'))
+            if delay:
+                print(f"{host} answered {response.status}; pausing requests to it for {delay:.0f}s.")
+            if response.status not in RETRY_STATUSES:
+                return response
+
+        pause = retry_delay(attempt)
+        if attempt == config.FETCH_RETRIES or (deadline is not None and time.monotonic() + pause > deadline):
+            if error is not None:
+                raise error
+            return response
+        if response is not None:
+            response.release()
+        await asyncio.sleep(pause)
+
+async def _get_text(session, url, raise_for_status, timeout):
+    kwargs = {'timeout': aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+    async with await resilient_get(session, url, **kwargs) as response:
+        if raise_for_status:
+            response.raise_for_status()
+        return response.status, await response.text(errors='replace')
+
+def fetch_text(url, raise_for_status=True, timeout=None):
+    """
+    Fetches a small text document (a robots.txt, a results page) and returns
+    (status, text). HTTP errors are raised unless raise_for_status is False;
+    timeout limits the whole request in seconds.
+    """
+    return run_sync(_get_text, url, raise_for_status, timeout)
+
+# --- Shared Event Loop ---
+def _get_loop():
+    """Returns the shared event loop, starting its thread on first use."""
+    global _loop, _loop_thread
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=loop.run_forever, name='fetch-loop', daemon=True)
+            _loop_thread.start()
+            _loop = loop
+            atexit.register(_close_session)
+        return _loop
+
+def _close_session():
+    # Lets aiohttp close its connections cleanly at exit instead of warning about them.
+    if _session is not None:
+        try:
+            asyncio.run_coroutine_threadsafe(_session.close(), _loop).result(timeout=5)
+        except Exception:
+            pass
+
+async def _with_session(function, args, kwargs):
+    global _session
+    if _session is None:
+        _session = create_session() # Created on the loop it belongs to; only this thread touches it
+    return await function(_session, *args, **kwargs)
+
+def _copy_outcome(task, future):
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+def run_sync(function, *args, **kwargs):
+    """
+    Runs the coroutine function(session, *args, **kwargs) on the shared event
+    loop with the process-wide session, and blocks until it returns its
+    result or raises. The coroutine runs in a copy of the caller's context,
+    so its spans join the job's trace and fetch_deadline() applies. Must not
+    be called from the shared loop itself.
+    """
+    loop = _get_loop()
+    if threading.current_thread() is _loop_thread:
+        raise RuntimeError("run_sync() was called on the fetch loop; await the coroutine instead.")
+    context = contextvars.copy_context()
+    future = Future()
+
+    def start():
+        task = context.run(loop.create_task, _with_session(function, args, kwargs))
+        task.add_done_callback(lambda task: _copy_outcome(task, future))
+
+    loop.call_soon_threadsafe(start)
+    return future.result()
+
+def _get_blocking_executor():
+    global _blocking_executor
+    with _lock:
+        if _blocking_executor is None:
+            _blocking_executor = ThreadPoolExecutor(thread_name_prefix='blocking')
+        return _blocking_executor
+
+async def run_blocking(function, *args):
+    """
+    Runs a short blocking call (parsing, disk or database work) on a thread
+    and returns its result, so the event loop keeps serving other scrapes.
+    Unlike asyncio.to_thread() it has a pool of its own, so it never waits
+    behind long-running to_thread() calls such as a whole crawl.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_blocking_executor(), functools.partial(context.run, function, *args))
+
+def normalize_url(url):
+    """
+    Returns url in a canonical form for comparing pages: scheme and host
+    lower-cased, default port and fragment dropped, and an empty path as "/".
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, parts.port) in (('http', 80), ('https', 443)):
+        netloc = netloc.rsplit(':', 1)[0]
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+# Size of each chunk read from the network and written to disk.
+CHUNK_SIZE = 64 * 1024
+
+class JobBudget:
+    """Tracks the bytes saved by all downloads of one scrape (or batch) against a limit."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self, size):
+        """Reserves up to size bytes and returns how many may actually be written."""
+        with self._lock:
+            allowed = max(min(size, self.limit - self.used), 0)
+            self.used += allowed
+            return allowed
+
+    def release(self, size):
+        """Gives back size bytes taken for a file that was dropped or made smaller."""
+        with self._lock:
+            self.used -= size
+
+    def exhausted(self):
+        """Returns True once the job has used its whole byte budget."""
+        with self._lock:
+            return self.used >= self.limit
+
+def _store(archive, spool, result, deadline, budget, media):
+    """
+    Passes a finished download through the media stage, adds what is kept to
+    the archive and frees it. Returns True if it was saved. Runs on a thread.
+    """
+    try:
+        downloaded = result['bytes']
+        fileobj = media.process(spool, result, deadline)
+        # Bytes of dropped or recompressed files no longer count against the job's limit.
+        budget.release(downloaded - (result['bytes'] if fileobj is not None else 0))
+        if fileobj is None:
+            return False
+        try:
+            saved = archive.write_stream(result['filename'], fileobj)
+        finally:
+            if fileobj is not spool:
+                fileobj.close()
+        if not saved:
+            result['error'] = "Finished after the archive was closed."
+        return saved
+    finally:
+        spool.close()
+
+async def _download_one(session, asset, archive, deadline, budget, media):
+    """Streams a single asset in chunks, passes it through the media stage and adds it to the archive."""
+    url = asset['url']
+    result = {'url': url, 'filename': asset['filename'], 'saved': False, 'error': None,
+              'bytes': 0, 'truncated': False}
+    spool = None
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        result['error'] = "Job deadline reached before download started."
+        return result
+    if budget.exhausted():
+        result['error'] = "Skipped: job size limit reached."
+        return result
+    # The asset must finish within its own timeout and the job deadline.
+    timeout = aiohttp.ClientTimeout(total=min(config.DOWNLOAD_TIMEOUT, remaining))
+    try:
+        async with await resilient_get(session, url, deadline, timeout=timeout) as response:
+            response.raise_for_status()
+
+            # Skip assets that announce a size over the limit before reading any body.
+            if response.content_length and response.content_length > config.MAX_ASSET_BYTES:
+                result['error'] = f"Skipped: size {response.content_length} bytes exceeds the {config.MAX_ASSET_BYTES} byte limit."
+                return result
+
+            # Write chunk by chunk into a spooled buffer, which only moves to
+            # disk for large files, so memory use stays flat regardless of size.
+            spool = spooled_file()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                allowed = min(len(chunk), config.MAX_ASSET_BYTES - result['bytes'])
+                allowed = budget.take(allowed)
+                spool.write(chunk[:allowed])
+                result['bytes'] += allowed
+                if allowed < len(chunk):
+                    result['truncated'] = True
+                    result['error'] = "Stopped early: size limit reached."
+                    break
+    except asyncio.TimeoutError:
+        print(f"Download of {url} timed out.")
+        result['error'] = "Stopped early: download timed out." if spool is not None else "Download timed out."
+        result['truncated'] = spool is not None
+    except aiohttp.ClientError as e:
+        print(f"Failed to download {url}: {e}")
+        result['error'] = str(e)
+        result['truncated'] = spool is not None
+    except Exception as e:
+        print(f"Error saving {url}: {e}")
+        result['error'] = str(e)
+        result['truncated'] = spool is not None
+
+    if spool is None:
+        return result
+    # An empty partial file carries no data, so do not keep it around.
+    if result['bytes'] == 0 and result['truncated']:
+        result['truncated'] = False
+        spool.close()
+        return result
+    # Hashing, recompressing and copying into the zip may hit the disk, so
+    # they run on a thread. It is shielded so a cancelled download never
+    # closes a spool still being read.
+    result['saved'] = await asyncio.shield(run_blocking(_store, archive, spool, result, deadline, budget, media))
+    return result
+
+async def _timed_download(session, asset, archive, deadline, budget, media):
+    """
+    Runs _download_one as a 'download' span, counting downloads that did not
+    complete as errors. Retries stop at the job deadline.
+    """
+    with span('download') as download, fetch_deadline(deadline):
+        result = await _download_one(session, asset, archive, deadline, budget, media)
+        if result['truncated']:
+            download.fail('truncated')
+        elif result['error'] and not result['saved']:
+            download.fail('skipped' if result['error'].startswith(("Skipped", "Job deadline")) else 'failed')
+    return result
+
+async def download_assets_async(session, assets, archive, job_timeout=None, budget=None, media=None):
+    """
+    Downloads a list of assets concurrently and adds them to an ArchiveBuilder.
+
+    Each asset is a dict with 'url' and 'filename' keys. At most
+    DOWNLOAD_PER_JOB downloads of one call hold a connection at once; they
+    reuse the session's keep-alive connections and are streamed in chunks.
+    Returns one result dict per asset, in the same order, with 'saved' and
+    'bytes' set for whatever was added and 'error' set on failure. A
+    download cut short by MAX_ASSET_BYTES, MAX_JOB_BYTES or a timeout keeps
+    its partial file and is marked 'truncated'. Assets that have not
+    finished when the job deadline is reached are reported as timed out.
+    Every download goes through a MediaStage, which may rename, recompress or
+    drop it (see media.py). Pass a JobBudget and a MediaStage to share one
+    byte limit and duplicate check between several calls.
+    """
+    if not assets:
+        return []
+
+    job_timeout = config.SCRAPE_JOB_TIMEOUT if job_timeout is None else job_timeout
+    deadline = time.monotonic() + job_timeout
+    if budget is None:
+        budget = JobBudget(config.MAX_JOB_BYTES)
+    if media is None:
+        media = MediaStage()
+    lanes = asyncio.Semaphore(config.DOWNLOAD_PER_JOB)
+
+    async def run_in_lane(asset):
+        async with lanes:
+            return await _timed_download(session, asset, archive, deadline, budget, media)
+
+    tasks = [asyncio.ensure_future(run_in_lane(asset)) for asset in assets]
+
+    # Wait for all downloads, but never past the job deadline.
+    await asyncio.wait(tasks, timeout=job_timeout)
+
+    results = []
+    for asset, task in zip(assets, tasks):
+        if task.done():
+            results.append(task.result())
+        else:
+            task.cancel()
+            print(f"Download of {asset['url']} did not finish before the job deadline.")
+            results.append({'url': asset['url'], 'filename': asset['filename'], 'saved': False,
+                            'error': "Job deadline reached.", 'bytes': 0, 'truncated': False})
+    return results
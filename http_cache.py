@@ -0,0 +1,374 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import config
+from db import get_connection, transaction
+from fetcher import resilient_get, run_blocking, normalize_url, CHUNK_SIZE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS http_cache (
+    url TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    encoding TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    expires REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS http_cache_lru ON http_cache (last_access);
+"""
+
+def _http_date(value):
+    """Parses an HTTP date header into a timestamp, or returns None."""
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def freshness(headers, now=None):
+    """
+    Reads the caching headers of a response and returns (storable, expires):
+    whether the body may be cached at all, and until when it can be used
+    without asking the server again. Follows Cache-Control (no-store,
+    no-cache, max-age), then Expires, then the usual heuristic of 10% of the
+    time since Last-Modified, capped at HTTP_CACHE_HEURISTIC_MAX.
+    """
+    now = time.time() if now is None else now
+    directives = {}
+    for part in headers.get('Cache-Control', '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip().strip('"')
+
+    # Every request sends the same headers, so only "Vary: *" rules out reuse.
+    if 'no-store' in directives or headers.get('Vary', '').strip() == '*':
+        return False, now
+    if 'no-cache' in directives:
+        return True, now
+    if directives.get('max-age', '').isdigit():
+        return True, now + int(directives['max-age'])
+
+    date = _http_date(headers.get('Date')) or now
+    expires = headers.get('Expires')
+    if expires:
+        expires_at = _http_date(expires)
+        # An invalid Expires value (often "0" or "-1") means already expired.
+        return True, now + max(expires_at - date, 0) if expires_at else now
+
+    last_modified = _http_date(headers.get('Last-Modified'))
+    if last_modified and last_modified < date:
+        return True, now + min((date - last_modified) / 10, config.HTTP_CACHE_HEURISTIC_MAX)
+    return True, now
+
+class PageResponse:
+    """
+    A page fetched from the network, wrapping an aiohttp response. Read it
+    with iter_chunks() and close it when done (or use it with async with).
+    CachedResponse offers the same interface, so callers do not need to know
+    where the page came from.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self.url = str(response.url)
+        self.status = response.status
+        self.headers = response.headers
+        self.encoding = response.charset
+        self.from_cache = False
+        self.revalidated = False
+
+    def raise_for_status(self):
+        self._response.raise_for_status()
+
+    async def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        async for chunk in self._response.content.iter_chunked(chunk_size):
+            yield chunk
+
+    def close(self):
+        self._response.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+class CachedResponse:
+    """
+    A page body served from the cache. revalidated is True if the server
+    confirmed the copy with a 304 Not Modified.
+    """
+    status = 200
+
+    def __init__(self, url, fileobj, encoding, revalidated=False):
+        self.url = url
+        self.encoding = encoding
+        self.from_cache = True
+        self.revalidated = revalidated
+        self._file = fileobj
+
+    def raise_for_status(self):
+        pass
+
+    async def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        while True:
+            chunk = await run_blocking(self._file.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._file.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+class _RecordingResponse(PageResponse):
+    """
+    A network response that copies the body into the cache while the caller
+    reads it. A caller that stops early (once its extractors have what they
+    need) leaves the rest of the body to be read in the background when it
+    exits the response's async with, so the page is still cached. The entry
+    is only stored if the whole body fits in HTTP_CACHE_MAX_ENTRY_BYTES.
+    """
+
+    def __init__(self, cache, key, response, expires):
+        super().__init__(response)
+        self._cache = cache
+        self._key = key
+        self._expires = expires
+        self._recording = True
+        self._out = None
+        self._tmp_path = None
+        self._size = 0
+
+    async def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        async for chunk in super().iter_chunks(chunk_size):
+            await self._record(chunk)
+            yield chunk
+        # Only reached when the caller read the whole body.
+        await self._store()
+
+    async def _record(self, chunk):
+        """Appends chunk to the entry, giving up on it once the body is too large."""
+        if not self._recording:
+            return
+        self._size += len(chunk)
+        if self._size > config.HTTP_CACHE_MAX_ENTRY_BYTES:
+            self._recording = False
+            await run_blocking(self._discard)
+            return
+        if self._out is None:
+            await run_blocking(self._open)
+        await run_blocking(self._out.write, chunk)
+
+    def _open(self):
+        fd, self._tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self._cache.directory)
+        self._out = os.fdopen(fd, 'wb')
+
+    def _discard(self):
+        """Deletes the partly written entry."""
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        if self._tmp_path is not None and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+        self._tmp_path = None
+
+    async def _store(self):
+        if not self._recording:
+            return
+        self._recording = False
+        try:
+            if self._out is None:
+                await run_blocking(self._open) # An empty body
+            await run_blocking(self._out.close)
+            await run_blocking(self._cache.store, self._key, self, self._tmp_path, self._size, self._expires)
+        finally:
+            await run_blocking(self._discard)
+
+    async def _finish(self):
+        """Reads the rest of the body into the entry and stores it, then closes the response."""
+        try:
+            async for chunk in super().iter_chunks():
+                await self._record(chunk)
+                if not self._recording:
+                    break
+            await self._store()
+        except Exception as e:
+            print(f"Could not cache {self.url}: {e}")
+        finally:
+            self.close()
+
+    def close(self):
+        self._recording = False
+        self._discard()
+        super().close()
+
+    async def __aexit__(self, exc_type, *exc):
+        if exc_type is None and self._recording:
+            self._cache.in_background(self._finish())
+        else:
+            self.close()
+
+class HttpCache:
+    """
+    An on-disk HTTP cache for page fetches, keyed by normalized URL.
+
+    Fresh entries are served without touching the network. Stale entries with
+    an ETag or Last-Modified validator are revalidated with a conditional GET
+    (If-None-Match / If-Modified-Since), so an unchanged page costs a 304
+    instead of a full download. The least recently used entries are evicted
+    once the cache holds more than max_bytes. Its database and file work runs
+    on threads (see fetcher.run_blocking), never on the event loop.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._background = set() # Tasks finishing entries whose readers stopped early
+        os.makedirs(directory, exist_ok=True)
+        get_connection().executescript(SCHEMA)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def _lookup(self, key, now):
+        """
+        Returns (row, open file) for the cached copy of key, or (None, None).
+        A fresh copy is marked as used.
+        """
+        conn = get_connection()
+        row = conn.execute("SELECT * FROM http_cache WHERE url = ?", (key,)).fetchone()
+        if row is None:
+            return None, None
+        try:
+            # Opened right away, so a concurrent eviction cannot pull the file away mid-read.
+            cached = open(row['path'], 'rb')
+        except OSError:
+            self._remove(key)
+            return None, None
+        if row['expires'] > now:
+            conn.execute("UPDATE http_cache SET last_access = ? WHERE url = ?", (now, key))
+        return row, cached
+
+    def _revalidated(self, key, headers, now):
+        # The server may send updated caching headers along with the 304.
+        _, expires = freshness(headers, now)
+        get_connection().execute(
+            "UPDATE http_cache SET expires = ?, last_access = ?, etag = COALESCE(?, etag), "
+            "last_modified = COALESCE(?, last_modified) WHERE url = ?",
+            (expires, now, headers.get('ETag'), headers.get('Last-Modified'), key))
+
+    async def get(self, session, url, deadline=None):
+        """
+        Fetches url with fetcher.resilient_get and returns a response to read
+        with iter_chunks() and close: a CachedResponse when the cached copy
+        is fresh or was revalidated, otherwise a PageResponse, which is added
+        to the cache as it is read.
+        """
+        key = normalize_url(url)
+        now = time.time()
+        row, cached = await run_blocking(self._lookup, key, now)
+
+        headers = {}
+        if row is not None:
+            if row['expires'] > now:
+                return CachedResponse(url, cached, row['encoding'])
+            if row['etag']:
+                headers['If-None-Match'] = row['etag']
+            if row['last_modified']:
+                headers['If-Modified-Since'] = row['last_modified']
+
+        try:
+            response = await resilient_get(session, url, deadline, headers=headers)
+        except BaseException:
+            if cached:
+                cached.close()
+            raise
+
+        if response.status == 304 and cached:
+            response.release()
+            await run_blocking(self._revalidated, key, response.headers, now)
+            return CachedResponse(url, cached, row['encoding'], revalidated=True)
+
+        if cached:
+            cached.close()
+        storable, expires = freshness(response.headers, now)
+        has_validator = 'ETag' in response.headers or 'Last-Modified' in response.headers
+        if response.status != 200 or not storable or (expires <= now and not has_validator):
+            return PageResponse(response)
+        return _RecordingResponse(self, key, response, expires)
+
+    def in_background(self, coroutine):
+        """Runs coroutine as a task on the running loop, holding on to it until it is done."""
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def wait_background(self):
+        """Waits until the entries being finished in the background are stored."""
+        while self._background:
+            await asyncio.gather(*self._background)
+
+    def store(self, key, response, tmp_path, size, expires):
+        """Moves a fully read body into the cache under key and records its validators."""
+        path = self._path(key)
+        os.replace(tmp_path, path)
+        get_connection().execute(
+            "INSERT OR REPLACE INTO http_cache (url, path, size, encoding, etag, last_modified, expires, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, path, size, response.encoding, response.headers.get('ETag'),
+             response.headers.get('Last-Modified'), expires, time.time()))
+        self._evict()
+
+    def _remove(self, key):
+        """Deletes a cache entry and its file."""
+        with transaction() as conn:
+            row = conn.execute("SELECT path FROM http_cache WHERE url = ?", (key,)).fetchone()
+            conn.execute("DELETE FROM http_cache WHERE url = ?", (key,))
+        if row and os.path.exists(row['path']):
+            os.remove(row['path'])
+
+    def _evict(self):
+        """Drops least recently used entries until the cache is under max_bytes."""
+        conn = get_connection()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM http_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for row in conn.execute("SELECT url, size FROM http_cache ORDER BY last_access").fetchall():
+            self._remove(row['url'])
+            total -= row['size']
+            if total <= self.max_bytes:
+                break
+
+# Created on first use, like the shared session.
+_cache = None
+_lock = threading.Lock()
+
+def _get_cache():
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = HttpCache(config.HTTP_CACHE_DIR, config.HTTP_CACHE_MAX_BYTES)
+        return _cache
+
+async def fetch_page_async(session, url, deadline=None):
+    """
+    Fetches a page through the HTTP cache (or straight from the network if
+    HTTP_CACHE_MAX_BYTES is 0). Read the result with iter_chunks() and close
+    it when done, or use it with async with.
+    """
+    if config.HTTP_CACHE_MAX_BYTES <= 0:
+        return PageResponse(await resilient_get(session, url, deadline))
+    cache = await run_blocking(_get_cache)
+    return await cache.get(session, url, deadline)
@@ -0,0 +1,235 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+# Upper bounds (in seconds) of the stage duration histogram buckets.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def _value_text(value):
+    # Full precision: with :g large counts and sums would stop changing after 6 digits.
+    if isinstance(value, int):
+        return str(value)
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+class Counter:
+    """A monotonically increasing count per label set."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+class Gauge(Counter):
+    """A value per label set that is set rather than counted up."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    """Counts observations per label set in fixed buckets, with their sum, as Prometheus histograms do."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._values = {} # Maps a label set to [count per bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry):
+                    cumulative += count
+                    samples.append((self.name + '_bucket', key + (('le', f"{bound:g}"),), cumulative))
+                samples.append((self.name + '_bucket', key + (('le', '+Inf'),), entry[-1]))
+                samples.append((self.name + '_sum', key, entry[-2]))
+                samples.append((self.name + '_count', key, entry[-1]))
+        return samples
+
+class Registry:
+    """The metrics of this process, rendered in the Prometheus text format by render()."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name, help):
+        """Returns the counter called name, creating it on first use."""
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help):
+        """Returns the gauge called name, creating it on first use."""
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name, help, buckets=DURATION_BUCKETS):
+        """Returns the histogram called name, creating it on first use."""
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_label_text(labels)} {_value_text(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+def serve_metrics(port):
+    """
+    Serves the registry on /metrics at port from a background thread, for
+    processes without the keep-alive server (worker.py, async_bot.py).
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+STAGE_SECONDS = registry.histogram('scrapnest_stage_duration_seconds',
+                                   "Time spent in each stage of a scrape job.")
+STAGE_ERRORS = registry.counter('scrapnest_stage_errors_total',
+                                "Stages that failed, by stage and error type.")
+
+# The trace of the job running in this context, if trace logging is on.
+_current_trace = contextvars.ContextVar('scrapnest_trace', default=None)
+_trace_lock = threading.Lock()
+
+class Span:
+    """One timed stage. Call fail() for errors that are handled inside the stage rather than raised."""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.error = None
+
+    def fail(self, error):
+        self.error = error if isinstance(error, str) else type(error).__name__
+
+@contextmanager
+def span(stage):
+    """
+    Times the enclosed block as stage: its duration goes into the stage
+    histogram, a raised exception (or fail()) into the error counter, and
+    both into the running job's trace.
+    """
+    current = Span(stage)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(e)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, stage=stage)
+        if current.error:
+            STAGE_ERRORS.inc(stage=stage, error=current.error)
+        trace = _current_trace.get()
+        if trace is not None:
+            with _trace_lock:
+                trace['spans'].append({'stage': stage, 'start': round(started - trace['_started'], 4),
+                                       'seconds': round(duration, 4), 'error': current.error})
+
+@contextmanager
+def trace_job(job_id, **fields):
+    """
+    Collects the spans of one job. If TRACE_LOG is set, a JSON line with
+    every span and the total time per stage is appended to it at the end.
+    Spans on download threads and asyncio tasks started inside belong to the
+    job too, as long as they run in a copy of this context.
+    """
+    if not config.TRACE_LOG:
+        yield
+        return
+    trace = {'job_id': job_id, **fields, 'spans': [], '_started': time.perf_counter()}
+    token = _current_trace.set(trace)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+        # Downloads cut off by the job deadline may still add spans; they are left out.
+        with _trace_lock:
+            spans = list(trace['spans'])
+        stages = {}
+        for entry in spans:
+            stage = stages.setdefault(entry['stage'], {'count': 0, 'seconds': 0})
+            stage['count'] += 1
+            stage['seconds'] = round(stage['seconds'] + entry['seconds'], 4)
+        record = {'job_id': job_id, **fields, 'time': time.time(),
+                  'seconds': round(time.perf_counter() - trace['_started'], 4),
+                  'stages': stages, 'spans': spans}
+        line = json.dumps(record, ensure_ascii=False)
+        with _trace_lock:
+            with open(config.TRACE_LOG, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
@@ -0,0 +1,283 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+
+import config
+from db import get_connection, transaction
+
+class QueueFullError(Exception):
+    """Raised when the queue already holds the maximum number of pending jobs."""
+
+class UserLimitError(Exception):
+    """Raised when a user already has the maximum number of jobs queued or running."""
+
+# Job states: 'queued' -> 'running' -> 'done' or 'failed'.
+# A 'running' job whose lease has expired belonged to a worker that crashed
+# or was restarted; it is handed out again until max_attempts is reached.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error TEXT,
+    reported INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, status);
+"""
+
+class JobStore:
+    """
+    A durable scrape job queue stored in SQLite.
+
+    The bot process only calls enqueue(). Worker threads or processes call
+    claim() to lease the oldest job, renew() while working on it, and then
+    complete() or fail() it. The bot process later picks up finished jobs
+    with finished() and marks them reported once the user has been told.
+    """
+
+    def __init__(self, per_user=1, max_pending=100, lease_seconds=120, max_attempts=3):
+        self.per_user = per_user
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        get_connection().executescript(SCHEMA)
+
+    def enqueue(self, user_id, chat_id, payload):
+        """
+        Stores a new job and returns its position in the queue (1 means next).
+        payload is a JSON-serializable dict describing the scrape.
+        """
+        now = time.time()
+        with transaction() as conn:
+            user_jobs = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status IN ('queued', 'running')",
+                (user_id,)).fetchone()[0]
+            if user_jobs >= self.per_user:
+                raise UserLimitError(f"You already have {user_jobs} scrape(s) in progress.")
+            pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if pending >= self.max_pending:
+                raise QueueFullError("The scrape queue is full.")
+            conn.execute(
+                "INSERT INTO jobs (user_id, chat_id, payload, created, updated) VALUES (?, ?, ?, ?, ?)",
+                (user_id, chat_id, json.dumps(payload), now, now))
+            return pending + 1
+
+    def claim(self, worker_id):
+        """
+        Leases the oldest runnable job to worker_id and returns it as a dict,
+        or returns None if there is nothing to do.
+        """
+        now = time.time()
+        with transaction() as conn:
+            # Jobs abandoned by crashed workers too many times are given up on.
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Worker crashed repeatedly.', updated = ? "
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts))
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_owner = ?, "
+                "lease_expires = ?, updated = ? WHERE id = ?",
+                (worker_id, now + self.lease_seconds, now, row['id']))
+        job = self._to_job(row, attempts=row['attempts'] + 1)
+        job['status'] = 'running'
+        return job
+
+    def renew(self, job_id, worker_id):
+        """Extends the lease on a job this worker is still working on."""
+        now = time.time()
+        get_connection().execute(
+            "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+            (now + self.lease_seconds, now, job_id, worker_id))
+
+    def complete(self, job_id, worker_id):
+        """Marks a job as successfully finished."""
+        self._finish(job_id, worker_id, 'done', None)
+
+    def fail(self, job_id, worker_id, error):
+        """Marks a job as failed with an error message for the user."""
+        self._finish(job_id, worker_id, 'failed', str(error))
+
+    def _finish(self, job_id, worker_id, status, error):
+        # The lease_owner check stops a worker whose lease already expired from
+        # overwriting the result of the worker that took the job over.
+        get_connection().execute(
+            "UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, lease_expires = NULL, updated = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (status, error, time.time(), job_id, worker_id))
+
+    def finished(self, limit=50):
+        """Returns finished jobs whose results have not been reported to the user yet."""
+        rows = get_connection().execute(
+            "SELECT * FROM jobs WHERE status IN ('done', 'failed') AND reported = 0 ORDER BY id LIMIT ?",
+            (limit,)).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def mark_reported(self, job_id):
+        """Records that the user has been told about a finished job."""
+        get_connection().execute("UPDATE jobs SET reported = 1 WHERE id = ?", (job_id,))
+
+    def stats(self):
+        """Returns a (pending, running) tuple."""
+        rows = get_connection().execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status").fetchall()
+        counts = {row[0]: row[1] for row in rows}
+        return counts.get('queued', 0), counts.get('running', 0)
+
+    @staticmethod
+    def _to_job(row, attempts=None):
+        job = json.loads(row['payload'])
+        job.update({'id': row['id'], 'user_id': row['user_id'], 'chat_id': row['chat_id'],
+                    'status': row['status'], 'error': row['error'],
+                    'attempts': row['attempts'] if attempts is None else attempts})
+        return job
+
+def open_job_store():
+    """Returns a JobStore configured from config.py."""
+    return JobStore(per_user=config.MAX_JOBS_PER_USER, max_pending=config.MAX_PENDING_JOBS,
+                    lease_seconds=config.JOB_LEASE_SECONDS, max_attempts=config.JOB_MAX_ATTEMPTS)
+
+class WorkerPool:
+    """
+    A fixed number of threads that claim jobs from a JobStore and run
+    handler(job) for each. While a job runs its lease is renewed in the
+    background, so only a worker that really died loses its job.
+    """
+
+    def __init__(self, store, handler, workers=2, poll_interval=1.0):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Starts the worker threads. Safe to call more than once."""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            worker_id = f"{socket.gethostname()}:{os.getpid()}:{i+1}"
+            t = threading.Thread(target=self._work, args=(worker_id,), name=f"scrape-worker-{i+1}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        """Asks the workers to exit once their current job is done."""
+        self._stop.set()
+
+    def join(self):
+        """Waits for all worker threads to exit."""
+        for t in self._threads:
+            t.join()
+
+    def _work(self, worker_id):
+        """Worker loop: claims jobs and runs the handler for each."""
+        while not self._stop.is_set():
+            try:
+                job = self.store.claim(worker_id)
+            except Exception as e:
+                print(f"Worker {worker_id} could not claim a job: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job['id'], worker_id, done), daemon=True)
+            heartbeat.start()
+            try:
+                self.handler(job)
+                self.store.complete(job['id'], worker_id)
+            except Exception as e:
+                print(f"Error in scrape job {job['id']} for user {job['user_id']}: {e}")
+                self.store.fail(job['id'], worker_id, e)
+            finally:
+                done.set()
+
+    def _heartbeat(self, job_id, worker_id, done):
+        """Renews the job lease until the job is done."""
+        while not done.wait(self.store.lease_seconds / 3):
+            try:
+                self.store.renew(job_id, worker_id)
+            except Exception as e:
+                print(f"Could not renew lease on job {job_id}: {e}")
+
+class AsyncJobRunner:
+    """
+    The asyncio counterpart of WorkerPool: one event loop claims jobs from a
+    JobStore and runs up to max_jobs of them at once as coroutines,
+    await handler(job). One heartbeat task renews the leases of all running
+    jobs. Store calls run on threads so they never block the loop.
+    """
+
+    def __init__(self, store, handler, max_jobs=100, poll_interval=1.0):
+        self.store = store
+        self.handler = handler
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:async"
+        self._stopping = False
+        self._running = {} # Maps each running task to its job ID
+
+    def stop(self):
+        """Stops claiming new jobs; run() returns once the running ones are done."""
+        self._stopping = True
+
+    async def run(self):
+        """Claims and runs jobs until stop() is called."""
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while not self._stopping:
+                if len(self._running) >= self.max_jobs:
+                    await asyncio.wait(list(self._running), timeout=self.poll_interval,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                try:
+                    job = await asyncio.to_thread(self.store.claim, self.worker_id)
+                except Exception as e:
+                    print(f"Worker {self.worker_id} could not claim a job: {e}")
+                    job = None
+                if job is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                task = asyncio.create_task(self._run_job(job))
+                self._running[task] = job['id']
+                task.add_done_callback(self._running.pop)
+            if self._running:
+                await asyncio.wait(list(self._running))
+        finally:
+            heartbeat.cancel()
+
+    async def _run_job(self, job):
+        try:
+            await self.handler(job)
+            await asyncio.to_thread(self.store.complete, job['id'], self.worker_id)
+        except Exception as e:
+            print(f"Error in scrape job {job['id']} for user {job['user_id']}: {e}")
+            await asyncio.to_thread(self.store.fail, job['id'], self.worker_id, e)
+
+    async def _heartbeat(self):
+        """Renews the leases of all running jobs until cancelled."""
+        while True:
+            await asyncio.sleep(self.store.lease_seconds / 3)
+            for job_id in list(self._running.values()):
+                try:
+                    await asyncio.to_thread(self.store.renew, job_id, self.worker_id)
+                except Exception as e:
+                    print(f"Could not renew lease on job {job_id}: {e}")
@@ -1,14 +1,50 @@
+import hmac
 import os
-from flask import Flask
+from flask import Flask, Response, request, abort
 from threading import Thread
 
-app = Flask('')
+import config
+from instrument import registry
+
+app = Flask(__name__)
+
+# Set by enable_webhook(); receives a list of telebot Update objects.
+_update_handler = None
 
 @app.route('/')
 def home():
     """Simple route to indicate the bot is alive."""
     return "Bot is alive!"
 
+@app.route('/metrics')
+def metrics():
+    """Stage timings and counters of this process, in the Prometheus text format."""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route(config.WEBHOOK_PATH, methods=['POST'])
+def webhook():
+    """Receives updates from Telegram in webhook mode and hands them to the bot."""
+    if _update_handler is None:
+        abort(404)
+    # Telegram sends the secret given to setWebhook with every update, so
+    # anything without it did not come from Telegram.
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(token, config.WEBHOOK_SECRET):
+        abort(403)
+
+    # Imported here so the keep-alive page does not need telebot.
+    from telebot.types import Update
+    update = Update.de_json(request.get_data(as_text=True))
+    # With a threaded bot this only queues the update for its worker threads,
+    # so Telegram gets its answer right away.
+    _update_handler([update])
+    return ''
+
+def enable_webhook(handler):
+    """Routes webhook updates to handler, e.g. bot.process_new_updates."""
+    global _update_handler
+    _update_handler = handler
+
 def run():
     """Runs the Flask app on all available interfaces and a dynamic port."""
     # Use 0.0.0.0 to listen on all public IPs
@@ -19,4 +55,4 @@ def keep_alive():
     """Starts the Flask web server in a separate thread."""
     t = Thread(target=run)
     t.start()
-    
+    return t
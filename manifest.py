@@ -0,0 +1,47 @@
+import csv
+import io
+import json
+
+# Output formats for the scrape manifest, selected with `/scrape --format <name>`.
+FORMATS = ('json', 'ndjson', 'csv')
+
+def _records(manifest):
+    """Flattens a manifest into one record per extracted item, for line-based formats."""
+    for name, result in manifest['data'].items():
+        if isinstance(result, list):
+            for index, item in enumerate(result):
+                yield {'extractor': name, 'index': index, 'value': item}
+        else:
+            yield {'extractor': name, 'index': 0, 'value': result}
+    for index, download in enumerate(manifest['downloads']):
+        yield {'extractor': 'downloads', 'index': index, 'value': download}
+
+def render_manifest(manifest, fmt='json'):
+    """
+    Renders a manifest dict (source, url, extractors, data, downloads) and returns (file name, text).
+
+    json is a single document. ndjson starts with a header line describing the
+    scrape, followed by one line per extracted item. csv has the columns
+    extractor, index and value, with non-text values JSON-encoded.
+    """
+    if fmt == 'json':
+        return "manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2)
+
+    header = {key: value for key, value in manifest.items() if key not in ('data', 'downloads')}
+    if fmt == 'ndjson':
+        lines = [json.dumps(dict(header, extractor='scrape'), ensure_ascii=False)]
+        lines.extend(json.dumps(record, ensure_ascii=False) for record in _records(manifest))
+        return "manifest.ndjson", "\n".join(lines) + "\n"
+
+    if fmt == 'csv':
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(['extractor', 'index', 'value'])
+        for record in _records(manifest):
+            value = record['value']
+            if not isinstance(value, str):
+                value = json.dumps(value, ensure_ascii=False)
+            writer.writerow([record['extractor'], record['index'], value])
+        return "manifest.csv", out.getvalue()
+
+    raise ValueError(f"Unknown format '{fmt}'. Available: {', '.join(FORMATS)}.")
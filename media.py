@@ -0,0 +1,203 @@
+# Post-download media stage: every downloaded image and video passes through
+# a MediaStage before it is added to the archive. Recompressing large images
+# needs Pillow (`pip install Pillow`); everything else works without it.
+import hashlib
+import io
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+import config
+from archive import spooled_file
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# (magic bytes, offset, content type, extension), checked in order.
+SIGNATURES = [
+    (b'\xff\xd8\xff', 0, 'image/jpeg', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', 0, 'image/png', '.png'),
+    (b'GIF87a', 0, 'image/gif', '.gif'),
+    (b'GIF89a', 0, 'image/gif', '.gif'),
+    (b'BM', 0, 'image/bmp', '.bmp'),
+    (b'\x00\x00\x01\x00', 0, 'image/x-icon', '.ico'),
+    (b'\x1aE\xdf\xa3', 0, 'video/webm', '.webm'),
+    (b'OggS', 0, 'video/ogg', '.ogv'),
+    (b'FLV', 0, 'video/x-flv', '.flv'),
+]
+
+# ISO media files (MP4, QuickTime, AVIF, HEIC, M4A, 3GP, ...) all start with an
+# ftyp box whose major brand, at offset 8, says what they hold. Brands not
+# listed here (audio-only M4A, for example) are treated as unknown.
+FTYP_BRANDS = {
+    b'avif': ('image/avif', '.avif'),
+    b'avis': ('image/avif', '.avif'),
+    b'heic': ('image/heic', '.heic'),
+    b'heix': ('image/heic', '.heic'),
+    b'qt  ': ('video/quicktime', '.mov'),
+    **dict.fromkeys([b'isom', b'iso2', b'iso4', b'iso5', b'iso6', b'mp41', b'mp42', b'avc1', b'dash',
+                     b'M4V ', b'M4VH', b'M4VP', b'mmp4', b'MSNV'], ('video/mp4', '.mp4')),
+}
+
+# Images Pillow can shrink; others (GIF animations, SVG, icons) are kept as they are.
+RECOMPRESSIBLE = ('image/jpeg', 'image/png', 'image/webp', 'image/bmp')
+
+def sniff(head):
+    """Returns (content type, extension) for the first bytes of a file, or (None, None) if unknown."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp', '.webp'
+    if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return 'video/x-msvideo', '.avi'
+    if head[4:8] == b'ftyp':
+        return FTYP_BRANDS.get(head[8:12], (None, None))
+    for magic, offset, content_type, extension in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return content_type, extension
+    text = head.lstrip()[:256].lower()
+    if text.startswith(b'<svg') or (text.startswith(b'<?xml') and b'<svg' in text):
+        return 'image/svg+xml', '.svg'
+    if text.startswith((b'<!doctype html', b'<html', b'<head', b'<body')):
+        return 'text/html', None
+    return None, None
+
+def dimensions(head, content_type):
+    """Returns (width, height) read from a PNG or GIF header, or None for other types."""
+    if content_type == 'image/png' and len(head) >= 24:
+        return struct.unpack('>II', head[16:24])
+    if content_type == 'image/gif' and len(head) >= 10:
+        return struct.unpack('<HH', head[6:10])
+    return None
+
+def _recompress(data, target_bytes, max_dimension):
+    """
+    Shrinks an image to at most max_dimension pixels per side and re-encodes
+    it (JPEG, or PNG if it has transparency), lowering the JPEG quality until
+    it fits target_bytes. Returns (bytes, content type) or None if the result
+    is not smaller. Runs in a worker process.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((max_dimension, max_dimension))
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        best = None
+        if has_alpha:
+            out = io.BytesIO()
+            image.save(out, 'PNG', optimize=True)
+            best = (out.getvalue(), 'image/png')
+        else:
+            rgb = image.convert('RGB')
+            for quality in (85, 75, 65, 50):
+                out = io.BytesIO()
+                rgb.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+                best = (out.getvalue(), 'image/jpeg')
+                if len(best[0]) <= target_bytes:
+                    break
+    return best if len(best[0]) < len(data) else None
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    """Returns the process pool for image recompression, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Workers are started from a clean server process rather than forked
+            # from this one, which has threads (and their locks) running.
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(max_workers=config.MEDIA_PROCESSES,
+                                        mp_context=multiprocessing.get_context(method))
+        return _pool
+
+class MediaStage:
+    """
+    Checks downloaded media before it goes into an archive. Use one per job,
+    shared by all of its downloads:
+    - the real type is detected from the file's magic bytes and the file
+      name's extension corrected (an "image1.jpg" that is a PNG becomes
+      "image1.png"); HTML error pages served instead of media are dropped;
+    - files under MEDIA_MIN_BYTES and images of at most 2x2 pixels
+      (tracking pixels, spacers) are dropped;
+    - files whose content was already added by this job are dropped;
+    - images over MEDIA_TARGET_IMAGE_BYTES are downscaled and recompressed
+      in a process pool, if Pillow is installed.
+    """
+
+    def __init__(self):
+        self._seen = {} # Maps a content hash to the result of the download that kept it
+        self._lock = threading.Lock()
+
+    def process(self, spool, result, deadline=None):
+        """
+        Checks a finished download (spool, positioned anywhere) described by
+        its download result. Returns the file object to archive, which may be
+        a new one the caller must also close, or None if the file should be
+        dropped; result gets 'content_type', 'sha256' and the final
+        'filename', and 'error' explains a dropped file.
+        """
+        spool.seek(0)
+        head = spool.read(64)
+        content_type, extension = sniff(head)
+        result['content_type'] = content_type
+
+        if content_type == 'text/html':
+            result['error'] = "Skipped: the server sent a web page instead of media."
+            return None
+        if not result['truncated']:
+            size = dimensions(head, content_type)
+            if size and size[0] <= 2 and size[1] <= 2:
+                result['error'] = "Skipped: placeholder or tracking image."
+                return None
+            if result['bytes'] < config.MEDIA_MIN_BYTES:
+                result['error'] = "Skipped: file too small to be real media."
+                return None
+
+        digest = hashlib.sha256(head)
+        for chunk in iter(lambda: spool.read(1024 * 1024), b""):
+            digest.update(chunk)
+        result['sha256'] = digest.hexdigest()
+        if extension:
+            result['filename'] = os.path.splitext(result['filename'])[0] + extension
+        with self._lock:
+            original = self._seen.setdefault(result['sha256'], result)
+        if original is not result:
+            result['duplicate_of'] = original['filename']
+            result['error'] = f"Skipped: same content as {original['filename']}."
+            return None
+
+        spool.seek(0)
+        if (Image is None or result['truncated'] or content_type not in RECOMPRESSIBLE
+                or not 0 < config.MEDIA_TARGET_IMAGE_BYTES < result['bytes'] <= config.MEDIA_MAX_RECOMPRESS_BYTES):
+            return spool
+        return self._recompressed(spool, result, deadline) or spool
+
+    def _recompressed(self, spool, result, deadline):
+        """Returns a new spool with a smaller version of the image, or None to keep the original."""
+        timeout = None if deadline is None else deadline - time.monotonic()
+        if timeout is not None and timeout <= 0:
+            return None
+        try:
+            shrunk = _get_pool().submit(_recompress, spool.read(), config.MEDIA_TARGET_IMAGE_BYTES,
+                                        config.MEDIA_MAX_DIMENSION).result(timeout=timeout)
+        except FutureTimeout:
+            return None
+        except Exception as e:
+            print(f"Could not recompress {result['url']}: {e}")
+            return None
+        finally:
+            spool.seek(0)
+        if shrunk is None:
+            return None
+        data, content_type = shrunk
+        result['original_bytes'] = result['bytes']
+        result['bytes'] = len(data)
+        result['content_type'] = content_type
+        result['filename'] = os.path.splitext(result['filename'])[0] + ('.png' if content_type == 'image/png' else '.jpg')
+        out = spooled_file()
+        out.write(data)
+        out.seek(0)
+        return out
@@ -0,0 +1,129 @@
+import time
+
+import config
+from scraper import scrape_data, safe_name
+from crawler import crawl
+from utils import send_zip
+from delivery import DeliveryError
+from storage import UserStore
+from result_cache import ResultCache, cache_key
+from stats import StatsStore
+from instrument import span, trace_job
+
+users = UserStore()
+result_cache = ResultCache(config.RESULT_CACHE_DIR, config.RESULT_CACHE_TTL, config.RESULT_CACHE_MAX_BYTES)
+stats_store = StatsStore()
+
+def scraped_result(archive):
+    """Returns (archive, cacheable) for a scrape's archive; failed scrapes are not worth caching."""
+    return archive, not archive.has("error.txt")
+
+def build_result(keyword, options):
+    """
+    Scrapes the keyword/URL into a zip archive.
+    Returns (archive, cacheable) like scraped_result().
+    """
+    # Call the scrape_data function from scraper.py
+    return scraped_result(scrape_data(keyword, only=options['only'], fmt=options['format']))
+
+def build_batch_result(urls, options):
+    """
+    Scrapes a batch of URLs (following links options['depth'] levels deep)
+    into one zip archive. Returns (archive, cacheable); a batch with any
+    failed page is not cached.
+    """
+    archive = crawl(urls, options['depth'], only=options['only'], fmt=options['format'])
+    failed = any(name == "error.txt" or name.endswith("/error.txt") for name in archive.names())
+    return archive, not failed
+
+def check_allowed(user):
+    """Raises PermissionError unless the job's user exists and is not banned."""
+    # The user may have been banned while the job was waiting in the queue.
+    if user is None or user['banned']:
+        raise PermissionError("You are not authorized to use this bot.")
+
+def job_target(job):
+    """
+    Returns (target, options, filename) for a queued job: what to scrape
+    (the keyword, or the URLs of a /batch job), the scrape options and the
+    name of the zip sent back.
+    """
+    options = {'only': job.get('only') or [], 'format': job.get('format') or 'json'}
+    if job.get('urls'):
+        # A /batch job: many pages, all returned in one archive.
+        options['depth'] = job.get('depth') or 0
+        return job['urls'], options, f"batch_{safe_name(job['keyword'])}.zip"
+    return job['keyword'], options, f"{safe_name(job['keyword'])}.zip"
+
+class ScrapeOutcome:
+    """
+    What happened to one job, recorded in the scrape stats when it ends:
+    whether the cache answered it, the bytes downloaded and why it failed, if it did.
+    """
+
+    def __init__(self):
+        # A request counts as a hit until it has to build its result.
+        self.cache_hit = True if result_cache.enabled else None
+        self.downloaded = 0
+        self.failure = None
+        self.started = time.monotonic()
+
+    def missed(self):
+        """Notes that the result is being built, as the cache could not answer."""
+        if result_cache.enabled:
+            self.cache_hit = False
+
+    def built(self, archive, cacheable):
+        """Notes a freshly built result, returning (archive, cacheable) for get_or_build."""
+        self.downloaded = archive.streamed_bytes
+        if not cacheable:
+            self.failure = 'scrape'
+        return archive, cacheable
+
+    def failed(self, error):
+        """Notes the exception that ended the job."""
+        if isinstance(error, DeliveryError):
+            self.failure = self.failure or 'delivery'
+        else:
+            self.failure = type(error).__name__
+
+    def record(self):
+        """Adds the job to the scrape stats."""
+        stats_store.record_scrape(time.monotonic() - self.started, self.failure is None,
+                                  cache_hit=self.cache_hit, downloaded=self.downloaded, failure=self.failure)
+
+def run_scrape_job(bot, job):
+    """
+    Runs one queued scrape or batch and sends the zipped results to the job's chat.
+    Used by the bot's own worker threads and by worker.py processes alike.
+    """
+    with trace_job(job.get('id'), user_id=job['user_id'], batch=bool(job.get('urls'))), span('job'):
+        _run_scrape_job(bot, job)
+
+def _run_scrape_job(bot, job):
+    check_allowed(users.get(job['user_id']))
+    bot.send_message(job['chat_id'], "⏳ Scraping started... This might take a moment.")
+    outcome = ScrapeOutcome()
+    target, options, filename = job_target(job)
+    scrape = build_batch_result if job.get('urls') else build_result
+
+    def build():
+        outcome.missed()
+        return outcome.built(*scrape(target, options))
+
+    try:
+        key = cache_key(target, options)
+        # Identical requests share one scrape, and repeats within the TTL skip the network entirely.
+        result, cached = result_cache.get_or_build(key, build)
+        try:
+            # Send the zip to the user
+            send_zip(bot, job['chat_id'], result, source_key=key, filename=filename)
+        finally:
+            # Cached archives stay on disk for the next request; fresh ones are discarded.
+            if not cached:
+                result.close()
+    except Exception as e:
+        outcome.failed(e)
+        raise
+    finally:
+        outcome.record()
@@ -0,0 +1,249 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+class TokenBucket:
+    """
+    A thread-safe token bucket: allows rate actions per second on average,
+    with bursts of up to capacity. pause() empties the bucket and blocks it
+    for a while, e.g. when a server answers "429 Too Many Requests".
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait_locked(self, tokens, now):
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        if self._tokens >= tokens:
+            return 0
+        return (tokens - self._tokens) / self.rate
+
+    def wait_time(self, tokens=1):
+        """Returns how many seconds until tokens would be available, without taking them."""
+        with self._lock:
+            return self._wait_locked(tokens, time.monotonic())
+
+    def try_acquire(self, tokens=1):
+        """Takes tokens if they are available right now and returns True, else returns False."""
+        with self._lock:
+            if self._wait_locked(tokens, time.monotonic()) > 0:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def refund(self, tokens=1):
+        """Gives back tokens taken for an action that did not happen, up to capacity."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def acquire(self, tokens=1):
+        """Blocks until tokens are available and takes them."""
+        while True:
+            with self._lock:
+                wait = self._wait_locked(tokens, time.monotonic())
+                if wait <= 0:
+                    self._tokens -= tokens
+                    return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        """Like acquire(), but sleeps without blocking the event loop."""
+        while True:
+            with self._lock:
+                wait = self._wait_locked(tokens, time.monotonic())
+                if wait <= 0:
+                    self._tokens -= tokens
+                    return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Allows nothing for the next seconds; the bucket then refills from empty."""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0
+            self._updated = self._paused_until
+
+class KeyedLimiter:
+    """
+    One TokenBucket per key (a chat, a user, a host), created on first use.
+    Only the max_keys most recently used buckets are kept; a bucket that was
+    dropped starts full again, which is what an idle key would have anyway.
+    """
+
+    def __init__(self, rate, capacity=None, max_keys=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bucket(self, key):
+        """Returns the TokenBucket for key."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+    def acquire(self, key, tokens=1):
+        self.bucket(key).acquire(tokens)
+
+    async def acquire_async(self, key, tokens=1):
+        await self.bucket(key).acquire_async(tokens)
+
+    def try_acquire(self, key, tokens=1):
+        return self.bucket(key).try_acquire(tokens)
+
+    def wait_time(self, key, tokens=1):
+        return self.bucket(key).wait_time(tokens)
+
+    def refund(self, key, tokens=1):
+        self.bucket(key).refund(tokens)
+
+    def pause(self, key, seconds):
+        self.bucket(key).pause(seconds)
+
+def parse_retry_after(value, now=None):
+    """
+    Returns the delay in seconds asked for by a Retry-After header (a number
+    of seconds or an HTTP date), or None if it is missing or malformed.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = time.time() if now is None else now
+    return max(when.timestamp() - now, 0.0)
+
+class HostThrottle:
+    """
+    Paces requests to each host with a KeyedLimiter, and backs off from hosts
+    that answer "429 Too Many Requests" or "503 Service Unavailable": the
+    host is paused for its Retry-After, or else for an exponentially growing
+    delay (base_backoff, doubled on every consecutive throttled response, up
+    to max_backoff). A successful response resets the backoff.
+    """
+
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, rate, capacity=None, base_backoff=1, max_backoff=300, max_keys=10000):
+        self.limiter = KeyedLimiter(rate, capacity, max_keys)
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_keys = max_keys
+        self._strikes = {} # Maps a host to (throttled responses in a row, end of its pause)
+        self._lock = threading.Lock()
+
+    async def acquire_async(self, host, max_wait):
+        """
+        Waits for the host's turn without blocking the event loop and returns
+        True, or returns False at once if that takes over max_wait seconds.
+        """
+        while True:
+            wait = self.limiter.wait_time(host)
+            if wait > max_wait:
+                return False
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if self.limiter.try_acquire(host):
+                return True
+
+    def observe(self, host, status, retry_after=None):
+        """
+        Feeds a response status (and its Retry-After header) back in. Returns
+        the seconds the host is paused for, or 0 if it was not throttling.
+        Throttled answers arriving while the host is already paused were sent
+        before the pause, so they do not add to the backoff.
+        """
+        if status not in self.THROTTLE_STATUSES:
+            with self._lock:
+                self._strikes.pop(host, None)
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            strikes, paused_until = self._strikes.get(host, (0, 0))
+            if now < paused_until:
+                return 0
+            strikes += 1
+            delay = parse_retry_after(retry_after)
+            if delay is None:
+                delay = self.base_backoff * 2 ** (strikes - 1)
+            delay = min(delay, self.max_backoff)
+            self._strikes[host] = (strikes, now + delay)
+            if len(self._strikes) > self.max_keys:
+                del self._strikes[next(iter(self._strikes))]
+        self.limiter.pause(host, delay)
+        return delay
+
+class CircuitBreaker:
+    """
+    One circuit breaker per host. After `failures` failed requests in a row
+    (connection errors, timeouts, 5xx answers) the host's breaker opens and
+    retry_in() tells callers to fail fast for `cooldown` seconds. After that a
+    single trial request is let through per cooldown: a success closes the
+    breaker, a failure keeps it open.
+    """
+
+    def __init__(self, failures, cooldown, max_keys=10000):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.max_keys = max_keys
+        self._hosts = OrderedDict() # Maps a host to [failures in a row, time its breaker opened or None]
+        self._lock = threading.Lock()
+
+    def retry_in(self, host):
+        """
+        Returns 0 if a request to host may go ahead, else the seconds until
+        the breaker lets a trial request through.
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state[1] is None:
+                return 0
+            now = time.monotonic()
+            remaining = state[1] + self.cooldown - now
+            if remaining > 0:
+                return remaining
+            state[1] = now # This request is the trial; others wait for its outcome or another cooldown
+            return 0
+
+    def success(self, host):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def failure(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = [0, None]
+                if len(self._hosts) > self.max_keys:
+                    self._hosts.popitem(last=False)
+            state[0] += 1
+            if state[0] >= self.failures:
+                state[1] = time.monotonic()
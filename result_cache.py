@@ -0,0 +1,195 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from db import get_connection, transaction
+from fetcher import normalize_url, run_blocking
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS result_cache_lru ON result_cache (last_access);
+"""
+
+def _normalize_target(keyword):
+    keyword = keyword.strip()
+    if keyword.startswith("http"):
+        return "url:" + normalize_url(keyword)
+    return "query:" + " ".join(keyword.casefold().split())
+
+def cache_key(keyword, options=None):
+    """
+    Returns the cache key for a scrape target and its options (extractors and
+    output format). URLs are normalized (scheme and host lower-cased, default
+    port and fragment dropped) and search keywords are compared
+    case-insensitively with whitespace collapsed. keyword may also be a list
+    of targets, for a batch scrape.
+    """
+    targets = keyword if isinstance(keyword, (list, tuple)) else [keyword]
+    normalized = "\n".join(_normalize_target(target) for target in targets)
+    if options:
+        normalized += "|" + json.dumps(options, sort_keys=True)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """
+    Caches finished scrape archives on disk, keyed by cache_key().
+
+    Entries expire after ttl seconds, and the least recently used entries are
+    evicted once the cache holds more than max_bytes. Concurrent requests for
+    the same key within this process are single-flighted: only the first one
+    builds the result and the others wait for it. Threads and coroutines are
+    single-flighted separately, since a process runs its jobs one way or the other.
+    """
+
+    def __init__(self, directory, ttl, max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._inflight = {} # Maps a key being built to an Event set when it is done
+        self._inflight_async = {} # The same for keys built on an event loop, with asyncio Events
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        get_connection().executescript(SCHEMA)
+
+    @property
+    def enabled(self):
+        """True unless caching was switched off with a zero TTL or size."""
+        return self.ttl > 0 and self.max_bytes > 0
+
+    def get(self, key):
+        """Returns the path of a fresh cached archive for key, or None."""
+        conn = get_connection()
+        row = conn.execute("SELECT path, created FROM result_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if time.time() - row['created'] > self.ttl or not os.path.exists(row['path']):
+            self._remove(key)
+            return None
+        conn.execute("UPDATE result_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row['path']
+
+    def put(self, key, archive):
+        """Writes a finished ArchiveBuilder into the cache and returns the cached file's path."""
+        path = os.path.join(self.directory, f"{key}.zip")
+        # Write under a temporary name first, so readers never see a half-written file.
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        os.close(fd)
+        try:
+            archive.save(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        now = time.time()
+        get_connection().execute(
+            "INSERT OR REPLACE INTO result_cache (key, path, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, path, os.path.getsize(path), now, now))
+        self._evict()
+        return path
+
+    def get_or_build(self, key, build):
+        """
+        Returns (result, cached) for key, where result is the cached file's
+        path. On a miss, build() is called and must return (archive,
+        cacheable) for a finished ArchiveBuilder; cacheable results are stored.
+        An uncacheable result is returned as the ArchiveBuilder itself with
+        cached False, and the caller must close it. Only one caller per key builds at a time;
+        others wait and reuse its result. With the cache disabled every call builds.
+        """
+        if not self.enabled:
+            return build()[0], False
+        while True:
+            path = self.get(key)
+            if path:
+                return path, True
+            event = self._begin(self._inflight, key, threading.Event)
+            if event is None:
+                break
+            # Another thread is building this key; wait for it and look again.
+            event.wait()
+
+        try:
+            return self._store(key, *build())
+        finally:
+            self._end(self._inflight, key)
+
+    async def get_or_build_async(self, key, build):
+        """
+        Async counterpart of get_or_build, where build is a coroutine function.
+        The database and disk work runs on threads.
+        """
+        if not self.enabled:
+            return (await build())[0], False
+        while True:
+            path = await run_blocking(self.get, key)
+            if path:
+                return path, True
+            event = self._begin(self._inflight_async, key, asyncio.Event)
+            if event is None:
+                break
+            # Another job is building this key; wait for it and look again.
+            await event.wait()
+
+        try:
+            archive, cacheable = await build()
+            return await run_blocking(self._store, key, archive, cacheable)
+        finally:
+            self._end(self._inflight_async, key)
+
+    def _begin(self, inflight, key, new_event):
+        """
+        Marks key as being built and returns None, or returns the Event of
+        the build already under way.
+        """
+        with self._lock:
+            event = inflight.get(key)
+            if event is None:
+                inflight[key] = new_event()
+            return event
+
+    def _end(self, inflight, key):
+        """Marks key's build as done, waking whoever waits for it."""
+        with self._lock:
+            event = inflight.pop(key)
+        event.set()
+
+    def _store(self, key, archive, cacheable):
+        """Caches a freshly built result if it is cacheable; returns (result, cached) for get_or_build."""
+        if not cacheable:
+            return archive, False
+        try:
+            return self.put(key, archive), True
+        finally:
+            archive.close()
+
+    def _remove(self, key):
+        """Deletes a cache entry and its file."""
+        with transaction() as conn:
+            row = conn.execute("SELECT path FROM result_cache WHERE key = ?", (key,)).fetchone()
+            conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+        if row and os.path.exists(row['path']):
+            os.remove(row['path'])
+
+    def _evict(self):
+        """Drops expired entries, then least recently used ones until under max_bytes."""
+        conn = get_connection()
+        for row in conn.execute("SELECT key FROM result_cache WHERE created < ?", (time.time() - self.ttl,)).fetchall():
+            self._remove(row['key'])
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM result_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for row in conn.execute("SELECT key, size FROM result_cache ORDER BY last_access").fetchall():
+            self._remove(row['key'])
+            total -= row['size']
+            if total <= self.max_bytes:
+                break
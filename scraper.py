@@ -1,129 +1,211 @@
+# Scraping a URL or keyword into a zip archive. The work is done once, by
+# the coroutines scrape_page_async and scrape_data_async, which async_bot.py
+# awaits on its own event loop; scrape_page and scrape_data are thin wrappers
+# for threads, running them on the shared loop (see fetcher.run_sync).
+import asyncio
 import os
-import requests
-from bs4 import BeautifulSoup
+import codecs
 from urllib.parse import urlparse, urljoin
 import re
-import shutil # Import shutil for rmtree
+import time
+import config
+from fetcher import download_assets_async, fetch_deadline, run_sync, run_blocking, FETCH_ERRORS
+from http_cache import fetch_page_async
+from archive import ArchiveBuilder
+from extract import ExtractionEngine, make_parser, resolve_names
+from manifest import render_manifest, FORMATS
+from instrument import span
 
-def scrape_data(keyword):
+def safe_name(keyword):
+    """Returns a file-system safe name for a keyword or URL, used to name the result archive."""
+    # Remove characters that are invalid in file names
+    return re.sub(r'[\\/*?:"<>|]', '', keyword).replace(' ', '_')[:50]
+
+async def _extract_async(response, only, deadline):
+    """
+    Parses a page with the named extractors while it downloads, decoding it
+    chunk by chunk, and stops reading as soon as every extractor has what it
+    needs. Returns the ExtractionEngine. Raises asyncio.TimeoutError if the
+    body is still arriving after deadline (a time.monotonic() value).
+    """
+    page = ExtractionEngine(only)
+    parser = make_parser(page)
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    async for chunk in response.iter_chunks():
+        if time.monotonic() > deadline:
+            raise asyncio.TimeoutError(f"The page took longer than {config.PAGE_TIMEOUT:g} seconds to download.")
+        # Parsing holds the CPU, so it runs on a thread and the loop keeps serving other scrapes.
+        await run_blocking(parser.feed, decoder.decode(chunk))
+        if page.done:
+            break
+    await run_blocking(parser.feed, decoder.decode(b'', final=True))
+    await run_blocking(parser.close)
+    return page
+
+def parse_scrape_request(text, options=None):
+    """
+    Splits a scrape request like "/scrape --only prices,media --format csv <keyword or URL>"
+    into (target, options). options has 'only' (a list of extractor names,
+    empty for all) and 'format'; flags in text override the given options.
+    Raises ValueError for unknown names or formats.
+    """
+    tokens = text.split()
+    if tokens and tokens[0].startswith('/'):
+        tokens = tokens[1:] # Drop the command itself
+    options = dict(options) if options else {'only': [], 'format': 'json'}
+    rest = []
+    while tokens:
+        token = tokens.pop(0)
+        flag, _, value = token.partition('=')
+        if flag in ('--only', '--format'):
+            if not value:
+                if not tokens:
+                    raise ValueError(f"{flag} needs a value.")
+                value = tokens.pop(0)
+            if flag == '--only':
+                options['only'] = resolve_names(value.split(','))
+            elif value.lower() in FORMATS:
+                options['format'] = value.lower()
+            else:
+                raise ValueError(f"Unknown format '{value}'. Available: {', '.join(FORMATS)}.")
+        else:
+            rest.append(token)
+    return " ".join(rest), options
+
+def collect_assets(url, page, prefix=''):
     """
-    Scrapes data (prices, headlines, descriptions, images, videos) from a given
-    URL or a Google search result for a keyword.
-    The scraped data is saved into a uniquely named folder.
+    Returns the images and videos found by the page's extractors as a list of
+    assets ({'url', 'filename'}) for download_assets, with absolute URLs.
     """
-    # Create a unique folder for each scrape operation
-    # Using a relative path within the current working directory
-    # Ensure the folder name is safe for file systems by removing invalid characters
-    sanitized_keyword = re.sub(r'[\\/*?:"<>|]', '', keyword).replace(' ', '_')
-    folder = os.path.join("scraped_data", sanitized_keyword)
-
-    # Clean up previous scrape data for the same keyword if it exists
-    # This ensures fresh data for each request and prevents accumulation of old files.
-    if os.path.exists(folder):
-        shutil.rmtree(folder)
-    os.makedirs(folder, exist_ok=True)
+    # --- Collect Images (up to 5) ---
+    # Assets are only collected here; they are downloaded together afterwards.
+    assets = []
+    images = page.get('images')
+    for idx, src in (images.images if images else []):
+        # Construct absolute URL for images using urljoin for robustness.
+        img_url = urljoin(url, src)
+        assets.append({'url': img_url, 'filename': f"{prefix}image{idx+1}.jpg"})
+
+    # --- Collect Videos (up to 3) ---
+    # <video src>, <source> inside <video>, and links to video files, without duplicates.
+    videos = page.get('videos')
+    for idx, video_src in enumerate(videos.videos if videos else []):
+        # Construct absolute URL for videos.
+        video_url = urljoin(url, video_src)
+        # Determine file extension from the URL.
+        parsed_video_url = urlparse(video_url)
+        video_ext = os.path.splitext(parsed_video_url.path)[1]
+        if not video_ext: # Default to .mp4 if no extension found in URL
+            video_ext = ".mp4"
+        assets.append({'url': video_url, 'filename': f"{prefix}video{idx+1}{video_ext}"})
+    return assets
+
+# Download result fields listed in the manifest; the media stage's are missing
+# (None) for files it never saw.
+DOWNLOAD_FIELDS = ('filename', 'url', 'saved', 'bytes', 'truncated', 'error',
+                   'content_type', 'sha256', 'duplicate_of', 'original_bytes')
+
+def write_manifest(archive, url, source, page, download_results, fmt='json', prefix=''):
+    """
+    Adds the manifest of a scraped page to the archive: everything extracted,
+    plus the outcome of every download so a partial or missing file can be
+    told from a complete one.
+    """
+    manifest = {
+        'source': source,
+        'url': url,
+        'extractors': [extractor.name for extractor in page.extractors],
+        'data': page.results(),
+        'downloads': [{key: result.get(key) for key in DOWNLOAD_FIELDS} for result in download_results],
+    }
+    manifest_name, manifest_text = render_manifest(manifest, fmt)
+    archive.writestr(prefix + manifest_name, manifest_text)
+
+async def scrape_page_async(session, url, archive, only=None, fmt='json', prefix='', source=None, budget=None,
+                            media=None):
+    """
+    Scrapes one page into archive: downloaded media and the manifest are added
+    with prefix in front of their names (e.g. "01_example.com/"). source is
+    recorded in the manifest (defaults to url), and budget and media are an
+    optional JobBudget and MediaStage shared with other pages. Returns the
+    ExtractionEngine of the page. Network and parsing errors are raised to
+    the caller. session comes from fetcher.create_session().
+    """
+    # Pages go through the HTTP cache, so an unchanged page costs a 304 instead of a download.
+    # 'fetch' lasts until the response headers arrive; reading the body is part of 'parse'.
+    # Connecting, each read and the whole page (retries included) have time limits.
+    deadline = time.monotonic() + config.PAGE_TIMEOUT
+    with span('fetch'), fetch_deadline(deadline):
+        response = await fetch_page_async(session, url, deadline)
+        try:
+            response.raise_for_status() # Raise an error for bad responses (4xx or 5xx)
+        except Exception:
+            response.close()
+            raise
+
+    async with response:
+        with span('parse'):
+            # --- Extract Everything in One Pass ---
+            page = await _extract_async(response, only, deadline)
+
+    assets = collect_assets(url, page, prefix)
+
+    # --- Download Images and Videos ---
+    # All assets are fetched concurrently over pooled keep-alive connections,
+    # so the scrape takes roughly as long as the slowest download.
+    with span('downloads'):
+        download_results = await download_assets_async(session, assets, archive, budget=budget, media=media)
+
+    with span('manifest'):
+        await run_blocking(write_manifest, archive, url, source or url, page, download_results, fmt, prefix)
+    return page
+
+def scrape_page(url, archive, only=None, fmt='json', prefix='', source=None, budget=None, media=None):
+    """scrape_page_async for threads, run on the shared event loop."""
+    return run_sync(scrape_page_async, url, archive, only, fmt, prefix, source, budget, media)
+
+async def scrape_data_async(session, keyword, archive=None, only=None, fmt='json'):
+    """
+    Scrapes data (prices, headlines, descriptions, images, videos, metadata,
+    tables) from a given URL, or the web search results for a keyword and
+    the pages of the top results (see search.py).
+    only limits the run to the named extractors (see extract.EXTRACTORS);
+    the others are skipped entirely. Extracted data is written as a single
+    structured manifest in fmt (json, ndjson or csv) and downloaded media
+    as separate files, straight into a zip archive (an ArchiveBuilder),
+    which is finished and returned. Pass archive to write into an existing one.
+    """
+    # Each scrape writes into its own in-memory archive, so two users scraping
+    # the same target at once never touch each other's files.
+    if archive is None:
+        archive = ArchiveBuilder(safe_name(keyword))
 
     # Determine if the keyword is a URL or a search query
-    # If it starts with "http", treat it as a direct URL; otherwise, perform a Google search.
-    url = keyword if keyword.startswith("http") else f"https://www.google.com/search?q={keyword}"
-    
+    # If it starts with "http", treat it as a direct URL; otherwise, search the web for it.
     try:
-        # Make a request to the URL with a user-agent header to mimic a browser.
-        # This can help avoid some website blocking.
-        response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'})
-        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # --- Scrape Prices ---
-        # Finds patterns like "₹1,234" or "$9.99" in the entire response text.
-        prices = re.findall(r"₹[0-9,]+|\$[0-9.]+", response.text)
-        with open(os.path.join(folder, "price.txt"), "w", encoding="utf-8") as f:
-            f.write("\n".join(prices or ["No prices found."]))
-
-        # --- Scrape Headlines ---
-        # Finds all h1, h2, or h3 tags and extracts their text.
-        # Changed .docx to .txt as we are writing plain text content.
-        headlines = [h.get_text(strip=True) for h in soup.find_all(['h1', 'h2', 'h3'])]
-        with open(os.path.join(folder, "headline.txt"), "w", encoding="utf-8") as f:
-            f.write("\n".join(headlines or ["No headlines found."]))
-
-        # --- Scrape Paragraphs (Descriptions) ---
-        # Finds all <p> tags and extracts their text, limiting to the first 20.
-        # Changed .docx to .txt as we are writing plain text content.
-        paragraphs = [p.get_text(strip=True) for p in soup.find_all('p')][:20] 
-        with open(os.path.join(folder, "description.txt"), "w", encoding="utf-8") as f:
-            f.write("\n".join(paragraphs or ["No descriptions found."]))
-
-        # --- Scrape Images (up to 5) ---
-        img_tags = soup.find_all('img')
-        for idx, img in enumerate(img_tags[:5]): # Limit to first 5 images
-            src = img.get('src')
-            if src:
-                # Construct absolute URL for images using urljoin for robustness.
-                img_url = urljoin(url, src)
-                try:
-                    # Download image content.
-                    img_data = requests.get(img_url, stream=True, headers={'User-Agent': 'Mozilla/5.0'}).content
-                    with open(os.path.join(folder, f"image{idx+1}.jpg"), "wb") as img_file:
-                        img_file.write(img_data)
-                except requests.exceptions.RequestException as img_e:
-                    print(f"Failed to download image {img_url}: {img_e}")
-                except Exception as img_e:
-                    print(f"Error saving image {img_url}: {img_e}")
-
-        # --- Scrape Videos (up to 3) ---
-        video_sources = []
-        # Find video tags directly
-        video_tags = soup.find_all('video')
-        for vid in video_tags:
-            if vid.get('src'):
-                video_sources.append(vid.get('src'))
-            # Check for source tags within video tags (e.g., <video><source src="...">)
-            for source_tag in vid.find_all('source'):
-                if source_tag.get('src'):
-                    video_sources.append(source_tag.get('src'))
-        
-        # Also look for common video file extensions in <a> tags (links to video files)
-        a_tags_with_videos = soup.find_all('a', href=re.compile(r'\.(mp4|webm|ogg|mov|avi)$', re.IGNORECASE))
-        for a_tag in a_tags_with_videos:
-            if a_tag.get('href'):
-                video_sources.append(a_tag.get('href'))
-
-        video_sources = list(set(video_sources)) # Remove duplicate URLs
-
-        for idx, video_src in enumerate(video_sources[:3]): # Limit to first 3 videos
-            if video_src:
-                # Construct absolute URL for videos.
-                video_url = urljoin(url, video_src)
-                try:
-                    # Determine file extension from the URL.
-                    parsed_video_url = urlparse(video_url)
-                    video_ext = os.path.splitext(parsed_video_url.path)[1]
-                    if not video_ext: # Default to .mp4 if no extension found in URL
-                        video_ext = ".mp4" 
-                    
-                    # Download video content.
-                    video_data = requests.get(video_url, stream=True, headers={'User-Agent': 'Mozilla/5.0'}).content
-                    with open(os.path.join(folder, f"video{idx+1}{video_ext}"), "wb") as video_file:
-                        video_file.write(video_data)
-                except requests.exceptions.RequestException as video_e:
-                    print(f"Failed to download video {video_url}: {video_e}")
-                except Exception as video_e:
-                    print(f"Error saving video {video_url}: {video_e}")
-
-    except requests.exceptions.RequestException as e:
+        if keyword.startswith("http"):
+            await scrape_page_async(session, keyword, archive, only, fmt, source=keyword)
+        else:
+            # Imported here: search uses the crawler, which imports this module.
+            from search import scrape_search
+            # Searches and their fan-out use the crawler's per-domain scheduler, which runs on threads.
+            return await asyncio.to_thread(scrape_search, keyword, archive, only, fmt)
+
+    except FETCH_ERRORS as e:
         # Catch network-related or HTTP errors during the main request.
         print(f"Network or HTTP error during scraping: {e}")
         # Create an error file to inform the user about the failure.
-        with open(os.path.join(folder, "error.txt"), "w", encoding="utf-8") as f:
-            f.write(f"Scraping failed due to network or HTTP error: {e}")
+        archive.writestr("error.txt", f"Scraping failed due to network or HTTP error: {e}")
     except Exception as e:
         # Catch any other unexpected errors during the scraping process.
         print(f"An unexpected error occurred during scraping: {e}")
-        with open(os.path.join(folder, "error.txt"), "w", encoding="utf-8") as f:
-            f.write(f"Scraping failed due to an unexpected error: {e}")
+        archive.writestr("error.txt", f"Scraping failed due to an unexpected error: {e}")
+
+    # Return the finished archive. The caller sends it with send_zip and
+    # then closes it (or stores it in the result cache).
+    with span('zip'):
+        return await run_blocking(archive.finish)
 
-    # Return the path to the folder containing scraped data.
-    # The zip_and_send function will then handle zipping and sending.
-    return folder
-                  
+def scrape_data(keyword, archive=None, only=None, fmt='json'):
+    """scrape_data_async for threads, run on the shared event loop."""
+    return run_sync(scrape_data_async, keyword, archive, only, fmt)
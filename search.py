@@ -0,0 +1,319 @@
+# Web search for keyword scrapes. A search backend builds the URL of a plain
+# HTML results page (no JavaScript needed) and parses the result list from it
+# into entries with a title, URL and snippet. Parsed results are cached per
+# backend and keyword for SEARCH_CACHE_TTL seconds, and the pages of the top
+# SEARCH_FAN_OUT results are scraped too, like a /batch of those URLs.
+import base64
+import json
+import threading
+import time
+from urllib.parse import parse_qs, quote_plus, urljoin, urlsplit
+
+import config
+from crawler import crawl
+from db import get_connection, transaction
+from extract import make_parser
+from fetcher import fetch_text, fetch_deadline, normalize_url
+from instrument import registry, span
+from manifest import render_manifest
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_cache (
+    key TEXT PRIMARY KEY,
+    results TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS search_cache_created ON search_cache (created);
+"""
+
+SEARCHES = registry.counter('scrapnest_searches_total',
+                            "Keyword searches, by backend and whether the parsed results came from the cache.")
+
+# --- Backend Registry ---
+# Maps a backend name (as set in SEARCH_BACKEND) to its class.
+BACKENDS = {}
+
+def register(name):
+    """Class decorator adding a search backend to the registry under name."""
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+def get_backend(name=None):
+    """Returns the backend class called name (SEARCH_BACKEND by default). Raises ValueError for unknown names."""
+    name = (name or config.SEARCH_BACKEND).strip().lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown search backend '{name}'. Available: {', '.join(BACKENDS)}.")
+    return BACKENDS[name]
+
+def _classes(attrs):
+    return attrs.get('class', '').split()
+
+class SearchBackend:
+    """
+    Base class for search backends. search_url() returns the results page for
+    a query, and an instance is the parser target (start, end, data, close)
+    reading the results from that page, the same interface the extraction
+    engine offers. Subclasses call _add() when a result's link starts and
+    _capture() when its title or snippet text starts; the text is collected
+    until that element ends. close() returns the results as a list of
+    {'title', 'url', 'snippet'} dicts.
+    """
+    name = None
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.results = []
+        self._seen = set()
+        self._field = None # The result field whose text is being collected
+        self._tag = None
+        self._nesting = 0
+        self._text = []
+
+    @staticmethod
+    def search_url(query):
+        raise NotImplementedError
+
+    def _add(self, url):
+        """Starts a new result for url. Returns False (and adds nothing) for relative, repeated or excess links."""
+        if not url or not url.startswith(('http://', 'https://')) or 0 < self.limit <= len(self.results):
+            return False
+        url = normalize_url(url)
+        if url in self._seen:
+            return False
+        self._seen.add(url)
+        self.results.append({'title': '', 'url': url, 'snippet': ''})
+        return True
+
+    def _capture(self, field, tag):
+        """Collects the text of the element tag that just started into field of the latest result."""
+        if self.results and self._field is None and not self.results[-1][field]:
+            self._field, self._tag, self._nesting, self._text = field, tag, 0, []
+
+    def start(self, tag, attrs):
+        if self._field is not None and tag == self._tag:
+            self._nesting += 1
+        elif self._field is None:
+            self.on_start(tag, attrs)
+
+    def end(self, tag):
+        if self._field is not None and tag == self._tag:
+            if self._nesting:
+                self._nesting -= 1
+                return
+            self.results[-1][self._field] = " ".join("".join(self._text).split())
+            self._field = None
+        self.on_end(tag)
+
+    def data(self, text):
+        if self._field is not None:
+            self._text.append(text)
+
+    def on_start(self, tag, attrs):
+        pass
+
+    def on_end(self, tag):
+        pass
+
+    def close(self):
+        # Links whose title turned out empty were not results (e.g. image-only links).
+        return [result for result in self.results if result['title']][:self.limit or None]
+
+@register('duckduckgo')
+class DuckDuckGoBackend(SearchBackend):
+    """DuckDuckGo's HTML results page. Result links go through a redirect that carries the target in uddg."""
+
+    @staticmethod
+    def search_url(query):
+        return f"https://html.duckduckgo.com/html/?q={quote_plus(query)}"
+
+    def on_start(self, tag, attrs):
+        classes = _classes(attrs)
+        if tag == 'a' and 'result__a' in classes:
+            href = urlsplit(urljoin('https://duckduckgo.com/', attrs.get('href', '')))
+            # Ads link to duckduckgo.com/y.js instead, without uddg, and are skipped.
+            target = parse_qs(href.query).get('uddg', [None])[0]
+            if target is None and not href.netloc.endswith('duckduckgo.com'):
+                target = href.geturl()
+            if self._add(target):
+                self._capture('title', tag)
+        elif 'result__snippet' in classes:
+            self._capture('snippet', tag)
+
+@register('bing')
+class BingBackend(SearchBackend):
+    """Bing's results page: <li class="b_algo"> per result, its title link in an <h2>, the snippet in a <p>."""
+
+    def __init__(self, limit):
+        super().__init__(limit)
+        self._in_result = False
+        self._in_title = False
+
+    @staticmethod
+    def search_url(query):
+        return f"https://www.bing.com/search?q={quote_plus(query)}"
+
+    @staticmethod
+    def _target(href):
+        # Tracking links (bing.com/ck/a?...&u=a1<base64url of the target>) are decoded to the target.
+        if urlsplit(href).netloc.endswith('bing.com'):
+            encoded = parse_qs(urlsplit(href).query).get('u', [''])[0]
+            if encoded.startswith('a1'):
+                encoded = encoded[2:]
+                try:
+                    return base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode('utf-8')
+                except ValueError:
+                    return None
+        return href
+
+    def on_start(self, tag, attrs):
+        if tag == 'li':
+            self._in_result = 'b_algo' in _classes(attrs)
+        elif not self._in_result:
+            return
+        elif tag == 'h2':
+            self._in_title = True
+        elif tag == 'a' and self._in_title:
+            if self._add(self._target(attrs.get('href', ''))):
+                self._capture('title', tag)
+        elif tag == 'p':
+            self._capture('snippet', tag)
+
+    def on_end(self, tag):
+        if tag == 'h2':
+            self._in_title = False
+
+@register('google')
+class GoogleBackend(SearchBackend):
+    """
+    Google's basic HTML results page (as served without JavaScript): a
+    result is a /url?q=<target> link around an <h3> title, and its snippet
+    is the next block of text marked with one of SNIPPET_CLASSES.
+    """
+    SNIPPET_CLASSES = {'s3v9rd', 'VwiC3b'}
+
+    def __init__(self, limit):
+        super().__init__(limit)
+        self._link = None # Target of the /url?q= link the parser is inside
+
+    @staticmethod
+    def search_url(query):
+        return f"https://www.google.com/search?q={quote_plus(query)}&hl=en&gbv=1"
+
+    def on_start(self, tag, attrs):
+        if tag == 'a':
+            href = attrs.get('href', '')
+            self._link = parse_qs(urlsplit(href).query).get('q', [None])[0] if href.startswith('/url?') else None
+        elif tag == 'h3' and self._link:
+            if self._add(self._link):
+                self._capture('title', tag)
+            self._link = None
+        elif self.SNIPPET_CLASSES.intersection(_classes(attrs)):
+            self._capture('snippet', tag)
+
+    def on_end(self, tag):
+        if tag == 'a':
+            self._link = None
+
+def parse_results(backend, html, limit=None):
+    """Parses a results page (HTML text) with the backend class and returns its results."""
+    target = backend(config.SEARCH_MAX_RESULTS if limit is None else limit)
+    parser = make_parser(target)
+    parser.feed(html)
+    return parser.close()
+
+def _normalize_query(query):
+    return " ".join(query.casefold().split())
+
+class SearchCache:
+    """
+    Keeps parsed search results in the database for ttl seconds, keyed by
+    backend and query (compared case-insensitively, whitespace collapsed),
+    so every user searching the same keyword shares one search.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        get_connection().executescript(SCHEMA)
+
+    @staticmethod
+    def _key(backend, query):
+        return f"{backend}|{_normalize_query(query)}"
+
+    def get(self, backend, query):
+        """Returns the cached results for the query, or None if there are none that are fresh."""
+        if self.ttl <= 0:
+            return None
+        row = get_connection().execute("SELECT results FROM search_cache WHERE key = ? AND created > ?",
+                                       (self._key(backend, query), time.time() - self.ttl)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, backend, query, results):
+        if self.ttl <= 0:
+            return
+        now = time.time()
+        with transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO search_cache (key, results, created) VALUES (?, ?, ?)",
+                         (self._key(backend, query), json.dumps(results, ensure_ascii=False), now))
+            conn.execute("DELETE FROM search_cache WHERE created <= ?", (now - self.ttl,))
+
+# Created on first use, so importing this module does not open the database.
+_cache = None
+_lock = threading.Lock()
+
+def _get_cache():
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = SearchCache(config.SEARCH_CACHE_TTL)
+        return _cache
+
+def search(query, backend=None):
+    """
+    Searches the web for query with the named backend (SEARCH_BACKEND by
+    default) and returns up to SEARCH_MAX_RESULTS results, from the cache
+    when they are fresh. Network and HTTP errors are raised to the caller.
+    """
+    backend = get_backend(backend)
+    cache = _get_cache()
+    results = cache.get(backend.name, query)
+    if results is not None:
+        SEARCHES.inc(backend=backend.name, source='cache')
+        return results
+
+    SEARCHES.inc(backend=backend.name, source='fetch')
+    with span('search'), fetch_deadline(time.monotonic() + config.PAGE_TIMEOUT):
+        _, text = fetch_text(backend.search_url(query))
+        results = parse_results(backend, text)
+    # An empty list is more likely a captcha or changed markup than a real answer, so it is not kept.
+    if results:
+        cache.put(backend.name, query, results)
+    return results
+
+def scrape_search(keyword, archive, only=None, fmt='json'):
+    """
+    Scrapes a search keyword into archive: the manifest lists the search
+    results, and with SEARCH_FAN_OUT > 0 the pages of that many top results
+    are scraped concurrently into numbered folders, as crawler.crawl() does
+    for a batch. Finishes and returns the archive. Network errors of the
+    search itself are raised to the caller.
+    """
+    backend = get_backend()
+    results = search(keyword, backend.name)
+    manifest = {
+        'source': keyword,
+        'url': backend.search_url(keyword),
+        'extractors': ['search'],
+        'data': {'search': results},
+        'downloads': [],
+    }
+    archive.writestr(*render_manifest(manifest, fmt))
+    if not results:
+        archive.writestr("error.txt", f"The search for '{keyword}' found no results.")
+    if not results or config.SEARCH_FAN_OUT <= 0:
+        with span('zip'):
+            return archive.finish()
+    return crawl([result['url'] for result in results[:config.SEARCH_FAN_OUT]], only=only, fmt=fmt,
+                 archive=archive)
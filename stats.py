@@ -0,0 +1,175 @@
+import time
+
+from db import get_connection, transaction
+
+# counters holds running totals. series holds ring buffers: for every name
+# and resolution there are at most `slots` rows, each covering one bucket of
+# time, and a slot is reused (reset) once its bucket is older than the ring.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS series (
+    name TEXT NOT NULL,
+    resolution INTEGER NOT NULL,
+    slot INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, resolution, slot)
+);
+"""
+
+# Ring buffers kept for every series: (bucket length in seconds, number of buckets).
+# A window uses the hourly buckets if the ring still holds every bucket it
+# overlaps; the extra daily bucket lets a 30-day window reach back a full 30 days.
+HOURLY = (3600, 48)
+DAILY = (86400, 31)
+RESOLUTIONS = (HOURLY, DAILY)
+
+# Upper bounds (in seconds) of the scrape latency histogram buckets; the last
+# bucket takes everything slower.
+LATENCY_BUCKETS = (0.5, 1, 2, 4, 8, 15, 30, 60, 120, 300, float('inf'))
+
+# The share of a bucket that falls inside a window starting at :since. The
+# oldest bucket a window overlaps is only partly inside it, so it is counted
+# in proportion; the current bucket is still filling and counts whole.
+_OVERLAP = "MIN(1.0, (start + resolution - :since) * 1.0 / resolution)"
+
+def latency_label(bound):
+    """Describes a latency bucket for display, e.g. "≤2s", or "> 300s" for the last one."""
+    if bound == LATENCY_BUCKETS[-1]:
+        return f"> {LATENCY_BUCKETS[-2]:g}s"
+    return f"≤{bound:g}s"
+
+def _slot_sql(length, slots, now_sql):
+    # Adds to the current bucket's slot, or resets the slot if it still holds an older bucket.
+    return f"""
+    INSERT INTO series (name, resolution, slot, start, value)
+    VALUES (:name, {length}, ({now_sql} / {length}) % {slots}, {now_sql} / {length} * {length}, :amount)
+    ON CONFLICT (name, resolution, slot) DO UPDATE SET
+        value = CASE WHEN start = excluded.start THEN value + excluded.value ELSE excluded.value END,
+        start = excluded.start;
+    """
+
+# The user counters are kept by triggers on the users table, so every change
+# (from any process, including migrate_json) is counted in the same transaction.
+_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+USER_TRIGGERS = f"""
+CREATE TRIGGER users_stats_insert AFTER INSERT ON users BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'users';
+    UPDATE counters SET value = value + NEW.uses WHERE name = 'uses_remaining';
+    UPDATE counters SET value = value + NEW.banned WHERE name = 'users_banned';
+    UPDATE counters SET value = value + NEW.active WHERE name = 'users_active';
+    {_slot_sql(*HOURLY, _NOW).replace(':name', "'new_users'").replace(':amount', '1')}
+    {_slot_sql(*DAILY, _NOW).replace(':name', "'new_users'").replace(':amount', '1')}
+END;
+CREATE TRIGGER users_stats_uses AFTER UPDATE OF uses ON users BEGIN
+    UPDATE counters SET value = value + NEW.uses - OLD.uses WHERE name = 'uses_remaining';
+END;
+CREATE TRIGGER users_stats_banned AFTER UPDATE OF banned ON users BEGIN
+    UPDATE counters SET value = value + NEW.banned - OLD.banned WHERE name = 'users_banned';
+END;
+CREATE TRIGGER users_stats_active AFTER UPDATE OF active ON users BEGIN
+    UPDATE counters SET value = value + NEW.active - OLD.active WHERE name = 'users_active';
+END;
+CREATE TRIGGER users_stats_delete AFTER DELETE ON users BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'users';
+    UPDATE counters SET value = value - OLD.uses WHERE name = 'uses_remaining';
+    UPDATE counters SET value = value - OLD.banned WHERE name = 'users_banned';
+    UPDATE counters SET value = value - OLD.active WHERE name = 'users_active';
+END;
+"""
+
+class StatsStore:
+    """
+    Usage statistics maintained incrementally, so reading them never scans
+    users or jobs: running totals in counters, and hourly (48 hours) and
+    daily (31 days) ring buffers in series. Scrape latency is kept as a
+    fixed histogram, from which percentiles are estimated.
+
+    Needs the users table, so create it after UserStore.
+    """
+
+    def __init__(self):
+        conn = get_connection()
+        conn.executescript(SCHEMA)
+        with transaction() as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'users_stats_insert'").fetchone()
+            if not exists:
+                # One scan when the triggers are installed; they keep the counters from here on.
+                row = conn.execute("SELECT COUNT(*), COALESCE(SUM(uses), 0), COALESCE(SUM(banned), 0), "
+                                   "COALESCE(SUM(active), 0) FROM users").fetchone()
+                for name, value in zip(('users', 'uses_remaining', 'users_banned', 'users_active'), row):
+                    conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)", (name, value))
+                for statement in USER_TRIGGERS.split("END;")[:-1]:
+                    conn.execute(statement + "END;")
+
+    def record(self, amounts, now=None):
+        """Adds {name: amount} to the totals and to the current hourly and daily buckets."""
+        now = int(time.time() if now is None else now)
+        with transaction() as conn:
+            for name, amount in amounts.items():
+                conn.execute("INSERT INTO counters (name, value) VALUES (?, ?) "
+                             "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value", (name, amount))
+                for length, slots in RESOLUTIONS:
+                    conn.execute(_slot_sql(length, slots, ':now'), {'name': name, 'amount': amount, 'now': now})
+
+    def record_scrape(self, seconds, ok, cache_hit=None, downloaded=0, failure=None):
+        """Records one finished scrape job: its latency, outcome, cache use and bytes downloaded."""
+        amounts = {'scrapes': 1, 'downloaded_bytes': downloaded}
+        if not ok:
+            amounts['scrapes_failed'] = 1
+            amounts[f"failure:{failure or 'unknown'}"] = 1
+        if cache_hit is not None:
+            amounts['cache_hits' if cache_hit else 'cache_misses'] = 1
+        bucket = next(bound for bound in LATENCY_BUCKETS if seconds <= bound)
+        amounts[f"latency_le:{bucket}"] = 1
+        self.record(amounts)
+
+    def total(self, name):
+        row = get_connection().execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def recent(self, name, seconds, now=None):
+        """
+        Returns the sum of name over the sliding window of the last seconds,
+        from the hourly (up to 47 hours) or daily buckets.
+        """
+        now = time.time() if now is None else now
+        length = HOURLY[0] if seconds <= HOURLY[0] * (HOURLY[1] - 1) else DAILY[0]
+        return get_connection().execute(
+            f"SELECT COALESCE(SUM(value * {_OVERLAP}), 0) FROM series "
+            "WHERE name = :name AND resolution = :length AND start > :since - resolution",
+            {'name': name, 'length': length, 'since': now - seconds}).fetchone()[0]
+
+    def recent_by_prefix(self, prefix, seconds, now=None):
+        """
+        Returns {name without prefix: sum over the last seconds} for every
+        hourly series starting with prefix, like recent().
+        """
+        now = time.time() if now is None else now
+        rows = get_connection().execute(
+            f"SELECT name, SUM(value * {_OVERLAP}) FROM series "
+            "WHERE name >= :prefix AND name < :end AND resolution = :length AND start > :since - resolution "
+            "GROUP BY name",
+            {'prefix': prefix, 'end': prefix + '\uffff', 'length': HOURLY[0], 'since': now - seconds}).fetchall()
+        return {row[0][len(prefix):]: row[1] for row in rows if row[1]}
+
+    def latency_percentile(self, q, seconds=86400):
+        """
+        Estimates the q-th percentile (0-100) of scrape latency over the last
+        seconds as the upper bound of the histogram bucket it falls in.
+        Returns None if there were no scrapes.
+        """
+        counts = self.recent_by_prefix('latency_le:', seconds)
+        total = sum(counts.values())
+        if not total:
+            return None
+        seen = 0
+        for bound in LATENCY_BUCKETS:
+            seen += counts.get(str(bound), 0)
+            if seen >= total * q / 100:
+                return bound
+        return LATENCY_BUCKETS[-1]
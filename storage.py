@@ -0,0 +1,170 @@
+import json
+import os
+import time
+
+from db import get_connection, transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    uses INTEGER NOT NULL,
+    banned INTEGER NOT NULL DEFAULT 0,
+    active INTEGER NOT NULL DEFAULT 1
+);
+"""
+
+# Number of free uses given to a new user.
+FREE_USES = 2
+
+class UserStore:
+    """
+    Per-user records (remaining uses, ban status, whether the bot can still
+    reach them) stored in SQLite.
+
+    Every method touches only the rows it needs, so the cost of a request does
+    not grow with the number of users, and each update is atomic even when
+    several handler threads or worker processes act on the same user.
+    """
+
+    def __init__(self):
+        get_connection().executescript(SCHEMA)
+        # Databases created before the active column existed get it added once.
+        with transaction() as conn:
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(users)")}
+            if 'active' not in columns:
+                conn.execute("ALTER TABLE users ADD COLUMN active INTEGER NOT NULL DEFAULT 1")
+
+    def get(self, uid):
+        """Returns the user's record as a dict, or None if the user is unknown."""
+        row = get_connection().execute("SELECT uses, banned, active FROM users WHERE user_id = ?", (uid,)).fetchone()
+        if row is None:
+            return None
+        return {'uses': row['uses'], 'banned': bool(row['banned']), 'active': bool(row['active'])}
+
+    def get_or_create(self, uid):
+        """
+        Returns the user's record, registering new users with the free uses.
+        A user marked inactive is active again, since they just messaged the bot.
+        """
+        get_connection().execute("INSERT OR IGNORE INTO users (user_id, uses) VALUES (?, ?)", (uid, FREE_USES))
+        user = self.get(uid)
+        if not user['active']:
+            self.set_active(uid, True)
+            user['active'] = True
+        return user
+
+    def try_use(self, uid):
+        """
+        Spends one use if the user has any left and is not banned.
+        Returns the number of uses left afterwards, or None if nothing was spent.
+        The check and the decrement are a single UPDATE, so a use can never be
+        spent twice by concurrent requests.
+        """
+        with transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE users SET uses = uses - 1 WHERE user_id = ? AND uses > 0 AND banned = 0", (uid,))
+            if cursor.rowcount == 0:
+                return None
+            return conn.execute("SELECT uses FROM users WHERE user_id = ?", (uid,)).fetchone()[0]
+
+    def refund(self, uid):
+        """Gives back a use that was spent on a scrape that did not succeed."""
+        get_connection().execute("UPDATE users SET uses = uses + 1 WHERE user_id = ?", (uid,))
+
+    def grant(self, uid, uses):
+        """Adds uses to a user (registering them with 0 uses if new) and returns the new total."""
+        with transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO users (user_id, uses) VALUES (?, 0)", (uid,))
+            conn.execute("UPDATE users SET uses = uses + ? WHERE user_id = ?", (uses, uid))
+            return conn.execute("SELECT uses FROM users WHERE user_id = ?", (uid,)).fetchone()[0]
+
+    def set_banned(self, uid, banned, create=False):
+        """
+        Sets the user's ban status and returns True if the user exists.
+        With create=True an unknown user is registered with 0 uses first.
+        """
+        with transaction() as conn:
+            if create:
+                conn.execute("INSERT OR IGNORE INTO users (user_id, uses) VALUES (?, 0)", (uid,))
+            cursor = conn.execute("UPDATE users SET banned = ? WHERE user_id = ?", (int(banned), uid))
+            return cursor.rowcount > 0
+
+    def set_active(self, uid, active):
+        """Marks whether messages can be delivered to the user (False once they block the bot)."""
+        get_connection().execute("UPDATE users SET active = ? WHERE user_id = ?", (int(active), uid))
+
+    def active_ids(self, after=0, limit=100):
+        """Returns up to limit IDs of active users greater than after, in order, for paging through users."""
+        rows = get_connection().execute(
+            "SELECT user_id FROM users WHERE active = 1 AND user_id > ? ORDER BY user_id LIMIT ?",
+            (after, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def count_active(self, after=0):
+        """Returns the number of active users with an ID greater than after."""
+        return get_connection().execute(
+            "SELECT COUNT(*) FROM users WHERE active = 1 AND user_id > ?", (after,)).fetchone()[0]
+
+    def migrate_json(self, path):
+        """
+        One-time import of the old user_data.json file. Existing database rows
+        win over the file. The file is renamed afterwards so it is not imported again.
+        """
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, 'r') as f:
+                loaded_data = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Error decoding JSON from {path}. Skipping migration.")
+            return 0
+
+        with transaction() as conn:
+            for uid, data in loaded_data.items():
+                conn.execute("INSERT OR IGNORE INTO users (user_id, uses, banned) VALUES (?, ?, ?)",
+                             (int(uid), int(data.get('uses', 0)), int(bool(data.get('banned', False)))))
+        os.replace(path, path + '.migrated')
+        print(f"Migrated {len(loaded_data)} users from {path} to the database.")
+        return len(loaded_data)
+
+FILE_ID_SCHEMA = """
+CREATE TABLE IF NOT EXISTS telegram_files (
+    content_hash TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    source_key TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS telegram_files_source ON telegram_files (source_key);
+"""
+
+class FileIdStore:
+    """
+    Remembers the Telegram file_id of every uploaded archive, keyed by the
+    SHA-256 of its bytes, so the same content can be re-sent without uploading
+    it again. source_key (e.g. the result cache key) ties an upload to the
+    target it came from: remembering new content for the same target forgets
+    the old file_id.
+    """
+
+    def __init__(self):
+        get_connection().executescript(FILE_ID_SCHEMA)
+
+    def get(self, content_hash):
+        """Returns the file_id previously uploaded for this content, or None."""
+        row = get_connection().execute(
+            "SELECT file_id FROM telegram_files WHERE content_hash = ?", (content_hash,)).fetchone()
+        return row[0] if row else None
+
+    def remember(self, content_hash, file_id, source_key=None):
+        """Records the file_id Telegram returned for an upload."""
+        with transaction() as conn:
+            if source_key:
+                conn.execute("DELETE FROM telegram_files WHERE source_key = ? AND content_hash != ?",
+                             (source_key, content_hash))
+            conn.execute(
+                "INSERT OR REPLACE INTO telegram_files (content_hash, file_id, source_key, created) VALUES (?, ?, ?, ?)",
+                (content_hash, file_id, source_key, time.time()))
+
+    def forget(self, content_hash):
+        """Drops a file_id that Telegram no longer accepts."""
+        get_connection().execute("DELETE FROM telegram_files WHERE content_hash = ?", (content_hash,))
@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The modules read their settings from the environment when first imported,
+# and refuse to load without a bot token; nothing is sent to Telegram.
+_workdir = tempfile.mkdtemp(prefix='scrapnest-tests-')
+os.environ.setdefault("BOT_TOKEN", "123456:tests")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("DB_PATH", os.path.join(_workdir, 'tests.db'))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Points this thread's stores at an empty database of their own."""
+    import config
+    import db
+    monkeypatch.setattr(config, 'DB_PATH', str(tmp_path / 'tests.db'))
+    monkeypatch.setattr(db._local, 'conn', None, raising=False)
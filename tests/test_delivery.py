@@ -0,0 +1,97 @@
+# Splits archives and sends results to a stub bot, so nothing reaches Telegram.
+import os
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from delivery import DeliveryError, split_archive, _stale_file_id
+from utils import send_zip
+
+def telegram_error(error_code, description):
+    return ApiTelegramException('sendDocument', None, {'error_code': error_code, 'description': description})
+
+class StubBot:
+    """Records the documents and messages sent; send_document raises error if one is given."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.documents = []
+        self.messages = []
+
+    def send_document(self, chat_id, document, **kwargs):
+        if self.error:
+            raise self.error
+        self.documents.append(kwargs.get('visible_file_name'))
+        return SimpleNamespace(document=SimpleNamespace(file_id=f"file-{len(self.documents)}"))
+
+    def send_message(self, chat_id, text):
+        self.messages.append(text)
+
+@pytest.fixture
+def result_zip(tmp_path):
+    path = os.path.join(tmp_path, 'example.com.zip')
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('data.json', '{}')
+    return path
+
+def test_send_zip_raises_when_delivery_fails(result_zip):
+    bot = StubBot(telegram_error(400, "Bad Request: chat not found"))
+    with pytest.raises(DeliveryError, match="Your data could not be sent: .*chat not found"):
+        send_zip(bot, 1, result_zip)
+    # The failure is reported with the job's outcome, not as a success here.
+    assert bot.messages == []
+
+def test_send_zip_reports_success(result_zip):
+    bot = StubBot()
+    send_zip(bot, 1, result_zip, filename='example.com.zip')
+    assert bot.documents == ['example.com.zip']
+    assert bot.messages == ["📤 Your scraped data has been sent as a zip file!"]
+
+def test_split_archive_parts_are_standalone_zips(tmp_path):
+    # Stored members, so their sizes in the zip are known in advance.
+    source = tmp_path / 'big.zip'
+    members = {f"media/file{i:02}.bin": os.urandom(30_000) for i in range(20)}
+    with zipfile.ZipFile(source, 'w', zipfile.ZIP_STORED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+    part_bytes = 100_000
+    with open(source, 'rb') as f:
+        pieces = split_archive(f, part_bytes)
+    try:
+        assert len(pieces) > 1
+        extracted = {}
+        for piece in pieces:
+            piece.seek(0, os.SEEK_END)
+            assert piece.tell() <= part_bytes
+            piece.seek(0)
+            with zipfile.ZipFile(piece) as part:
+                assert part.testzip() is None
+                extracted.update((name, part.read(name)) for name in part.namelist())
+        assert list(extracted) == list(members)
+        assert extracted == members
+    finally:
+        for piece in pieces:
+            piece.close()
+
+@pytest.mark.parametrize('description', [
+    "Bad Request: wrong file identifier/HTTP URL specified",
+    "Bad Request: wrong remote file identifier specified: Wrong string length",
+    "Bad Request: FILE_REFERENCE_EXPIRED",
+    "Bad Request: invalid file_id",
+])
+def test_stale_file_id_errors(description):
+    assert _stale_file_id(telegram_error(400, description))
+
+@pytest.mark.parametrize('error', [
+    telegram_error(400, "Bad Request: chat not found"),
+    telegram_error(400, "Bad Request: message caption is too long"),
+    telegram_error(403, "Forbidden: bot was blocked by the user"),
+    telegram_error(404, "Not Found: wrong file identifier"),
+    telegram_error(429, "Too Many Requests: retry after 5"),
+    ConnectionError("wrong file identifier"),
+])
+def test_other_errors_are_not_stale_file_ids(error):
+    assert not _stale_file_id(error)
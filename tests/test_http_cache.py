@@ -0,0 +1,110 @@
+# Fetches pages from a local HTTP server through an HttpCache of its own.
+import asyncio
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import config
+from db import get_connection
+from fetcher import create_session
+from http_cache import HttpCache
+
+PAGE = b"<html><head><title>Cached</title></head><body>" + b"x" * 200_000 + b"</body></html>"
+
+class Server:
+    """Serves PAGE with an ETag and max-age=60, answering 304 to a matching If-None-Match."""
+
+    def __init__(self):
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests.append(self.headers.get('If-None-Match'))
+                if self.headers.get('If-None-Match') == '"v1"':
+                    self.send_response(304)
+                    self.send_header('ETag', '"v1"')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(PAGE)))
+                self.send_header('ETag', '"v1"')
+                self.send_header('Cache-Control', 'max-age=60')
+                self.end_headers()
+                self.wfile.write(PAGE)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/page.html"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+@pytest.fixture
+def server():
+    server = Server()
+    yield server
+    server.httpd.shutdown()
+
+@pytest.fixture
+def cache(database, tmp_path):
+    return HttpCache(str(tmp_path / 'http_cache'), 10 * 1024 * 1024)
+
+async def read(response, limit=None):
+    """Reads the response (only its first limit bytes, if given) and leaves it."""
+    body = b''
+    async with response:
+        async for chunk in response.iter_chunks():
+            body += chunk
+            if limit is not None and len(body) >= limit:
+                break
+    return body
+
+def fetch_all(cache, url, *limits):
+    """
+    Fetches url once per limit, reading at most that many bytes (None for
+    all), and returns the responses with their bodies.
+    """
+    async def run():
+        session = create_session()
+        results = []
+        try:
+            for limit in limits:
+                response = await cache.get(session, url)
+                results.append((response, await read(response, limit)))
+                await cache.wait_background()
+        finally:
+            await session.close()
+        return results
+    return asyncio.run(run())
+
+def expire_all():
+    get_connection().execute("UPDATE http_cache SET expires = 0")
+
+def test_fresh_hit_then_revalidation(cache, server):
+    (first, body), (second, cached_body) = fetch_all(cache, server.url, None, None)
+    assert not first.from_cache and body == PAGE
+    assert second.from_cache and not second.revalidated and cached_body == PAGE
+    assert server.requests == [None]
+
+    expire_all()
+    [(third, revalidated_body)] = fetch_all(cache, server.url, None)
+    assert third.from_cache and third.revalidated and revalidated_body == PAGE
+    assert server.requests == [None, '"v1"']
+
+def test_page_read_partly_is_still_cached(cache, server):
+    [(first, body)] = fetch_all(cache, server.url, 1000)
+    assert len(body) < len(PAGE)
+    [(second, cached_body)] = fetch_all(cache, server.url, None)
+    assert second.from_cache and cached_body == PAGE
+    assert server.requests == [None]
+
+def test_page_over_entry_limit_is_not_cached(cache, server, monkeypatch):
+    monkeypatch.setattr(config, 'HTTP_CACHE_MAX_ENTRY_BYTES', 100_000)
+    fetch_all(cache, server.url, 1000)
+    fetch_all(cache, server.url, None)
+    assert server.requests == [None, None]
+    assert os.listdir(cache.directory) == []
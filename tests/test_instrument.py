@@ -0,0 +1,27 @@
+# Checks the metrics served by processes without the keep-alive server.
+import urllib.error
+import urllib.request
+
+import pytest
+
+from instrument import serve_metrics, span
+
+@pytest.fixture
+def metrics_url():
+    server = serve_metrics(0)
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def test_serve_metrics_exports_stage_timings(metrics_url):
+    with span('test-stage'):
+        pass
+    with urllib.request.urlopen(metrics_url + "/metrics") as response:
+        assert response.headers['Content-Type'].startswith('text/plain')
+        text = response.read().decode('utf-8')
+    assert 'scrapnest_stage_duration_seconds_count{stage="test-stage"} 1' in text
+
+def test_serve_metrics_only_serves_metrics(metrics_url):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(metrics_url + "/other")
+    assert error.value.code == 404
@@ -0,0 +1,46 @@
+# Runs the job queue against an empty database per test.
+import pytest
+
+from db import get_connection
+from job_queue import JobStore
+
+pytestmark = pytest.mark.usefixtures('database')
+
+def status(job_id):
+    return get_connection().execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+def test_expired_lease_is_reclaimed():
+    # A negative lease has expired as soon as it is taken.
+    store = JobStore(lease_seconds=-1)
+    store.enqueue(1, 1, {'keyword': 'example'})
+    first = store.claim('worker-a')
+    second = store.claim('worker-b')
+    assert second['id'] == first['id']
+    assert (first['attempts'], second['attempts']) == (1, 2)
+
+    # The worker that lost the lease can no longer finish the job.
+    store.complete(first['id'], 'worker-a')
+    assert status(first['id']) == 'running'
+    store.fail(first['id'], 'worker-a', "too late")
+    assert status(first['id']) == 'running'
+    store.complete(second['id'], 'worker-b')
+    assert [(job['id'], job['status']) for job in store.finished()] == [(first['id'], 'done')]
+
+def test_renewed_lease_is_kept():
+    JobStore(lease_seconds=-1).enqueue(1, 1, {'keyword': 'example'})
+    job = JobStore(lease_seconds=-1).claim('worker-a')
+    JobStore(lease_seconds=60).renew(job['id'], 'worker-a')
+    assert JobStore().claim('worker-b') is None
+    # Only the owner's renewals count.
+    store = JobStore(lease_seconds=-1)
+    store.renew(job['id'], 'worker-b')
+    assert store.claim('worker-b') is None
+
+def test_job_fails_after_max_attempts():
+    store = JobStore(lease_seconds=-1, max_attempts=2)
+    store.enqueue(1, 1, {'keyword': 'example'})
+    job = store.claim('worker-a')
+    assert store.claim('worker-b')['attempts'] == 2
+    assert store.claim('worker-c') is None
+    [failed] = store.finished()
+    assert (failed['id'], failed['status'], failed['error']) == (job['id'], 'failed', 'Worker crashed repeatedly.')
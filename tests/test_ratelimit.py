@@ -0,0 +1,102 @@
+# Drives the rate limiters with a fake clock, so nothing sleeps.
+import time
+
+import pytest
+
+from ratelimit import TokenBucket, HostThrottle, CircuitBreaker, parse_retry_after
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'monotonic', clock)
+    return clock
+
+def test_bucket_refills_at_its_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.wait_time() == pytest.approx(0.5)
+    clock.advance(0.5)
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    # An idle bucket fills up to its capacity and no further.
+    clock.advance(60)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+def test_refund_gives_tokens_back_up_to_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=2)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    bucket.refund()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    bucket.refund(5)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+def test_observe_pauses_host_for_retry_after(clock):
+    throttle = HostThrottle(rate=100)
+    assert throttle.observe('example.com', 429, '7') == 7
+    assert throttle.limiter.wait_time('example.com') == pytest.approx(7)
+    assert throttle.limiter.wait_time('other.com') == 0
+    # Answers to requests sent before the pause do not extend it.
+    assert throttle.observe('example.com', 503, '30') == 0
+    # The host's bucket then refills from empty.
+    clock.advance(7)
+    assert throttle.limiter.wait_time('example.com') == pytest.approx(0.01)
+    clock.advance(0.02)
+    assert throttle.limiter.try_acquire('example.com')
+
+def test_observe_backs_off_without_retry_after(clock):
+    throttle = HostThrottle(rate=100, base_backoff=1, max_backoff=3)
+    assert throttle.observe('example.com', 503) == 1
+    clock.advance(1)
+    assert throttle.observe('example.com', 429, 'soon') == 2
+    clock.advance(2)
+    assert throttle.observe('example.com', 429) == 3
+    clock.advance(3)
+    # A successful answer resets the backoff.
+    assert throttle.observe('example.com', 200) == 0
+    assert throttle.observe('example.com', 429) == 1
+
+def test_parse_retry_after_date():
+    now = 784111777.0 # Sun, 06 Nov 1994 08:49:37 GMT
+    assert parse_retry_after("Sun, 06 Nov 1994 08:50:07 GMT", now) == 30
+    assert parse_retry_after("Sun, 06 Nov 1994 08:49:00 GMT", now) == 0
+    assert parse_retry_after("", now) is None
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker(failures=3, cooldown=10)
+    breaker.failure('example.com')
+    breaker.failure('example.com')
+    assert breaker.retry_in('example.com') == 0
+    breaker.failure('example.com')
+    assert breaker.retry_in('example.com') == pytest.approx(10)
+    assert breaker.retry_in('other.com') == 0
+
+    # After the cooldown one trial request goes through; a failure reopens the breaker.
+    clock.advance(10)
+    assert breaker.retry_in('example.com') == 0
+    assert breaker.retry_in('example.com') == pytest.approx(10)
+    breaker.failure('example.com')
+    clock.advance(5)
+    assert breaker.retry_in('example.com') == pytest.approx(5)
+
+    # A successful trial closes it.
+    clock.advance(5)
+    assert breaker.retry_in('example.com') == 0
+    breaker.success('example.com')
+    assert breaker.retry_in('example.com') == 0
+    assert breaker.retry_in('example.com') == 0
+    breaker.failure('example.com')
+    assert breaker.retry_in('example.com') == 0
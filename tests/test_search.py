@@ -0,0 +1,112 @@
+# Parses saved result pages of every search backend (tests/fixtures/search),
+# with both HTML parsers, and checks the search cache. Needs no network.
+import os
+
+import pytest
+
+import config
+import search
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'search')
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+@pytest.fixture(params=['lxml', 'html.parser'])
+def html_parser(request, monkeypatch):
+    if request.param == 'lxml':
+        pytest.importorskip('lxml')
+    monkeypatch.setattr(config, 'HTML_PARSER', request.param)
+    return request.param
+
+def test_duckduckgo_results(html_parser):
+    results = search.parse_results(search.get_backend('duckduckgo'), fixture('duckduckgo.html'))
+    assert results == [
+        {'title': "The Python Tutorial — Python 3.12 documentation",
+         'url': "https://docs.python.org/3/tutorial/",
+         'snippet': "Python is an easy to learn, powerful programming language. "
+                    "It has efficient high-level data structures."},
+        {'title': "Python Tutorial - W3Schools",
+         'url': "https://www.w3schools.com/python/",
+         'snippet': "Well organized and easy to understand Web building tutorials with lots of examples."},
+        {'title': "Real Python Tutorials",
+         'url': "https://realpython.com/",
+         'snippet': "Learn Python online: tutorials for developers of all skill levels."},
+    ]
+
+def test_duckduckgo_skips_ads(html_parser):
+    results = search.parse_results(search.get_backend('duckduckgo'), fixture('duckduckgo.html'))
+    assert not any('duckduckgo.com' in result['url'] or 'Course' in result['title'] for result in results)
+
+def test_bing_results(html_parser):
+    results = search.parse_results(search.get_backend('bing'), fixture('bing.html'))
+    assert [(result['title'], result['url']) for result in results] == [
+        ("The Python Tutorial — Python 3.12 documentation", "https://docs.python.org/3/tutorial/"),
+        ("Python Tutorial - W3Schools", "https://www.w3schools.com/python/"),
+        ("Welcome to Python.org", "https://www.python.org/"),
+    ]
+    assert results[0]['snippet'] == ("Mar 5, 2024 · Python is an easy to learn, powerful programming language. "
+                                     "It has efficient high-level data structures.")
+
+@pytest.mark.parametrize('href, target', [
+    ("https://www.bing.com/ck/a?!&&p=ee4f&u=a1aHR0cHM6Ly93d3cucHl0aG9uLm9yZy8&ntb=1", "https://www.python.org/"),
+    ("https://www.w3schools.com/python/", "https://www.w3schools.com/python/"),
+])
+def test_bing_unwraps_tracking_links(href, target):
+    assert search.BingBackend._target(href) == target
+
+def test_google_results(html_parser):
+    results = search.parse_results(search.get_backend('google'), fixture('google.html'))
+    assert results == [
+        {'title': "The Python Tutorial — Python 3.12 documentation",
+         'url': "https://docs.python.org/3/tutorial/",
+         'snippet': "Python is an easy to learn, powerful programming language. "
+                    "It has efficient high-level data structures."},
+        {'title': "Python Tutorial - W3Schools",
+         'url': "https://www.w3schools.com/python/",
+         'snippet': "Well organized and easy to understand Web building tutorials with lots of examples."},
+        {'title': "Welcome to Python.org",
+         'url': "https://www.python.org/",
+         'snippet': "The official home of the Python Programming Language."},
+    ]
+
+def test_results_are_limited(html_parser):
+    results = search.parse_results(search.get_backend('google'), fixture('google.html'), limit=2)
+    assert [result['url'] for result in results] == ["https://docs.python.org/3/tutorial/",
+                                                     "https://www.w3schools.com/python/"]
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        search.get_backend('altavista')
+
+RESULTS = [{'title': "Welcome to Python.org", 'url': "https://www.python.org/", 'snippet': ""}]
+
+def test_cache_keeps_results_for_ttl(monkeypatch):
+    cache = search.SearchCache(ttl=60)
+    now = 1_000_000.0
+    monkeypatch.setattr(search.time, 'time', lambda: now)
+    cache.put('duckduckgo', "Python  Tutorial", RESULTS)
+
+    # The query is compared case-insensitively, with whitespace collapsed.
+    assert cache.get('duckduckgo', "python tutorial") == RESULTS
+    assert cache.get('bing', "python tutorial") is None
+    now += 59
+    assert cache.get('duckduckgo', "python tutorial") == RESULTS
+    now += 2
+    assert cache.get('duckduckgo', "python tutorial") is None
+
+def test_cache_disabled_with_zero_ttl():
+    cache = search.SearchCache(ttl=0)
+    cache.put('duckduckgo', "python", RESULTS)
+    assert cache.get('duckduckgo', "python") is None
+
+def test_search_answers_from_cache(monkeypatch):
+    cache = search.SearchCache(ttl=60)
+    monkeypatch.setattr(search, '_cache', cache)
+    cache.put('duckduckgo', "cached query", RESULTS)
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("a cached search must not fetch")
+    monkeypatch.setattr(search, 'fetch_text', no_network)
+    assert search.search("Cached Query", 'duckduckgo') == RESULTS
@@ -0,0 +1,24 @@
+# Runs the user store against an empty database per test.
+import pytest
+
+from storage import UserStore
+
+pytestmark = pytest.mark.usefixtures('database')
+
+def test_try_use_spends_one_use():
+    users = UserStore()
+    assert users.get_or_create(1)['uses'] == 2
+    assert users.try_use(1) == 1
+    assert users.try_use(1) == 0
+    assert users.try_use(1) is None
+    assert users.get(1)['uses'] == 0
+    users.refund(1)
+    assert users.try_use(1) == 0
+
+def test_try_use_refuses_banned_and_unknown_users():
+    users = UserStore()
+    users.get_or_create(1)
+    users.set_banned(1, True)
+    assert users.try_use(1) is None
+    assert users.get(1)['uses'] == 2
+    assert users.try_use(2) is None
@@ -0,0 +1,41 @@
+# Posts updates made by fake_telegram.py to the webhook route through Flask's
+# test client; the handler only records them.
+import pytest
+
+import config
+import keep_alive
+from fake_telegram import make_update
+
+@pytest.fixture
+def received(monkeypatch):
+    updates = []
+    monkeypatch.setattr(keep_alive, '_update_handler', updates.extend)
+    return updates
+
+@pytest.fixture
+def client():
+    return keep_alive.app.test_client()
+
+def post(client, path, secret):
+    headers = {} if secret is None else {'X-Telegram-Bot-Api-Secret-Token': secret}
+    return client.post(path, data=make_update(7, 42, "/start"), content_type='application/json', headers=headers)
+
+def test_update_with_secret_is_dispatched(client, received):
+    response = post(client, config.WEBHOOK_PATH, config.WEBHOOK_SECRET)
+    assert response.status_code == 200
+    assert [update.update_id for update in received] == [7]
+    assert received[0].message.text == "/start"
+    assert received[0].message.from_user.id == 42
+
+@pytest.mark.parametrize('secret', [None, '', 'wrong-secret'])
+def test_update_without_secret_is_refused(client, received, secret):
+    assert post(client, config.WEBHOOK_PATH, secret).status_code == 403
+    assert received == []
+
+def test_other_path_is_not_found(client, received):
+    assert post(client, config.WEBHOOK_PATH + '-other', config.WEBHOOK_SECRET).status_code == 404
+    assert received == []
+
+def test_webhook_disabled_is_not_found(client, monkeypatch):
+    monkeypatch.setattr(keep_alive, '_update_handler', None)
+    assert post(client, config.WEBHOOK_PATH, config.WEBHOOK_SECRET).status_code == 404
@@ -0,0 +1,52 @@
+# Standalone scrape worker. Run it next to bot.py on the same machine (they
+# share the SQLite job store at DB_PATH), for example:
+#     SCRAPE_WORKERS=0 python bot.py & python worker.py --processes 3
+import argparse
+import multiprocessing
+import signal
+
+import telebot
+
+import config
+from job_queue import open_job_store, WorkerPool
+from instrument import serve_metrics
+from pipeline import run_scrape_job
+
+def run_worker(threads, metrics_port=0):
+    """
+    Claims and runs scrape jobs from the shared job store until stopped,
+    serving this process's metrics at metrics_port unless it is 0.
+    """
+    if metrics_port:
+        serve_metrics(metrics_port)
+    # Workers only send messages and files; updates are still polled by bot.py.
+    bot = telebot.TeleBot(config.BOT_TOKEN)
+    pool = WorkerPool(open_job_store(), lambda job: run_scrape_job(bot, job), workers=threads)
+
+    # On shutdown, stop claiming new jobs. A job cut off mid-way keeps its lease
+    # until it expires and is then retried by another worker.
+    signal.signal(signal.SIGTERM, lambda signum, frame: pool.stop())
+    pool.start()
+    print(f"Scrape worker started with {threads} thread(s).")
+    pool.join()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run ScrapNest scrape workers.")
+    parser.add_argument('--processes', type=int, default=config.WORKER_PROCESSES,
+                        help="Number of worker processes to start.")
+    parser.add_argument('--threads', type=int, default=max(config.SCRAPE_WORKERS, 1),
+                        help="Number of scrape threads per process.")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_worker(args.threads, config.METRICS_PORT)
+    else:
+        # One process per core lets parsing and zipping use more than one CPU.
+        # Each process has metrics of its own, served on consecutive ports.
+        processes = [multiprocessing.Process(target=run_worker, name=f"worker-{i+1}",
+                                             args=(args.threads, config.METRICS_PORT and config.METRICS_PORT + i))
+                     for i in range(args.processes)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
@@ -0,0 +1,18 @@
+# Entry point for running webhook mode behind a production WSGI server, e.g.
+#     WEBHOOK_URL=https://<your host> gunicorn --workers 1 --threads 8 wsgi:app
+# Use a single worker process: the scrape workers and the job reporter run
+# inside it. Scale scraping with worker.py or async_bot.py instead.
+import threading
+
+import config
+from bot import start_services, use_webhook, mark_ready, preload
+from keep_alive import app
+
+if not config.WEBHOOK_URL:
+    raise ValueError("WEBHOOK_URL must be set to serve the bot from a WSGI server.")
+
+start_services()
+use_webhook()
+mark_ready()
+if config.PRELOAD:
+    threading.Thread(target=preload, daemon=True).start()